@@ -0,0 +1,188 @@
+# batch_runner.py
+"""
+无界面的批量模式：把 JSONL 文件中的请求并发地交给 GeminiClient，不导入 customtkinter，可在服务器上运行。
+
+输入每行一个 JSON 对象：
+    {"prompt": "...", "history": [["You", "..."], ["Gemini", "..."]], "system_instruction": "...",
+     "model": "gemini-2.0-flash", "temperature": 0.7, "top_p": 0.9}
+除 prompt 外都可省略；history 也可以写成 [{"role": "user" | "model", "text": "..."}]。
+输出按完成顺序逐行写入，每行带原始行号 index；中断后用同样的参数再次运行会跳过已完成的行。
+
+用法：
+    python batch_runner.py prompts.jsonl -o results.jsonl -c 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from gemini_client import GeminiClient
+from message import Message, ROLE_MODEL
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+def _normalize_history(history):
+    """把输入中的历史统一成 GeminiClient 使用的 Message 列表"""
+    result = []
+    for item in history or []:
+        if isinstance(item, dict):
+            role = item.get("role") if item.get("role") in ("user", "model") else ROLE_MODEL
+            result.append(Message(role, item.get("text", "")))
+        else:
+            sender, message = item
+            result.append(Message.from_sender(sender, message))
+    return result
+
+
+def read_requests(path):
+    """逐行读取请求，产出 (index, 请求 dict 或解析错误)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for index, line in enumerate(f):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict) or "prompt" not in request:
+                    raise ValueError("缺少 prompt 字段")
+            except ValueError as e:
+                yield index, e
+                continue
+            yield index, request
+
+
+def load_finished(output_path, retry_errors=False):
+    """读取已有的输出文件，返回已完成的 index 集合（崩溃时写了一半的最后一行会被忽略）"""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if retry_errors and "error" in record:
+                continue
+            finished.add(record["index"])
+    return finished
+
+
+def _open_output(output_path):
+    """以追加方式打开输出文件；上次中断留下不完整的行时先补一个换行"""
+    needs_newline = False
+    if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
+        with open(output_path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+    out = open(output_path, "a", encoding="utf-8")
+    if needs_newline:
+        out.write("\n")
+    return out
+
+
+def run_request(client, index, request, defaults):
+    request_info = {}
+    model_name = request.get("model") or defaults["model"]
+    start = time.perf_counter()
+    record = {"index": index, "model": model_name}
+    if "id" in request:
+        record["id"] = request["id"]
+    try:
+        record["response"] = client.generate_response(
+            history=_normalize_history(request.get("history")),
+            new_prompt=request["prompt"],
+            temperature=request.get("temperature", defaults["temperature"]),
+            top_p=request.get("top_p", defaults["top_p"]),
+            request_info=request_info,
+            model_name=model_name,
+            system_instruction=request.get("system_instruction")
+        )
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["latency_ms"] = round((time.perf_counter() - start) * 1000, 1)
+    record["prompt_tokens"] = request_info.get("prompt_tokens")
+    record["output_tokens"] = request_info.get("output_tokens")
+    return record
+
+
+def run_batch(client, input_path, output_path, concurrency=4, defaults=None, retry_errors=False):
+    """
+    以最多 concurrency 个并发请求处理输入文件，结果按完成顺序追加写入 output_path。
+    同时在途的请求数有上限，输入文件不会整个读入内存。返回 (成功数, 失败数)。
+    """
+    defaults = dict({"model": client.model_name, "temperature": 0.7, "top_p": 0.9}, **(defaults or {}))
+    finished = load_finished(output_path, retry_errors)
+    if finished:
+        logger.info(f"从 {output_path} 恢复，跳过已完成的 {len(finished)} 条请求")
+    ok = failed = 0
+
+    def write(out, record):
+        nonlocal ok, failed
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        # 每条结果立即落盘，崩溃后最多丢失正在进行的请求
+        out.flush()
+        if "error" in record:
+            failed += 1
+        else:
+            ok += 1
+        done = ok + failed
+        if done % 50 == 0:
+            logger.info(f"已完成 {done} 条（失败 {failed}）")
+
+    with _open_output(output_path) as out, ThreadPoolExecutor(max_workers=concurrency,
+                                                              thread_name_prefix="batch") as pool:
+        pending = set()
+        for index, request in read_requests(input_path):
+            if index in finished:
+                continue
+            if isinstance(request, Exception):
+                write(out, {"index": index, "error": f"输入解析失败: {request}"})
+                continue
+            pending.add(pool.submit(run_request, client, index, request, defaults))
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(out, future.result())
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                write(out, future.result())
+    return ok, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="批量并发运行 JSONL 请求文件（无界面）")
+    parser.add_argument("input", help="输入 JSONL 文件")
+    parser.add_argument("-o", "--output", help="输出 JSONL 文件，默认为 <输入文件名>.out.jsonl")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="最大并发请求数，默认 4")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="请求未指定模型时使用的模型")
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--top-p", type=float, default=0.9)
+    parser.add_argument("--cache-dir", help="确定性回复（temperature=0）的磁盘缓存目录")
+    parser.add_argument("--retry-errors", action="store_true", help="恢复时重新运行上次失败的请求（同一 index 以最后一行为准）")
+    parser.add_argument("-v", "--verbose", action="store_true", help="输出每个请求的详细日志")
+    args = parser.parse_args(argv)
+
+    # 默认只输出批量进度，-v 时包括客户端的逐请求日志
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    logger.setLevel(logging.INFO)
+    output = args.output or os.path.splitext(args.input)[0] + ".out.jsonl"
+    client = GeminiClient(model_name=args.model, cache_dir=args.cache_dir)
+    ok, failed = run_batch(
+        client, args.input, output,
+        concurrency=max(1, args.concurrency),
+        defaults={"model": args.model, "temperature": args.temperature, "top_p": args.top_p},
+        retry_errors=args.retry_errors
+    )
+    print(f"完成：成功 {ok} 条，失败 {failed} 条，结果写入 {output}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+# benchmarks.py
+"""
+性能基准测试：使用 fake_gemini 的本地假后端，不联网、不消耗配额。
+
+用法：
+    python benchmarks.py                          # 运行全部基准，结果 JSON 输出到标准输出
+    python benchmarks.py --quick -o result.json   # 缩小规模，结果写入文件
+    python benchmarks.py --only store_throughput --baseline last_release.json
+传入 --baseline 时与上一次的结果比较，*_ms 变大或 *_per_sec 变小超过 --tolerance 视为回退，以状态码 1 退出。
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+import logging
+from collections import OrderedDict
+
+import gemini_client
+from fake_gemini import FakeGemini, FakeCacheBackend
+from gemini_client import GeminiClient
+from quota_scheduler import QuotaScheduler
+from chat_store import ChatStore
+from request_engine import RequestEngine
+from message import Message
+
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name):
+    def register(fn):
+        BENCHMARKS[name] = fn
+        return fn
+    return register
+
+
+def _timeit(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def _stats(samples):
+    ordered = sorted(samples)
+    return {
+        "first_ms": round(samples[0], 3),
+        "median_ms": round(statistics.median(ordered), 3),
+        "min_ms": round(ordered[0], 3),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(0.95 * (len(ordered) - 1) + 0.5))], 3),
+    }
+
+
+def _round(value):
+    return None if value is None else round(value, 3)
+
+
+def _fake_client(fake, **kwargs):
+    """使用假后端的客户端；配额调度不限流，只保留重试逻辑；默认不预热，避免后台调用干扰计时"""
+    kwargs.setdefault("prewarm", False)
+    kwargs.setdefault("keepalive", None)
+    client = GeminiClient(api_key="fake-key", context_cache_backend=FakeCacheBackend(fake), **kwargs)
+    client.scheduler = QuotaScheduler(limits={"": (10 ** 9, 10 ** 9)}, base_delay=0.05, max_delay=0.5)
+    return client
+
+
+def _make_chat(index, messages):
+    return {
+        "title": f"对话 {index}",
+        "prompt": "",
+        "messages": [
+            ["You" if i % 2 == 0 else "Gemini", f"第 {i} 条消息，message number {i} in chat {index}"]
+            for i in range(messages)
+        ],
+    }
+
+
+@benchmark("history_conversion")
+def bench_history_conversion(quick):
+    """generate_response 中历史转换 + token 预算裁剪的耗时（后端零延迟）"""
+    fake = FakeGemini(chunks=1)
+    previous = fake.install()
+    try:
+        client = _fake_client(fake)
+        # 只测历史转换，不走上下文缓存
+        client.context_cache.enabled = False
+        results = {}
+        for turns in (10, 1000, 10000):
+            # 与界面一致使用 Message 列表，token 数和请求格式在多次请求间复用
+            history = [Message.from_sender("You" if i % 2 == 0 else "Gemini", f"第 {i} 条消息 message number {i}")
+                       for i in range(turns)]
+            samples = _timeit(lambda: client.generate_response(history, "新的问题"), 5 if quick else 20)
+            results[f"turns_{turns}"] = _stats(samples)
+        return results
+    finally:
+        gemini_client._sdk = previous
+
+
+@benchmark("store_throughput")
+def bench_store_throughput(quick):
+    """大量历史的迁移（批量保存）、索引加载、逐条追加和检索"""
+    chat_count, message_count = (50, 40) if quick else (500, 100)
+    appends = 500 if quick else 5000
+    with tempfile.TemporaryDirectory() as tmp:
+        json_path = os.path.join(tmp, "chat_history.json")
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({str(uuid.uuid4()): _make_chat(i, message_count) for i in range(chat_count)}, f,
+                      ensure_ascii=False)
+        total_messages = chat_count * message_count
+        store = ChatStore(os.path.join(tmp, "chat_history.db"))
+        try:
+            start = time.perf_counter()
+            store.migrate_json(json_path)
+            migrate_s = time.perf_counter() - start
+
+            start = time.perf_counter()
+            index = store.load_index()
+            load_index_ms = (time.perf_counter() - start) * 1000
+
+            start = time.perf_counter()
+            for chat_id in index:
+                store.load_messages(chat_id)
+            load_messages_s = time.perf_counter() - start
+
+            chat_id = next(iter(index))
+            start = time.perf_counter()
+            for i in range(appends):
+                store.append_message(chat_id, "You", f"追加消息 appended {i}")
+            store.flush()
+            append_s = time.perf_counter() - start
+
+            search_samples = _timeit(lambda: store.search("message number 7"), 10)
+        finally:
+            store.close()
+    return {
+        "chats": chat_count,
+        "messages": total_messages,
+        "migrate_messages_per_sec": round(total_messages / migrate_s, 1),
+        "load_index_ms": round(load_index_ms, 3),
+        "load_messages_per_sec": round(total_messages / load_messages_s, 1),
+        "append_messages_per_sec": round(appends / append_s, 1),
+        "search": _stats(search_samples),
+    }
+
+
+@benchmark("gui_render")
+def bench_gui_render(quick):
+    """大量对话时 refresh_chat_list / switch_chat 的耗时；没有显示环境时跳过"""
+    import tkinter
+    try:
+        probe = tkinter.Tk()
+        probe.destroy()
+    except tkinter.TclError as e:
+        return {"skipped": f"没有可用的显示环境: {e}"}
+
+    chat_count, message_count = (200, 100) if quick else (5000, 400)
+    fake = FakeGemini(chunks=1)
+    previous = fake.install()
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # ChatApp 在当前目录读写历史数据库和日志
+        os.chdir(tmp)
+        try:
+            store = ChatStore("chat_history.db")
+            for i in range(chat_count):
+                store.add_chat(str(uuid.uuid4()), _make_chat(i, message_count))
+            store.close()
+
+            from main_app import ChatApp
+            start = time.perf_counter()
+            app = ChatApp(gemini_client=_fake_client(fake))
+            app.update()
+            startup_ms = (time.perf_counter() - start) * 1000
+            chat_ids = list(app.chats)
+
+            def refresh():
+                app.refresh_chat_list()
+                app.update_idletasks()
+
+            switch_targets = iter(chat_ids[i % len(chat_ids)] for i in range(10 ** 9))
+
+            def switch():
+                app.switch_chat(next(switch_targets))
+                app.update_idletasks()
+
+            results = {
+                "chats": chat_count,
+                "messages_per_chat": message_count,
+                "startup_ms": round(startup_ms, 3),
+                "refresh_chat_list": _stats(_timeit(refresh, 20)),
+                "switch_chat": _stats(_timeit(switch, 20 if quick else 50)),
+            }
+            app.on_close()
+            return results
+        finally:
+            os.chdir(cwd)
+            gemini_client._sdk = previous
+
+
+@benchmark("concurrent_sends")
+def bench_concurrent_sends(quick):
+    """通过 RequestEngine 并发发送流式请求，后端带延迟、片段速率和错误率"""
+    requests = 16 if quick else 64
+    fake = FakeGemini(latency=0.2, chunk_rate=50, chunks=10, error_rate=0.05, seed=1)
+    previous = fake.install()
+    engine = RequestEngine()
+    try:
+        client = _fake_client(fake)
+        history = [Message.from_sender("You" if i % 2 == 0 else "Gemini", f"历史消息 {i}") for i in range(20)]
+        start = time.perf_counter()
+        futures = []
+        for i in range(requests):
+            request_info = {"submitted_at": time.perf_counter()}
+
+            def make_stream(i=i, request_info=request_info):
+                return client.generate_response_stream(history, f"并发问题 {i}", request_info=request_info)
+
+            futures.append(engine.submit_stream(f"chat-{i}", make_stream))
+        failed = 0
+        for future in futures:
+            try:
+                future.result()
+            except Exception:
+                failed += 1
+        wall_s = time.perf_counter() - start
+        summary = client.telemetry.summary()
+        return {
+            "requests": requests,
+            "failed": failed,
+            "backend_calls": fake.calls,
+            "wall_ms": round(wall_s * 1000, 3),
+            "requests_per_sec": round(requests / wall_s, 2),
+            "ttft_p50_ms": _round(summary["ttft_p50_ms"]),
+            "ttft_p95_ms": _round(summary["ttft_p95_ms"]),
+            "latency_p50_ms": _round(summary["latency_p50_ms"]),
+            "latency_p95_ms": _round(summary["latency_p95_ms"]),
+            "queue_p50_ms": _round(summary["queue_p50_ms"]),
+        }
+    finally:
+        engine.shutdown()
+        gemini_client._sdk = previous
+
+
+@benchmark("first_request")
+def bench_first_request(quick):
+    """启动后第一次请求的首字耗时：不预热（冷连接）与预热后对比，后端模拟 0.3 秒的连接建立开销"""
+    results = {}
+    for transport in (None, "rest"):
+        label = transport or "grpc"
+        for prewarm in (False, True):
+            fake = FakeGemini(chunks=1, connect_latency=0.3)
+            previous = fake.install()
+            try:
+                client = _fake_client(fake, transport=transport, pool_size=2)
+                if prewarm:
+                    client.warm_up()
+                request_info = {}
+                client.generate_response([], "第一个问题", request_info=request_info)
+                key = f"{label}_{'warm' if prewarm else 'cold'}"
+                results[key] = {"ttft_ms": _round(request_info["ttft_ms"])}
+                if prewarm:
+                    latency = client.connection_latency()
+                    results[key]["warmup_cold_ms"] = _round(latency["cold_ms"])
+                    results[key]["warmup_warm_ms"] = _round(latency["warm_ms"])
+            finally:
+                gemini_client._sdk = previous
+    return results
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[name] = value
+    return flat
+
+
+def compare(baseline, current, tolerance):
+    """返回回退的指标列表 [(指标, 基线值, 当前值)]"""
+    old = _flatten(baseline.get("results", {}))
+    new = _flatten(current.get("results", {}))
+    regressions = []
+    for name, value in new.items():
+        base = old.get(name)
+        if not base:
+            continue
+        if name.endswith("_ms") and value > base * (1 + tolerance):
+            regressions.append((name, base, value))
+        elif name.endswith("_per_sec") and value < base * (1 - tolerance):
+            regressions.append((name, base, value))
+    return regressions
+
+
+def run(names, quick=False):
+    results = OrderedDict()
+    for name in names:
+        print(f"运行基准 {name} ...", file=sys.stderr)
+        results[name] = BENCHMARKS[name](quick)
+    return {
+        "revision": _git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "quick": quick,
+        "results": results,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini Chat App 性能基准测试（本地假后端）")
+    parser.add_argument("--only", action="append", choices=list(BENCHMARKS), help="只运行指定的基准，可重复")
+    parser.add_argument("--quick", action="store_true", help="缩小数据规模，快速运行")
+    parser.add_argument("-o", "--output", help="结果 JSON 文件路径，默认输出到标准输出")
+    parser.add_argument("--baseline", help="用于比较的上一次结果 JSON")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的相对退化幅度，默认 0.25")
+    args = parser.parse_args(argv)
+
+    # 基准运行时只保留警告以上的日志，避免输出本身影响计时
+    logging.basicConfig(level=logging.WARNING)
+    report = run(args.only or list(BENCHMARKS), quick=args.quick)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, report, args.tolerance)
+        for name, base, value in regressions:
+            print(f"性能回退: {name} {base} -> {value}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,470 @@
+# chat_archive.py
+"""
+对话存档的批量导入 / 导出。
+
+导入：单个 .json、包含 .json 的文件夹或 .zip 压缩包。多个文件在进程池中并行解析（解析是纯 Python，
+线程受 GIL 限制无法并行）；messages 数组按元素增量解码，每解出一批就交给主进程写入存储，
+超大文件不会整体读入内存。
+导出：所有对话写入一个 zip（每个对话一个 .json，deflate 压缩），逐个对话流式写出。
+
+命令行：
+    python chat_archive.py import <文件夹 | 压缩包 | 文件> [--db chat_history.db]
+    python chat_archive.py export <输出.zip> [--db chat_history.db]
+"""
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import queue
+import re
+import sys
+import threading
+import uuid
+import zipfile
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+_WHITESPACE = " \t\r\n"
+_NUMBER_CHARS = frozenset("0123456789+-.eE")
+_DECODER = json.JSONDecoder()
+# 单个对话存档的字段；顶层对象的第一个键不是这些时按旧版 {chat_id: 对话} 格式解析
+_CHAT_FIELDS = ("title", "messages", "prompt")
+
+
+class TitleIndex:
+    """
+    维护已占用的标题 / 文件名，重名时追加 _1、_2 ……
+    每个基础名记住下一个候选后缀，分配一个唯一名称是均摊 O(1)，不需要反复扫描。
+    """
+
+    def __init__(self, names=()):
+        self._names = set(names)
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def add(self, name):
+        with self._lock:
+            self._names.add(name)
+
+    def discard(self, name):
+        with self._lock:
+            self._names.discard(name)
+
+    def unique(self, name):
+        """返回一个未被占用的名称并登记"""
+        with self._lock:
+            if name not in self._names:
+                self._names.add(name)
+                return name
+            i = self._next.get(name, 1)
+            while f"{name}_{i}" in self._names:
+                i += 1
+            self._next[name] = i + 1
+            candidate = f"{name}_{i}"
+            self._names.add(candidate)
+            return candidate
+
+
+def safe_filename(title):
+    # 允许中文，去除不合法字符
+    return re.sub(r'[\\/:*?"<>|]', '_', title)
+
+
+class _StreamReader:
+    """在文本流上按需补充缓冲区的增量 JSON 解码器"""
+
+    def __init__(self, fp, chunk_size=1 << 16):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # 读取量不小于已缓冲的长度，单个大元素的重试总开销保持线性
+        data = self.fp.read(max(self.chunk_size, len(self.buf) - self.pos))
+        if not data:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """跳过空白，返回下一个字符（文件结束时返回空串）"""
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"JSON 格式错误：期望 {char!r}")
+        self.pos += 1
+
+    def value(self):
+        """解码下一个完整的 JSON 值"""
+        self.peek()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # 数字可能被缓冲区截断（例如 "1500." 之后的部分还没读入），raw_decode 会返回前半段；
+            # 数字之后直到缓冲区末尾都是数字字符时，补充数据后重新解码
+            if (isinstance(value, (int, float)) and not isinstance(value, bool) and not self.eof
+                    and all(c in _NUMBER_CHARS for c in self.buf[end:]) and self._fill()):
+                continue
+            self.pos = end
+            return value
+
+    def array(self):
+        """逐个产出数组元素"""
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError("JSON 格式错误：数组元素之间缺少逗号")
+
+    def next_member(self):
+        """读取对象成员之间的逗号，对象结束时返回 False"""
+        char = self.peek()
+        self.pos += 1
+        if char == "}":
+            return False
+        if char != ",":
+            raise ValueError("JSON 格式错误：对象成员之间缺少逗号")
+        return True
+
+
+def _normalize_message(m):
+    """返回 (sender, text)；格式不对或文本为 null 的消息返回 None"""
+    if isinstance(m, (list, tuple)) and len(m) == 2 and m[1] is not None:
+        return str(m[0]), m[1] if isinstance(m[1], str) else str(m[1])
+    return None
+
+
+def _chat_fields(fields, default_title):
+    title = fields.get("title") if isinstance(fields.get("title"), str) else ""
+    prompt = fields.get("prompt") if isinstance(fields.get("prompt"), str) else ""
+    return {"title": title or default_title, "prompt": prompt}
+
+
+def _iter_chat_members(reader, key, default_title, batch_size):
+    """读取一个对话对象的成员（左花括号和第一个键已读取）"""
+    yield "begin", None
+    fields = {}
+    while True:
+        reader.expect(":")
+        if key == "messages" and reader.peek() == "[":
+            batch = []
+            for m in reader.array():
+                message = _normalize_message(m)
+                if message is None:
+                    continue
+                batch.append(message)
+                if len(batch) >= batch_size:
+                    yield "messages", batch
+                    batch = []
+            if batch:
+                yield "messages", batch
+        else:
+            fields[key] = reader.value()
+        if not reader.next_member():
+            break
+        key = reader.value()
+    # 标题和系统提示词可能写在 messages 之后，对话结束时才能确定
+    yield "end", _chat_fields(fields, default_title)
+
+
+def iter_chat_events(fp, default_title="导入对话", batch_size=500):
+    """
+    增量解析一个存档文件，按顺序产出事件：
+        ("begin", None)                      一个对话开始
+        ("messages", [(sender, text), ...])  最多 batch_size 条消息
+        ("end", {"title", "prompt"})         对话结束
+    支持单个对话 {"title", "prompt", "messages"}，也支持旧版 chat_history.json 的 {chat_id: 对话} 格式。
+    """
+    reader = _StreamReader(fp)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    key = reader.value()
+    if key in _CHAT_FIELDS:
+        yield from _iter_chat_members(reader, key, default_title, batch_size)
+        return
+    # {chat_id: 对话} 格式，每个对话同样逐条解码
+    while True:
+        reader.expect(":")
+        if reader.peek() == "{":
+            reader.expect("{")
+            if reader.peek() == "}":
+                reader.pos += 1
+                yield "begin", None
+                yield "end", _chat_fields({}, default_title)
+            else:
+                yield from _iter_chat_members(reader, reader.value(), default_title, batch_size)
+        else:
+            reader.value()  # 不是对话对象，跳过
+        if not reader.next_member():
+            return
+        reader.value()
+
+
+def parse_chat_stream(fp, default_title="导入对话"):
+    """把存档文件解析为对话列表 [{"title", "prompt", "messages"}]；结果整体在内存中，只用于小文件"""
+    chats = []
+    for event, payload in iter_chat_events(fp, default_title):
+        if event == "begin":
+            chats.append({"messages": []})
+        elif event == "messages":
+            chats[-1]["messages"].extend(payload)
+        else:
+            chats[-1].update(payload)
+    return chats
+
+
+@contextmanager
+def _open_source(source):
+    """source 为 ("file", 路径) 或 ("zip", 压缩包路径, 成员名)，产出 (文本流, 默认标题)"""
+    if source[0] == "zip":
+        _, zip_path, member = source
+        # 每个工作进程单独打开压缩包
+        with zipfile.ZipFile(zip_path) as zf, zf.open(member) as raw:
+            yield io.TextIOWrapper(raw, encoding="utf-8"), os.path.splitext(os.path.basename(member))[0]
+    else:
+        with open(source[1], "r", encoding="utf-8") as f:
+            yield f, os.path.splitext(os.path.basename(source[1]))[0]
+
+
+def _collect_jobs(path):
+    """把文件 / 文件夹 / 压缩包展开为 [(描述, source)]"""
+    if os.path.isdir(path):
+        jobs = []
+        for root, _, files in os.walk(path):
+            for name in sorted(files):
+                if name.lower().endswith(".json"):
+                    full = os.path.join(root, name)
+                    jobs.append((full, ("file", full)))
+        return jobs
+    if zipfile.is_zipfile(path):
+        with zipfile.ZipFile(path) as zf:
+            members = [n for n in zf.namelist() if n.lower().endswith(".json") and not n.endswith("/")]
+        return [(f"{path}:{m}", ("zip", path, m)) for m in members]
+    return [(path, ("file", path))]
+
+
+def _parse_job(job_id, source, batch_size, emit):
+    with _open_source(source) as (fp, title):
+        for event, payload in iter_chat_events(fp, title, batch_size):
+            emit((job_id, event, payload))
+
+
+_event_queue = None
+
+
+def _init_worker(event_queue):
+    global _event_queue
+    _event_queue = event_queue
+
+
+def _process_job(job_id, source, batch_size):
+    """在子进程中解析一个文件，事件经队列交给主进程；结束或出错时发送 done / error 事件"""
+    try:
+        _parse_job(job_id, source, batch_size, _event_queue.put)
+    except Exception as e:
+        _event_queue.put((job_id, "error", str(e)))
+    else:
+        _event_queue.put((job_id, "done", None))
+
+
+def import_sources(paths, handle_event, abort_job, workers=None, batch_size=500):
+    """
+    解析 paths（文件、文件夹或压缩包）中的所有对话。
+    每个文件是一个任务：事件在主进程中回调 handle_event(任务号, 事件, 数据)，事件格式见 iter_chat_events；
+    文件解析失败时回调 abort_job(任务号)，该文件已产出的数据由调用方撤销。
+    多个文件时在进程池中并行解析，事件队列有上限，写入跟不上时解析进程会等待。返回失败列表 [(描述, 错误)]。
+    """
+    jobs = []
+    for path in paths:
+        jobs.extend(_collect_jobs(path))
+    failed = []
+
+    def fail(job_id, error):
+        logger.error(f"解析存档失败 {jobs[job_id][0]}: {error}")
+        abort_job(job_id)
+        failed.append((jobs[job_id][0], str(error)))
+
+    workers = min(workers or min(8, os.cpu_count() or 1), len(jobs))
+    if workers <= 1:
+        # 单个文件不值得启动子进程
+        for job_id, (_, source) in enumerate(jobs):
+            try:
+                _parse_job(job_id, source, batch_size, lambda item: handle_event(*item))
+            except Exception as e:
+                fail(job_id, e)
+        return failed
+
+    # spawn：GUI 进程中有多个线程，fork 不安全；Windows 上也只支持 spawn
+    context = multiprocessing.get_context("spawn")
+    event_queue = context.Queue(maxsize=workers * 4)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker,
+                             initargs=(event_queue,)) as pool:
+        futures = {pool.submit(_process_job, job_id, source, batch_size): job_id
+                   for job_id, (_, source) in enumerate(jobs)}
+        remaining = set(futures.values())
+        while remaining:
+            try:
+                job_id, event, payload = event_queue.get(timeout=0.5)
+            except queue.Empty:
+                # 子进程异常退出时不会发送结束事件
+                for future, job_id in futures.items():
+                    if job_id in remaining and future.done() and future.exception() is not None:
+                        remaining.discard(job_id)
+                        fail(job_id, future.exception())
+                continue
+            if event == "done":
+                remaining.discard(job_id)
+            elif event == "error":
+                remaining.discard(job_id)
+                fail(job_id, payload)
+            else:
+                handle_event(job_id, event, payload)
+    return failed
+
+
+class _StoreImporter:
+    """把解析事件写入 ChatStore：对话开始时建档，消息按批追加，结束时确定标题和系统提示词"""
+
+    def __init__(self, store, titles, flush_every):
+        self.store = store
+        self.titles = titles
+        self.flush_every = flush_every
+        self.entries = {}
+        self._current = {}  # 任务号 -> [chat_id, 消息数]
+        self._job_chats = {}  # 任务号 -> [chat_id]
+        self._batches = 0
+
+    def handle(self, job_id, event, payload):
+        if event == "begin":
+            chat_id = str(uuid.uuid4())
+            self._current[job_id] = [chat_id, 0]
+            self._job_chats.setdefault(job_id, []).append(chat_id)
+            self.store.create_chat(chat_id, "", "")
+        elif event == "messages":
+            current = self._current[job_id]
+            current[1] += len(payload)
+            self.store.append_messages(current[0], payload)
+            self._batches += 1
+            if self._batches % self.flush_every == 0:
+                # 等待写线程追上，写队列不会无限增长
+                self.store.flush()
+        else:
+            chat_id, count = self._current.pop(job_id)
+            # 标题按对话解析完成的顺序去重
+            title = self.titles.unique(payload["title"])
+            self.store.update_chat(chat_id, title=title, prompt=payload["prompt"])
+            self.entries[chat_id] = {"title": title, "prompt": payload["prompt"], "message_count": count,
+                                     "messages": None}
+
+    def abort(self, job_id):
+        """撤销解析失败的文件已写入的对话"""
+        self._current.pop(job_id, None)
+        chat_ids = self._job_chats.pop(job_id, [])
+        if chat_ids:
+            self.store.delete_chats(chat_ids)
+        for chat_id in chat_ids:
+            entry = self.entries.pop(chat_id, None)
+            if entry is not None:
+                self.titles.discard(entry["title"])
+
+
+def import_into_store(store, paths, titles, workers=None, replace=False, flush_every=20):
+    """
+    导入到 ChatStore，返回 (新对话的索引条目 {chat_id: {"title", "prompt", "message_count", "messages": None}}, 失败列表)。
+    titles 为 TitleIndex，用于标题去重。
+    replace 为 True 时，至少导入一个对话后才删除原有历史，全部解析失败不会丢失数据。
+    每写入 flush_every 批消息等待写线程追上一次。
+    """
+    existing = list(store.load_index()) if replace else []
+    importer = _StoreImporter(store, titles, flush_every)
+    failed = import_sources(paths, importer.handle, importer.abort, workers=workers)
+    if replace and importer.entries:
+        store.delete_chats(existing)
+    store.flush()
+    logger.info(f"批量导入完成：{len(importer.entries)} 个对话，{len(failed)} 个文件失败")
+    return importer.entries, failed
+
+
+def export_archive(chats, load_messages, zip_path):
+    """
+    把所有对话写入一个 zip 压缩包。
+    chats 为 [(chat_id, 标题, 系统提示词, 消息列表或 None)]，消息为 None 时用 load_messages(chat_id) 读取。
+    每个对话读取后立即编码写出，内存中同时只保留一个对话。返回导出的对话数。
+    """
+    names = TitleIndex()
+    tmp_path = zip_path + ".tmp"
+    count = 0
+    with zipfile.ZipFile(tmp_path, "w", compression=zipfile.ZIP_DEFLATED, compresslevel=6) as zf:
+        for chat_id, title, prompt, messages in chats:
+            if messages is None:
+                messages = load_messages(chat_id)
+            name = names.unique(safe_filename(title or "对话")) + ".json"
+            data = {"title": title, "messages": [list(m) for m in messages], "prompt": prompt or ""}
+            with zf.open(name, "w") as raw, io.TextIOWrapper(raw, encoding="utf-8") as out:
+                for piece in json.JSONEncoder(ensure_ascii=False, indent=2).iterencode(data):
+                    out.write(piece)
+            count += 1
+    os.replace(tmp_path, zip_path)
+    logger.info(f"已导出 {count} 个对话到 {zip_path}")
+    return count
+
+
+def main(argv=None):
+    from chat_store import ChatStore
+
+    parser = argparse.ArgumentParser(description="对话存档批量导入 / 导出")
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("paths", nargs="+", help="导入：文件、文件夹或 zip；导出：输出 zip 路径")
+    parser.add_argument("--db", default="chat_history.db", help="对话数据库，默认与界面共用")
+    parser.add_argument("--workers", type=int, help="并行解析的进程数")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    store = ChatStore(args.db)
+    try:
+        index = store.load_index()
+        if args.action == "import":
+            titles = TitleIndex(c["title"] for c in index.values())
+            entries, failed = import_into_store(store, args.paths, titles, workers=args.workers)
+            print(f"导入 {len(entries)} 个对话，失败 {len(failed)} 个文件")
+            return 1 if failed else 0
+        chats = [(cid, c["title"], c["prompt"], None) for cid, c in index.items()]
+        print(f"导出 {export_archive(chats, store.load_messages, args.paths[0])} 个对话")
+        return 0
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,151 @@
+# chat_list_view.py
+import sys
+import customtkinter as ctk
+
+
+class ChatListView(ctk.CTkFrame):
+    """
+    虚拟化的对话列表：只创建填满可视区域所需的几行控件，滚动时复用这些行并更新文字，
+    对话数量再多，控件数量和刷新开销也只与可视行数有关。
+    """
+
+    def __init__(self, master, on_select, on_rename, row_height=36, **kwargs):
+        super().__init__(master, **kwargs)
+        self.on_select = on_select
+        self.on_rename = on_rename
+        self.row_height = row_height
+        self.items = []  # [(chat_id, title)]，按显示顺序
+        self.offset = 0  # 第一可见行对应的 items 下标
+        self.rows = []  # [(frame, 标题按钮, 重命名按钮)]
+        self._row_items = []  # 每一行当前显示的 (chat_id, title)，用于跳过未变化的行
+
+        self.grid_columnconfigure(0, weight=1)
+        self.grid_rowconfigure(0, weight=1)
+        self.body = ctk.CTkFrame(self, fg_color=kwargs.get("fg_color", "#ffffff"))
+        self.body.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self._on_scrollbar, button_color="#ffffff", button_hover_color="#aaaaaa")
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+
+        self.body.bind("<Configure>", self._on_resize)
+        self._bind_wheel(self.body)
+
+    # ---------- 数据 ----------
+
+    def set_items(self, items):
+        """更新列表内容；只有显示内容发生变化的行才会重新配置"""
+        self.items = items
+        self._clamp_offset()
+        self._render()
+
+    # ---------- 行控件池 ----------
+
+    def _visible_count(self):
+        height = self.body.winfo_height()
+        return max(1, height // self.row_height + 1)
+
+    def _on_resize(self, event=None):
+        needed = self._visible_count()
+        while len(self.rows) < needed:
+            self._add_row()
+        self._clamp_offset()
+        self._render()
+
+    def _add_row(self):
+        index = len(self.rows)
+        # 新行先不显示，_render 分配到对话后才 pack
+        frame = ctk.CTkFrame(self.body, fg_color="#ffffff", height=self.row_height - 4)
+        btn = ctk.CTkButton(
+            frame,
+            text="",
+            fg_color="#ffffff",
+            text_color="#222222",
+            command=lambda i=index: self._select(i),
+            font=("Microsoft YaHei", 12),
+            width=140,
+            anchor="w"
+        )
+        btn.bind("<Enter>", lambda e, b=btn: b.configure(fg_color="#3498db", text_color="#ffffff"))
+        btn.bind("<Leave>", lambda e, b=btn: b.configure(fg_color="#ffffff", text_color="#222222"))
+        btn.pack(side="left", fill="x", expand=True)
+        rename_btn = ctk.CTkButton(
+            frame,
+            text="🖉",  # 编辑图标
+            width=32,
+            fg_color="#ffffff",
+            text_color=("#666", "#aaa"),
+            hover_color=("#e0e0e0", "#444444"),
+            command=lambda i=index: self._rename(i),
+            font=("Microsoft YaHei", 13)
+        )
+        rename_btn.pack(side="right", padx=(2, 0))
+        for widget in (frame, btn, rename_btn):
+            self._bind_wheel(widget)
+        self.rows.append((frame, btn, rename_btn))
+        self._row_items.append(None)
+
+    def _render(self):
+        for i, (frame, btn, rename_btn) in enumerate(self.rows):
+            item_index = self.offset + i
+            item = self.items[item_index] if item_index < len(self.items) else None
+            if item == self._row_items[i]:
+                continue
+            if item is None:
+                frame.pack_forget()
+            else:
+                if self._row_items[i] is None:
+                    frame.pack(fill="x", pady=2)
+                btn.configure(text=item[1])
+            self._row_items[i] = item
+        self._update_scrollbar()
+
+    def _select(self, row_index):
+        item = self._row_items[row_index]
+        if item is not None:
+            self.on_select(item[0])
+
+    def _rename(self, row_index):
+        item = self._row_items[row_index]
+        if item is not None:
+            self.on_rename(item[0])
+
+    # ---------- 滚动 ----------
+
+    def _max_offset(self):
+        return max(0, len(self.items) - self._visible_count() + 1)
+
+    def _clamp_offset(self):
+        self.offset = min(max(0, self.offset), self._max_offset())
+
+    def scroll_to(self, offset):
+        old = self.offset
+        self.offset = offset
+        self._clamp_offset()
+        if self.offset != old:
+            self._render()
+
+    def _update_scrollbar(self):
+        total = max(1, len(self.items))
+        first = self.offset / total
+        last = min(1.0, (self.offset + self._visible_count() - 1) / total)
+        self.scrollbar.set(first, max(first, last))
+
+    def _on_scrollbar(self, action, value, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(value) * len(self.items)))
+        elif action == "scroll":
+            step = int(value) * (self._visible_count() - 1 if unit == "pages" else 1)
+            self.scroll_to(self.offset + step)
+
+    def _bind_wheel(self, widget):
+        if sys.platform.startswith("linux"):
+            widget.bind("<Button-4>", lambda e: self.scroll_to(self.offset - 1), add="+")
+            widget.bind("<Button-5>", lambda e: self.scroll_to(self.offset + 1), add="+")
+        else:
+            widget.bind("<MouseWheel>", self._on_wheel, add="+")
+
+    def _on_wheel(self, event):
+        if sys.platform == "darwin":
+            step = -event.delta
+        else:
+            step = -int(event.delta / 120) * 3
+        self.scroll_to(self.offset + step)
@@ -0,0 +1,394 @@
+# chat_store.py
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+import logging
+from concurrent.futures import Future
+from search_index import index_text, build_match_query
+from message import Message
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS chats (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    prompt TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages (chat_id, seq);
+"""
+
+# 全文索引：rowid 与 messages.id 相同，内容是预先切分好的检索词
+SEARCH_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS message_index USING fts5(tokens, tokenize='unicode61');
+"""
+
+# PRAGMA user_version：1 表示全文索引已经建立，2 表示索引包含每段中日韩文字的末字（单字检索）
+SCHEMA_VERSION = 2
+
+
+class ChatStore:
+    """
+    基于 SQLite 的对话存储。
+    所有数据库操作都在一个后台写线程中按提交顺序执行（write-behind），
+    连续的写操作合并到同一个事务中提交；读操作排在已提交的写操作之后，保证读到最新数据。
+    """
+
+    def __init__(self, path="chat_history.db"):
+        self.path = path
+        self._queue = queue.Queue()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="chat-store", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+
+    # ---------- 后台线程 ----------
+
+    def _run(self):
+        conn = sqlite3.connect(self.path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(SCHEMA)
+        conn.create_function("index_text", 1, index_text, deterministic=True)
+        self.search_enabled = _init_search(conn)
+        conn.commit()
+        self._ready.set()
+        while True:
+            batch = [self._queue.get()]
+            # 把已排队的操作一次取完，合并到同一个事务
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = False
+            try:
+                with conn:
+                    if not conn.in_transaction:
+                        conn.execute("BEGIN")
+                    for op, args, future in batch:
+                        if op is None:
+                            stop = True
+                            continue
+                        # 每个操作一个保存点：失败的操作整体回滚，不会把写了一半的数据随批次提交
+                        conn.execute("SAVEPOINT store_op")
+                        try:
+                            result = op(conn, *args)
+                        except Exception as e:
+                            conn.execute("ROLLBACK TO store_op")
+                            conn.execute("RELEASE store_op")
+                            logger.error(f"存储操作失败: {e}")
+                            if future is not None:
+                                future.set_exception(e)
+                        else:
+                            conn.execute("RELEASE store_op")
+                            if future is not None:
+                                future.set_result(result)
+            except sqlite3.Error as e:
+                logger.error(f"提交存储事务失败: {e}")
+            if stop:
+                conn.close()
+                return
+
+    def _submit(self, op, *args, wait=False):
+        if wait:
+            return self._submit_future(op, *args).result()
+        self._queue.put((op, args, None))
+        return None
+
+    def _submit_future(self, op, *args):
+        """提交操作并返回 Future，不等待"""
+        future = Future()
+        self._queue.put((op, args, future))
+        return future
+
+    # ---------- 写操作（异步） ----------
+
+    def create_chat(self, chat_id, title, prompt=""):
+        self._submit(_create_chat, chat_id, title, prompt, time.time())
+
+    def add_chat(self, chat_id, chat):
+        """写入一个带完整消息列表的对话（导入时使用）"""
+        self._submit(_add_chat, chat_id, _snapshot(chat), time.time())
+
+    def replace_all(self, chats):
+        snapshot = {chat_id: _snapshot(chat) for chat_id, chat in chats.items()}
+        self._submit(_replace_all, snapshot, time.time())
+
+    def append_message(self, chat_id, sender, text):
+        self._submit(_append_message, chat_id, sender, text, time.time())
+
+    def append_messages(self, chat_id, messages):
+        """批量追加消息 [(sender, text)]（导入时按批写入）"""
+        self._submit(_append_messages, chat_id, list(messages), time.time())
+
+    def update_chat(self, chat_id, title=None, prompt=None):
+        self._submit(_update_chat, chat_id, title, prompt, time.time())
+
+    def delete_chats(self, chat_ids):
+        self._submit(_delete_chats, list(chat_ids))
+
+    # ---------- 读操作（同步） ----------
+
+    def load_index(self):
+        """
+        只读取对话的轻量索引，按创建顺序排列：
+        {chat_id: {"title", "prompt", "updated", "message_count", "messages": None}}
+        """
+        return self._submit(_load_index, wait=True)
+
+    def load_chat(self, chat_id):
+        """读取单个对话的标题、系统提示词和消息数，不存在时返回 None"""
+        return self._submit(_load_chat, chat_id, wait=True)
+
+    def load_messages(self, chat_id):
+        """读取单个对话的完整消息列表（Message 对象）"""
+        return self._submit(_load_messages, chat_id, wait=True)
+
+    def search(self, query, limit=50):
+        """
+        全文检索所有对话，按相关度排序。
+        返回 [(chat_id, 标题, 消息序号, 发送者, 消息文本)]。
+        """
+        match = build_match_query(query)
+        if match is None:
+            return []
+        if self.search_enabled:
+            return self._submit(_search, match, limit, wait=True)
+        # 当前 SQLite 不支持 FTS5 时退化为逐条匹配
+        return self._submit(_search_like, query, limit, wait=True)
+
+    def is_empty(self):
+        return self._submit(lambda conn: conn.execute("SELECT 1 FROM chats LIMIT 1").fetchone() is None, wait=True)
+
+    def flush(self):
+        """等待此前提交的所有写操作落盘"""
+        self._submit(lambda conn: None, wait=True)
+
+    def close(self):
+        self.flush()
+        self._queue.put((None, (), None))
+        self._thread.join()
+
+    def migrate_json(self, json_path):
+        """把旧版 chat_history.json 导入数据库（仅在数据库为空时），完成后重命名旧文件"""
+        if not os.path.exists(json_path) or not self.is_empty():
+            return 0
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                chats = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"读取旧版历史文件失败: {e}")
+            return 0
+        futures = [
+            (chat_id, self._submit_future(_add_chat, chat_id, _snapshot(chat), time.time()))
+            for chat_id, chat in chats.items() if isinstance(chat, dict)
+        ]
+        failed = []
+        for chat_id, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                failed.append(chat_id)
+                logger.error(f"迁移对话 {chat_id} 失败: {e}")
+        count = len(futures) - len(failed)
+        if failed:
+            # 保留旧文件，未迁移的对话不会丢失
+            logger.error(f"{len(failed)} 个对话迁移失败，保留 {json_path}")
+        else:
+            os.replace(json_path, json_path + ".migrated")
+        logger.info(f"已从 {json_path} 迁移 {count} 个对话")
+        return count
+
+
+def _init_search(conn):
+    try:
+        conn.executescript(SEARCH_SCHEMA)
+    except sqlite3.OperationalError as e:
+        logger.warning(f"SQLite 不支持 FTS5，全文检索将使用逐条匹配: {e}")
+        return False
+    version = conn.execute("PRAGMA user_version").fetchone()[0]
+    if version < SCHEMA_VERSION:
+        # 旧数据库首次升级（或切分规则变化）时为已有消息重建一次索引
+        conn.execute("DELETE FROM message_index")
+        conn.execute("INSERT INTO message_index (rowid, tokens) SELECT id, index_text(text) FROM messages")
+        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        logger.info("已为历史消息建立全文索引")
+    return True
+
+
+def _index_rows(conn, where, params):
+    conn.execute(
+        f"INSERT INTO message_index (rowid, tokens) SELECT id, index_text(text) FROM messages WHERE {where}",
+        params,
+    )
+
+
+def _unindex_rows(conn, where, params):
+    try:
+        conn.execute(f"DELETE FROM message_index WHERE rowid IN (SELECT id FROM messages WHERE {where})", params)
+    except sqlite3.OperationalError:
+        pass
+
+
+def _snapshot(chat):
+    # 写操作在后台线程执行，先复制一份，避免界面线程随后修改
+    return {
+        "title": chat.get("title", ""),
+        "prompt": chat.get("prompt", "") or "",
+        "messages": list(chat.get("messages", [])),
+    }
+
+
+def _create_chat(conn, chat_id, title, prompt, now):
+    conn.execute(
+        "INSERT OR REPLACE INTO chats (id, title, prompt, created, updated, message_count) VALUES (?, ?, ?, ?, ?, 0)",
+        (chat_id, title, prompt or "", now, now),
+    )
+
+
+def _add_chat(conn, chat_id, chat, now):
+    # 文本为 null 的消息跳过，其他非字符串值转为字符串，消息数与实际写入的行数一致
+    messages = [(str(m[0]), m[1] if isinstance(m[1], str) else str(m[1]))
+                for m in chat.get("messages", []) if len(m) >= 2 and m[1] is not None]
+    _unindex_rows(conn, "chat_id = ?", (chat_id,))
+    conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+    conn.execute(
+        "INSERT OR REPLACE INTO chats (id, title, prompt, created, updated, message_count) VALUES (?, ?, ?, ?, ?, ?)",
+        (chat_id, chat.get("title", ""), chat.get("prompt", "") or "", now, now, len(messages)),
+    )
+    conn.executemany(
+        "INSERT INTO messages (chat_id, seq, sender, text, created) VALUES (?, ?, ?, ?, ?)",
+        [(chat_id, i, sender, text, now) for i, (sender, text) in enumerate(messages)],
+    )
+    try:
+        _index_rows(conn, "chat_id = ?", (chat_id,))
+    except sqlite3.OperationalError:
+        pass
+
+
+def _replace_all(conn, chats, now):
+    try:
+        conn.execute("DELETE FROM message_index")
+    except sqlite3.OperationalError:
+        pass
+    conn.execute("DELETE FROM messages")
+    conn.execute("DELETE FROM chats")
+    for chat_id, chat in chats.items():
+        _add_chat(conn, chat_id, chat, now)
+
+
+def _append_message(conn, chat_id, sender, text, now):
+    row = conn.execute("SELECT message_count FROM chats WHERE id = ?", (chat_id,)).fetchone()
+    if row is None:
+        return
+    cursor = conn.execute(
+        "INSERT INTO messages (chat_id, seq, sender, text, created) VALUES (?, ?, ?, ?, ?)",
+        (chat_id, row[0], sender, text, now),
+    )
+    # 新消息增量写入全文索引
+    try:
+        conn.execute("INSERT INTO message_index (rowid, tokens) VALUES (?, ?)", (cursor.lastrowid, index_text(text)))
+    except sqlite3.OperationalError:
+        pass
+    conn.execute("UPDATE chats SET message_count = ?, updated = ? WHERE id = ?", (row[0] + 1, now, chat_id))
+
+
+def _append_messages(conn, chat_id, messages, now):
+    row = conn.execute("SELECT message_count FROM chats WHERE id = ?", (chat_id,)).fetchone()
+    if row is None or not messages:
+        return
+    start = row[0]
+    conn.executemany(
+        "INSERT INTO messages (chat_id, seq, sender, text, created) VALUES (?, ?, ?, ?, ?)",
+        [(chat_id, start + i, sender, text, now) for i, (sender, text) in enumerate(messages)],
+    )
+    try:
+        _index_rows(conn, "chat_id = ? AND seq >= ?", (chat_id, start))
+    except sqlite3.OperationalError:
+        pass
+    conn.execute("UPDATE chats SET message_count = ?, updated = ? WHERE id = ?", (start + len(messages), now, chat_id))
+
+
+def _delete_chats(conn, chat_ids):
+    for chat_id in chat_ids:
+        _unindex_rows(conn, "chat_id = ?", (chat_id,))
+        conn.execute("DELETE FROM messages WHERE chat_id = ?", (chat_id,))
+        conn.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
+
+
+def _update_chat(conn, chat_id, title, prompt, now):
+    if title is not None:
+        conn.execute("UPDATE chats SET title = ?, updated = ? WHERE id = ?", (title, now, chat_id))
+    if prompt is not None:
+        conn.execute("UPDATE chats SET prompt = ?, updated = ? WHERE id = ?", (prompt, now, chat_id))
+
+
+def _load_index(conn):
+    chats = {}
+    rows = conn.execute("SELECT id, title, prompt, updated, message_count FROM chats ORDER BY rowid")
+    for chat_id, title, prompt, updated, message_count in rows:
+        chats[chat_id] = {
+            "title": title,
+            "prompt": prompt,
+            "updated": updated,
+            "message_count": message_count,
+            "messages": None,  # 未加载
+        }
+    return chats
+
+
+def _load_chat(conn, chat_id):
+    row = conn.execute("SELECT title, prompt, message_count FROM chats WHERE id = ?", (chat_id,)).fetchone()
+    if row is None:
+        return None
+    return {"title": row[0], "prompt": row[1], "message_count": row[2], "messages": None}
+
+
+def _load_messages(conn, chat_id):
+    rows = conn.execute("SELECT sender, text, created FROM messages WHERE chat_id = ? ORDER BY seq", (chat_id,))
+    return [Message.from_sender(sender, text, created) for sender, text, created in rows]
+
+
+def _search(conn, match, limit):
+    return conn.execute(
+        """
+        SELECT m.chat_id, c.title, m.seq, m.sender, m.text
+        FROM message_index
+        JOIN messages m ON m.id = message_index.rowid
+        JOIN chats c ON c.id = m.chat_id
+        WHERE message_index MATCH ?
+        ORDER BY bm25(message_index)
+        LIMIT ?
+        """,
+        (match, limit),
+    ).fetchall()
+
+
+def _search_like(conn, query, limit):
+    pattern = "%" + query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return conn.execute(
+        """
+        SELECT m.chat_id, c.title, m.seq, m.sender, m.text
+        FROM messages m JOIN chats c ON c.id = m.chat_id
+        WHERE m.text LIKE ? ESCAPE '\\'
+        ORDER BY m.id DESC
+        LIMIT ?
+        """,
+        (pattern, limit),
+    ).fetchall()
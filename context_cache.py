@@ -0,0 +1,226 @@
+# context_cache.py
+import datetime
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+class SdkCacheBackend:
+    """基于 google.generativeai.caching 的显式上下文缓存后端"""
+
+    def create(self, model_name, system_instruction, contents, ttl):
+        from google.generativeai.caching import CachedContent
+        return CachedContent.create(
+            model=model_name,
+            system_instruction=system_instruction or None,
+            contents=contents or None,
+            ttl=datetime.timedelta(seconds=ttl),
+        )
+
+    def expire_time(self, handle):
+        return handle.expire_time.timestamp()
+
+    def refresh(self, handle, ttl):
+        handle.update(ttl=datetime.timedelta(seconds=ttl))
+
+    def delete(self, handle):
+        handle.delete()
+
+    def model_for(self, handle):
+        from google.generativeai.generative_models import GenerativeModel
+        return GenerativeModel.from_cached_content(cached_content=handle)
+
+
+def _update_prefixes(history, count_fn):
+    """
+    保证 history 中每条消息的前缀状态都从 history[0] 开始计算，返回最后一条的 (前缀哈希, 前缀 token 数)。
+    对话只在末尾追加消息：从末尾往前找到第一条前缀状态仍然有效的消息，只为它之后的新消息计算，
+    每次请求的开销与新增消息数成正比，而不是整个历史。
+    """
+    start = len(history)
+    while start > 0 and history[start - 1].prefix_after(history[start - 2] if start > 1 else None) is None:
+        start -= 1
+    for i in range(start, len(history)):
+        history[i].extend_prefix(history[i - 1] if i else None, count_fn)
+    return history[-1].prefix_after(history[-2] if len(history) > 1 else None)
+
+
+class _CacheEntry:
+    def __init__(self, group, handle, model, length, prefix_hash, tokens, expire_time):
+        self.group = group  # (model_name, system_instruction)
+        self.handle = handle
+        self.model = model
+        self.length = length
+        self.prefix_hash = prefix_hash
+        self.tokens = tokens  # 缓存部分的历史 token 数
+        self.expire_time = expire_time
+
+
+class ContextCacheManager:
+    """
+    为长系统指令 + 稳定的历史前缀创建服务端缓存，后续请求只发送未缓存的尾部。
+    - 缓存按前缀内容区分（同一提示词下的多个对话各有各的缓存），LRU 保留最多 max_entries 个；
+    - 前缀哈希和 token 数增量保存在 Message 上，每次请求只为新增的消息计算；
+    - 系统指令和历史总量超过 min_tokens 才创建缓存；历史被预算裁剪过的请求不使用缓存，
+      因为下一轮裁剪后前缀就会变化，缓存用不上；
+    - 过期前 refresh_margin 秒内使用时自动续期；
+    - 创建、续期、删除等网络调用都在锁外进行，不阻塞其他对话的请求；
+    - 任何缓存相关错误都回退到普通请求，并在 retry_after 秒内不再尝试该组合。
+    backend 可替换为本地假实现用于测试。
+    """
+
+    def __init__(self, token_count, backend=None, min_tokens=4096, ttl=3600,
+                 refresh_margin=300, retry_after=600, max_entries=32):
+        self.token_count = token_count
+        self.backend = backend or SdkCacheBackend()
+        self.min_tokens = min_tokens
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.max_entries = max_entries
+        self.enabled = True
+        self._entries = OrderedDict()  # (model_name, system_instruction, 前缀哈希) -> _CacheEntry
+        self._creating = set()  # 正在创建的缓存键，避免并发请求重复创建
+        self._failed_until = {}
+        self._system_tokens = OrderedDict()  # 系统指令 -> token 数
+        self._lock = threading.Lock()
+
+    def prepare(self, model_name, system_instruction, history, new_message, trimmed=False):
+        """
+        history 为请求中的历史消息（Message 列表），new_message 为新的用户消息（请求格式）；
+        trimmed 表示历史被预算裁剪过。
+        命中或新建缓存时返回 (模型, 需要发送的消息)，否则返回 None。
+        """
+        # 所有缓存都从对话的第一条消息开始，裁剪后的历史不可能命中
+        if not self.enabled or trimmed or not history:
+            return None
+        group = (model_name, system_instruction or "")
+        with self._lock:
+            if self._failed_until.get(group, 0) > time.time():
+                return None
+        _, total_tokens = _update_prefixes(history, self.token_count)
+        with self._lock:
+            entry = self._match(group, history)
+            if entry is not None:
+                self._entries.move_to_end((*group, entry.prefix_hash))
+
+        # 未缓存的尾部太长时，用更长的前缀新建缓存（旧缓存仍可能被其他对话使用，交给 LRU 淘汰）
+        if entry is not None and total_tokens - entry.tokens < self.min_tokens:
+            if not self._refresh_if_needed(entry):
+                return None
+            return entry.model, self._tail(history, entry, new_message)
+
+        if total_tokens + self._count_system(system_instruction or "") < self.min_tokens:
+            return None
+        entry = self._create(group, model_name, system_instruction, history)
+        if entry is None:
+            return None
+        return entry.model, self._tail(history, entry, new_message)
+
+    def invalidate(self, model_name, system_instruction):
+        """使用缓存模型的请求失败时调用，下次回退到普通请求"""
+        group = (model_name, system_instruction or "")
+        with self._lock:
+            stale = [key for key, entry in self._entries.items() if entry.group == group]
+            stale = [self._entries.pop(key) for key in stale]
+            self._failed_until[group] = time.time() + self.retry_after
+        self._delete(stale)
+
+    @staticmethod
+    def _tail(history, entry, new_message):
+        return [m.payload() for m in history[entry.length:]] + [new_message]
+
+    def _count_system(self, system_instruction):
+        with self._lock:
+            tokens = self._system_tokens.get(system_instruction)
+            if tokens is not None:
+                self._system_tokens.move_to_end(system_instruction)
+                return tokens
+        tokens = self.token_count(system_instruction)
+        with self._lock:
+            self._system_tokens[system_instruction] = tokens
+            while len(self._system_tokens) > self.max_entries:
+                self._system_tokens.popitem(last=False)
+        return tokens
+
+    def _match(self, group, history):
+        """
+        在锁内查找与 history 前缀一致的最长缓存；已过期的条目（服务端已自动删除）直接移除。
+        前缀状态已由 _update_prefixes 计算，每个条目只需比较一次哈希。
+        """
+        now = time.time()
+        best = None
+        for key, entry in list(self._entries.items()):
+            if entry.expire_time <= now:
+                del self._entries[key]
+                continue
+            if entry.group != group or entry.length > len(history):
+                continue
+            if best is not None and entry.length <= best.length:
+                continue
+            i = entry.length - 1
+            state = history[i].prefix_after(history[i - 1] if i else None)
+            if state is not None and state[0] == entry.prefix_hash:
+                best = entry
+        return best
+
+    def _create(self, group, model_name, system_instruction, history):
+        prefix_hash, tokens = _update_prefixes(history, self.token_count)
+        key = (*group, prefix_hash)
+        with self._lock:
+            if key in self._creating:
+                # 另一个请求正在创建同一个缓存，本次直接发送普通请求
+                return None
+            self._creating.add(key)
+        try:
+            handle = self.backend.create(model_name, system_instruction, [m.payload() for m in history], self.ttl)
+            entry = _CacheEntry(
+                group,
+                handle,
+                self.backend.model_for(handle),
+                len(history),
+                prefix_hash,
+                tokens,
+                self.backend.expire_time(handle),
+            )
+        except Exception as e:
+            logger.warning(f"创建上下文缓存失败，回退到普通请求: {e}")
+            with self._lock:
+                self._creating.discard(key)
+                self._failed_until[group] = time.time() + self.retry_after
+            return None
+        evicted = []
+        with self._lock:
+            self._creating.discard(key)
+            self._entries[key] = entry
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[1])
+        self._delete(evicted)
+        logger.info(f"已创建上下文缓存 - 模型: {model_name}, 缓存消息数: {entry.length}")
+        return entry
+
+    def _refresh_if_needed(self, entry):
+        if entry.expire_time - time.time() > self.refresh_margin:
+            return True
+        try:
+            self.backend.refresh(entry.handle, self.ttl)
+            entry.expire_time = self.backend.expire_time(entry.handle)
+            return True
+        except Exception as e:
+            logger.warning(f"续期上下文缓存失败，回退到普通请求: {e}")
+            with self._lock:
+                removed = self._entries.pop((*entry.group, entry.prefix_hash), None)
+            self._delete([removed] if removed is not None else [])
+            return False
+
+    def _delete(self, entries):
+        """在锁外删除服务端缓存"""
+        for entry in entries:
+            try:
+                self.backend.delete(entry.handle)
+            except Exception as e:
+                logger.warning(f"删除上下文缓存失败: {e}")
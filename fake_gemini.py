@@ -0,0 +1,187 @@
+# fake_gemini.py
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+import gemini_client
+from token_budget import estimate_tokens
+
+
+class FakeApiError(Exception):
+    """模拟 google.api_core 的异常，code 为 HTTP 状态码"""
+
+    def __init__(self, code, message):
+        super().__init__(f"{code} {message}")
+        self.code = code
+
+
+def _contents_text(contents):
+    if isinstance(contents, str):
+        return contents
+    texts = []
+    for item in contents:
+        if isinstance(item, dict):
+            texts.extend(str(part) for part in item.get("parts", []))
+        else:
+            texts.append(str(item))
+    return "\n".join(texts)
+
+
+class FakeGemini:
+    """
+    本地的 Gemini 替身，不联网、不消耗配额，用于基准测试。
+    - latency: 首个片段（或完整回复）到达前的等待秒数；
+    - chunk_rate: 流式时每秒产出的片段数（0 表示不等待）；
+    - chunks: 每次回复的片段数，chunk_text 为每个片段的文本；
+    - error_rate: 请求失败的概率，error_code 为失败时的状态码（429 / 503 会被调度层重试）；
+    - exhausted_keys: 这些 API 密钥的请求总是返回 429，用于测试多密钥负载均衡；
+    - connect_latency: 每个连接第一次被使用时额外等待的秒数（模拟 DNS / TLS / 通道建立）。
+    install() 后 gemini_client 使用这里的 configure / list_models / GenerativeModel。
+    """
+
+    def __init__(self, latency=0.0, chunk_rate=0.0, chunks=8, chunk_text="测试回复 fake reply. ",
+                 error_rate=0.0, error_code=503, exhausted_keys=(), models=None, seed=None, connect_latency=0.0):
+        self.latency = latency
+        self.chunk_rate = chunk_rate
+        self.chunks = chunks
+        self.chunk_text = chunk_text
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.exhausted_keys = set(exhausted_keys)
+        self.connect_latency = connect_latency
+        self.connections = 0
+        self.count_calls = 0
+        self.key_calls = {}  # api_key -> 请求次数
+        self.models = models or ["gemini-2.0-flash", "gemini-2.5-flash", "gemini-2.5-pro"]
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        fake = self
+
+        class GenerativeModel:
+            def __init__(self, model_name, system_instruction=None, **kwargs):
+                self.model_name = model_name
+                self.system_instruction = system_instruction
+                self._client = None
+
+            def generate_content(self, contents, generation_config=None, stream=False, **kwargs):
+                fake._connect(self._client)
+                return fake._generate(contents, stream, getattr(self._client, "api_key", None))
+
+            def count_tokens(self, contents=None, **kwargs):
+                fake._connect(self._client)
+                with fake._lock:
+                    fake.count_calls += 1
+                return SimpleNamespace(total_tokens=estimate_tokens(_contents_text(contents or "")))
+
+        self.GenerativeModel = GenerativeModel
+        self.GenerationConfig = lambda **kwargs: SimpleNamespace(**kwargs)
+
+    def configure(self, **kwargs):
+        pass
+
+    def generative_client(self, api_key, transport=None):
+        return SimpleNamespace(api_key=api_key, transport=transport, connected=False)
+
+    def model_client(self, api_key, transport=None):
+        return SimpleNamespace(api_key=api_key, transport=transport, connected=False)
+
+    def _connect(self, client):
+        """连接第一次被使用时模拟建立连接的开销"""
+        if client is None or client.connected:
+            return
+        with self._lock:
+            if client.connected:
+                return
+            client.connected = True
+            self.connections += 1
+        if self.connect_latency:
+            time.sleep(self.connect_latency)
+
+    def list_models(self, client=None):
+        self._connect(client)
+        for name in self.models:
+            yield SimpleNamespace(
+                name=f"models/{name}",
+                display_name=name,
+                supported_generation_methods=["generateContent", "countTokens"],
+                input_token_limit=1048576,
+                output_token_limit=8192,
+            )
+
+    def _should_fail(self, api_key):
+        with self._lock:
+            self.calls += 1
+            self.key_calls[api_key] = self.key_calls.get(api_key, 0) + 1
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    def _usage(self, prompt_tokens, chunks_done):
+        return SimpleNamespace(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=estimate_tokens(self.chunk_text) * chunks_done,
+        )
+
+    def _generate(self, contents, stream, api_key=None):
+        prompt_tokens = estimate_tokens(_contents_text(contents))
+        # 与真实 SDK 一致：流式请求在调用时就取回首个片段，错误在调用时抛出
+        if self.latency:
+            time.sleep(self.latency)
+        if api_key in self.exhausted_keys:
+            with self._lock:
+                self.key_calls[api_key] = self.key_calls.get(api_key, 0) + 1
+            raise FakeApiError(429, "Resource has been exhausted (e.g. check quota).")
+        if self._should_fail(api_key):
+            raise FakeApiError(self.error_code, "fake backend error")
+        if not stream:
+            return SimpleNamespace(text=self.chunk_text * self.chunks,
+                                   usage_metadata=self._usage(prompt_tokens, self.chunks))
+        return iter(self._stream(prompt_tokens))
+
+    def _stream(self, prompt_tokens):
+        for i in range(self.chunks):
+            if i and self.chunk_rate:
+                time.sleep(1.0 / self.chunk_rate)
+            yield SimpleNamespace(text=self.chunk_text, usage_metadata=self._usage(prompt_tokens, i + 1))
+
+    def install(self):
+        """替换 gemini_client 使用的 SDK，返回之前的 SDK 以便恢复"""
+        previous = gemini_client._sdk
+        gemini_client._sdk = self
+        return previous
+
+
+class FakeCacheBackend:
+    """
+    ContextCacheManager 的本地后端：只记录缓存，模型仍由 FakeGemini 生成。
+    fail_create / fail_refresh 为 True 时对应调用抛出异常，用于测试回退。
+    """
+
+    def __init__(self, fake):
+        self.fake = fake
+        self.created = 0
+        self.refreshed = 0
+        self.deleted = 0
+        self.fail_create = False
+        self.fail_refresh = False
+
+    def create(self, model_name, system_instruction, contents, ttl):
+        if self.fail_create:
+            raise FakeApiError(500, "fake cache create error")
+        self.created += 1
+        return {"model": model_name, "expire_time": time.time() + ttl}
+
+    def expire_time(self, handle):
+        return handle["expire_time"]
+
+    def refresh(self, handle, ttl):
+        if self.fail_refresh:
+            raise FakeApiError(500, "fake cache refresh error")
+        self.refreshed += 1
+        handle["expire_time"] = time.time() + ttl
+
+    def delete(self, handle):
+        self.deleted += 1
+
+    def model_for(self, handle):
+        return self.fake.GenerativeModel(handle["model"])
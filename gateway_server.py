@@ -0,0 +1,312 @@
+# gateway_server.py
+"""
+本地 HTTP / SSE 网关：让其他服务复用本应用的 API Key（api.txt）、模型选择和对话存储，不需要 Tk 窗口。
+
+单个 asyncio 事件循环处理所有连接，模型调用交给 RequestEngine 的有界线程池，不会为每个请求新建线程；
+所有请求共用一个 GeminiClient（按模型 / 系统指令缓存 GenerativeModel 实例，底层连接随之复用）。
+
+接口：
+    GET  /health
+    GET  /v1/models
+    GET  /v1/chats/<chat_id>          对话的标题、系统提示词和消息
+    POST /v1/chat                     {"message", "chat_id"?, "model"?, "temperature"?, "top_p"?,
+                                       "system_instruction"?, "title"?, "stream"?}
+stream 为 true 时以 Server-Sent Events 返回：每个片段一个 data 事件，结束时发送 event: done。
+chat_id 对应 chat_history.db 中的对话，不存在时自动创建，消息与界面中的对话互通。
+对已有对话传入 system_instruction 时，新的系统提示词会保存到该对话，之后的请求继续使用。
+
+用法：
+    python gateway_server.py --port 8765 --token <访问令牌>
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+import uuid
+import weakref
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from gemini_client import GeminiClient
+from chat_store import ChatStore
+from request_engine import RequestEngine
+from model_registry import ModelRegistry, DEFAULT_MODELS
+from logging_setup import setup_logging
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 404: "Not Found",
+            405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class GatewayServer:
+    """把 HTTP 请求转换为 GeminiClient 调用，对话读写经过 ChatStore"""
+
+    def __init__(self, client, store, engine=None, token=None, max_body=1024 * 1024, read_timeout=30.0):
+        self.client = client
+        self.store = store
+        self.engine = engine or RequestEngine(max_workers=16)
+        self.token = token
+        self.max_body = max_body
+        self.read_timeout = read_timeout
+        # ChatStore 的读操作会阻塞等待写线程，放到少量线程中执行，不占用事件循环
+        self._store_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="gateway-store")
+        # 同一对话的请求依次执行，保证每次读到的历史包含上一次的回复
+        self._chat_locks = weakref.WeakValueDictionary()
+
+    async def serve(self, host="127.0.0.1", port=8765):
+        server = await asyncio.start_server(self.handle, host, port)
+        logger.info(f"网关已启动: http://{host}:{port}")
+        async with server:
+            await server.serve_forever()
+
+    def close(self):
+        self.client.close()
+        self.engine.shutdown()
+        self._store_executor.shutdown(wait=False)
+        self.store.close()
+
+    async def _store_call(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._store_executor, fn, *args)
+
+    def _lock_for(self, chat_id):
+        lock = self._chat_locks.get(chat_id)
+        if lock is None:
+            lock = asyncio.Lock()
+            self._chat_locks[chat_id] = lock
+        return lock
+
+    # ---------- HTTP ----------
+
+    async def _read_request(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").strip()
+        if not request_line:
+            return None
+        try:
+            method, target, _ = request_line.split(" ", 2)
+        except ValueError:
+            raise HttpError(400, "请求行格式错误")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get("content-length") or 0)
+        except ValueError:
+            raise HttpError(400, "Content-Length 不是整数")
+        if length < 0:
+            raise HttpError(400, "Content-Length 不能为负数")
+        if length > self.max_body:
+            raise HttpError(413, "请求体过大")
+        body = await reader.readexactly(length) if length else b""
+        return method.upper(), target.split("?", 1)[0], headers, body
+
+    @staticmethod
+    async def _send_json(writer, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode("latin-1") + body
+        )
+        await writer.drain()
+
+    @staticmethod
+    def _sse(event, payload):
+        data = json.dumps(payload, ensure_ascii=False)
+        prefix = f"event: {event}\n" if event else ""
+        return f"{prefix}data: {data}\n\n".encode("utf-8")
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                request = await asyncio.wait_for(self._read_request(reader), self.read_timeout)
+                if request is None:
+                    return
+                method, path, headers, body = request
+                if self.token and headers.get("authorization") != f"Bearer {self.token}":
+                    raise HttpError(401, "缺少或错误的访问令牌")
+                await self._route(method, path, body, writer)
+            except HttpError as e:
+                await self._send_json(writer, e.status, {"error": str(e)})
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError):
+                pass
+            except Exception as e:
+                logger.error(f"处理请求失败: {e}")
+                await self._send_json(writer, 500, {"error": str(e)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def _route(self, method, path, body, writer):
+        if path == "/health":
+            await self._send_json(writer, 200, {"status": "ok"})
+        elif path == "/v1/models":
+            models, _ = ModelRegistry().load_cached()
+            names = ModelRegistry.chat_model_names(models) or list(DEFAULT_MODELS)
+            await self._send_json(writer, 200, {"models": names, "default": self.client.model_name})
+        elif path.startswith("/v1/chats/"):
+            if method != "GET":
+                raise HttpError(405, "只支持 GET")
+            chat_id = path[len("/v1/chats/"):]
+            chat = await self._store_call(self.store.load_chat, chat_id)
+            if chat is None:
+                raise HttpError(404, f"对话不存在: {chat_id}")
+            messages = await self._store_call(self.store.load_messages, chat_id)
+            chat["messages"] = [{"sender": sender, "text": text} for sender, text in messages]
+            await self._send_json(writer, 200, dict(chat, chat_id=chat_id))
+        elif path == "/v1/chat":
+            if method != "POST":
+                raise HttpError(405, "只支持 POST")
+            try:
+                payload = json.loads(body or b"{}")
+            except ValueError:
+                raise HttpError(400, "请求体不是合法的 JSON")
+            await self._chat(payload, writer)
+        else:
+            raise HttpError(404, f"未知路径: {path}")
+
+    # ---------- 对话 ----------
+
+    async def _chat(self, payload, writer):
+        message = payload.get("message")
+        if not isinstance(message, str) or not message.strip():
+            raise HttpError(400, "message 不能为空")
+        chat_id = str(payload.get("chat_id") or uuid.uuid4())
+        model_name = payload.get("model") or self.client.model_name
+        stream = bool(payload.get("stream"))
+        if not isinstance(payload.get("system_instruction", ""), (str, type(None))):
+            raise HttpError(400, "system_instruction 必须是字符串")
+        async with self._lock_for(chat_id):
+            chat = await self._store_call(self.store.load_chat, chat_id)
+            if chat is None:
+                history = []
+                prompt = payload.get("system_instruction") or ""
+                self.store.create_chat(chat_id, payload.get("title") or message[:30], prompt)
+            else:
+                history = await self._store_call(self.store.load_messages, chat_id)
+                prompt = payload.get("system_instruction", chat["prompt"])
+                if prompt != chat["prompt"]:
+                    # 与界面中修改系统提示词一致：保存到对话，之后的请求继续使用
+                    self.store.update_chat(chat_id, prompt=prompt or "")
+            self.store.append_message(chat_id, "You", message)
+
+            request_info = {"submitted_at": time.perf_counter()}
+
+            def make_stream():
+                return self.client.generate_response_stream(
+                    history=history,
+                    new_prompt=message,
+                    temperature=payload.get("temperature", 0.7),
+                    top_p=payload.get("top_p", 0.9),
+                    request_info=request_info,
+                    model_name=model_name,
+                    system_instruction=prompt
+                )
+
+            loop = asyncio.get_running_loop()
+            chunks = asyncio.Queue()
+            future = self.engine.submit_stream(
+                chat_id, make_stream,
+                on_chunk=lambda cid, text: loop.call_soon_threadsafe(chunks.put_nowait, text)
+            )
+            # 完成回调排在所有片段之后，None 表示结束
+            future.add_done_callback(lambda f: loop.call_soon_threadsafe(chunks.put_nowait, None))
+
+            if stream:
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\n"
+                    b"Content-Type: text/event-stream; charset=utf-8\r\n"
+                    b"Cache-Control: no-cache\r\n"
+                    b"Connection: close\r\n\r\n"
+                )
+                writer.write(self._sse("start", {"chat_id": chat_id, "model": model_name}))
+            parts = []
+            disconnected = False
+            while True:
+                text = await chunks.get()
+                if text is None:
+                    break
+                parts.append(text)
+                if stream and not disconnected:
+                    try:
+                        writer.write(self._sse(None, {"text": text}))
+                        await writer.drain()
+                    except ConnectionError:
+                        # 客户端断开：停止生成，已生成的部分仍写入对话
+                        disconnected = True
+                        future.cancel_event.set()
+                        future.cancel()
+
+            if future.cancelled():
+                tail, error = "【已停止】", "请求已取消"
+            elif future.exception() is not None:
+                tail, error = f"【出错】{future.exception()}", str(future.exception())
+            else:
+                tail, error = "", None
+            # 与界面一致：回复（含停止 / 出错标记）写入对话记录
+            self.store.append_message(chat_id, "Gemini", "".join(parts) + tail)
+
+        result = {
+            "chat_id": chat_id,
+            "model": model_name,
+            "prompt_tokens": request_info.get("prompt_tokens"),
+            "output_tokens": request_info.get("output_tokens"),
+            "ttft_ms": request_info.get("ttft_ms"),
+            "total_ms": request_info.get("total_ms"),
+        }
+        if stream:
+            if not disconnected:
+                writer.write(self._sse("error" if error else "done", dict(result, error=error) if error else result))
+                await writer.drain()
+        elif error:
+            await self._send_json(writer, 500, dict(result, error=error))
+        else:
+            await self._send_json(writer, 200, dict(result, response="".join(parts)))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Gemini Chat App 本地 HTTP / SSE 网关")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址，默认只接受本机连接")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--token", help="访问令牌，设置后请求需带 Authorization: Bearer <令牌>")
+    parser.add_argument("--model", default="gemini-2.0-flash", help="请求未指定模型时使用的模型")
+    parser.add_argument("--db", default="chat_history.db", help="对话数据库，默认与界面共用")
+    parser.add_argument("--workers", type=int, default=16, help="同时进行的模型请求上限")
+    parser.add_argument("--cache-dir", default="cache", help="确定性回复的磁盘缓存目录")
+    parser.add_argument("--json-logs", action="store_true", help="以 JSON 行格式写日志")
+    parser.add_argument("--transport", choices=["grpc", "rest"], help="与 Gemini API 的连接方式，默认 gRPC")
+    parser.add_argument("--pool-size", type=int, default=1, help="每个 API 密钥的连接数")
+    args = parser.parse_args(argv)
+
+    # 日志由后台线程写入，不阻塞事件循环
+    setup_logging(json_format=args.json_logs, prefix="gateway")
+    # 启动时在后台预热连接，第一个请求不必等待连接建立
+    client = GeminiClient(model_name=args.model, cache_dir=args.cache_dir, transport=args.transport,
+                          pool_size=args.pool_size)
+    gateway = GatewayServer(client, ChatStore(args.db), engine=RequestEngine(max_workers=args.workers),
+                            token=args.token)
+    try:
+        asyncio.run(gateway.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        logger.info("网关已停止")
+    finally:
+        gateway.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
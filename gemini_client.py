@@ -1,16 +1,65 @@
 # gemini_client.py
+import itertools
 import os
-import google.generativeai as genai
-from google.generativeai.client import configure
-from google.generativeai.models import list_models
-from google.generativeai.generative_models import GenerativeModel
-from google.generativeai.types import GenerationConfig
+import re
 import sys
 import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from types import SimpleNamespace
+from quota_scheduler import QuotaScheduler, is_quota_error
+from response_cache import ResponseCache, make_cache_key
+from token_budget import TokenCounter, budget_for, trim_history
+from context_cache import ContextCacheManager
+from telemetry import RequestRecord, Telemetry
+from key_pool import KeyPool, key_label
+from message import Message, ROLE_USER
 
 # 获取日志记录器
 logger = logging.getLogger(__name__)
 
+_sdk = None
+
+# 可选的传输方式；None 表示使用 SDK 默认值（gRPC）
+TRANSPORTS = ("grpc", "rest")
+
+
+def load_sdk():
+    """
+    首次使用时才导入 google.generativeai（导入耗时较长，不放在启动路径上）。
+    """
+    global _sdk
+    if _sdk is None:
+        from google.generativeai.client import configure, _ClientManager
+        from google.generativeai.models import list_models
+        from google.generativeai.generative_models import GenerativeModel
+        from google.generativeai.types import GenerationConfig
+
+        def service_client(name, api_key, transport=None):
+            # 每个密钥一个独立的客户端，不经过进程全局的 configure
+            manager = _ClientManager()
+            manager.configure(api_key=api_key, transport=transport)
+            return manager.get_default_client(name)
+
+        def generative_client(api_key, transport=None):
+            return service_client("generative", api_key, transport)
+
+        def model_client(api_key, transport=None):
+            return service_client("model", api_key, transport)
+
+        _sdk = SimpleNamespace(
+            configure=configure,
+            list_models=list_models,
+            GenerativeModel=GenerativeModel,
+            GenerationConfig=GenerationConfig,
+            generative_client=generative_client,
+            model_client=model_client,
+        )
+    return _sdk
+
+
 def get_api_file_path():
     if getattr(sys, 'frozen', False):
         # 打包后
@@ -21,35 +70,134 @@ def get_api_file_path():
         api_path = os.path.join(os.path.dirname(__file__), "api.txt")
     return api_path
 
+def read_api_keys():
+    """
+    从 api.txt 读取所有 API Key：每行一个（也可用逗号分隔），# 开头的行为注释。
+    文件不存在时返回空列表。
+    """
+    try:
+        with open(get_api_file_path(), "r", encoding="utf-8") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    keys = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        keys.extend(k for k in re.split(r"[\s,]+", line) if k)
+    return keys
+
+def read_api_key():
+    """从 api.txt 读取第一个 API Key，文件不存在时返回 None"""
+    keys = read_api_keys()
+    return keys[0] if keys else None
+
 class GeminiClient:
-    def __init__(self, api_key=None, model_name="gemini-2.0-flash", system_instruction=None):
+    def __init__(self, api_key=None, model_name="gemini-2.0-flash", system_instruction=None, cache_dir=None,
+                 context_cache_backend=None, telemetry=None, transport=None, pool_size=1, prewarm=True,
+                 keepalive=240.0, quota_state_path=None):
         """
         初始化 Gemini 客户端。
+        api_key 可以是单个密钥或密钥列表，为 None 时读取 api.txt 中的所有密钥，请求在这些密钥间负载均衡。
+        cache_dir 不为空时，确定性回复缓存会同时写入该目录。
+        context_cache_backend 用于替换显式上下文缓存的后端（例如本地假实现）。
+        telemetry 为 None 时只在内存中统计请求指标。
+        transport 为 "grpc" / "rest"（None 为 SDK 默认）；pool_size 为每个密钥的连接数，请求轮流使用。
+        prewarm 为 True 时在后台预先建立连接；keepalive 秒内没有请求时后台重新预热，None 表示不保活。
+        quota_state_path 不为空时每日请求计数保存到该文件，重启后今日剩余额度不会被重置。
         """
+        if transport is not None and transport not in TRANSPORTS:
+            raise ValueError(f"不支持的传输方式: {transport}，可选 {', '.join(TRANSPORTS)}")
         if api_key is None:
-            api_file = get_api_file_path()
-            with open(api_file, "r", encoding="utf-8") as f:
-                api_key = f.read().strip()
-        if not api_key:
-            raise ValueError("API Key not found. Please make sure api.txt exists and contains your API key.")
+            api_key = read_api_keys()
+        keys = [api_key] if isinstance(api_key, str) else list(api_key)
+        self.key_pool = KeyPool(keys)
         
-        logger.info(f"初始化Gemini客户端 - 模型: {model_name}")
-        configure(api_key=api_key)
+        self.transport = transport
+        self.pool_size = max(1, int(pool_size))
+        logger.info(f"初始化Gemini客户端 - 模型: {model_name}, API 密钥数: {len(self.key_pool)}, "
+                    f"传输: {transport or '默认'}, 连接数: {self.pool_size}")
+        # 全局配置只用于模型列表和上下文缓存；生成请求使用各密钥自己的连接
+        load_sdk().configure(api_key=self.key_pool.primary, transport=transport)
+        self._service_clients = {}  # (api_key, 连接序号) -> GenerativeServiceClient
+        self._next_slot = itertools.count()
         self.model_name = model_name
         self.system_instruction = system_instruction
+        # 所有 generate_content 调用都经过配额调度层，总配额按密钥数计算
+        self.scheduler = QuotaScheduler(keys=len(self.key_pool), state_path=quota_state_path)
+        # temperature 为 0 时的回复缓存，cache_enabled 为 False 时绕过
+        self.response_cache = ResponseCache(cache_dir=cache_dir)
+        self.cache_enabled = True
+        # 新输入和系统指令的 token 计数缓存（历史消息的 token 数缓存在 Message 上）；
+        # context_budgets 为 None 时使用默认预算
+        self.token_counter = TokenCounter()
+        self.context_budgets = None
+        # 长系统指令 / 长历史前缀的服务端上下文缓存；历史文本不进入按文本的计数缓存
+        self.context_cache = ContextCacheManager(self.token_counter.count_fn, backend=context_cache_backend)
+        # 每次请求的排队 / 转换 / 首字 / 总耗时和 token 用量
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        # GenerativeModel 实例缓存，键为 (模型名, 系统指令, 密钥, 连接序号)
+        self._models = OrderedDict()
+        self._models_lock = threading.Lock()
+        self.max_cached_models = 16 * self.pool_size
+        # 连接预热测得的首次 / 再次调用耗时，按模型名保存
+        self._warm_latency = {}
+        self._warm_lock = threading.Lock()
+        self._last_activity = time.monotonic()
+        self._closed = threading.Event()
+        self.keepalive = keepalive
+        # 多模型同时请求使用的线程池，第一次使用时创建
+        self._fan_out_executor = None
         self._init_model()
+        if prewarm:
+            self.prewarm()
+        if keepalive:
+            threading.Thread(target=self._keepalive_loop, daemon=True, name="gemini-keepalive").start()
 
     def _init_model(self):
-        if self.system_instruction and str(self.system_instruction).strip():
-            self.model = GenerativeModel(
-                self.model_name,
-                system_instruction=self.system_instruction
-            )
+        self.model = self._get_model(self.model_name, self.system_instruction)
+
+    def _service_client(self, api_key, slot=0):
+        with self._models_lock:
+            client = self._service_clients.get((api_key, slot))
+        if client is None:
+            client = load_sdk().generative_client(api_key, transport=self.transport)
+            with self._models_lock:
+                client = self._service_clients.setdefault((api_key, slot), client)
+        return client
+
+    def _get_model(self, model_name, system_instruction, api_key=None, slot=None):
+        """
+        按 (模型名, 系统指令, 密钥, 连接序号) 复用 GenerativeModel 实例，LRU 淘汰。
+        slot 为 None 时轮流使用该密钥的 pool_size 个连接。
+        """
+        if not (system_instruction and str(system_instruction).strip()):
+            system_instruction = None
+        api_key = api_key or self.key_pool.primary
+        if slot is None:
+            slot = next(self._next_slot) % self.pool_size
+        key = (model_name, system_instruction, api_key, slot)
+        with self._models_lock:
+            model = self._models.get(key)
+            if model is not None:
+                self._models.move_to_end(key)
+                return model
+        sdk = load_sdk()
+        if system_instruction is None:
+            model = sdk.GenerativeModel(model_name)
         else:
-            self.model = GenerativeModel(self.model_name)
+            model = sdk.GenerativeModel(model_name, system_instruction=system_instruction)
+        # GenerativeModel 没有公开的按实例指定密钥的参数，直接绑定该密钥的服务客户端
+        model._client = self._service_client(api_key, slot)
+        with self._models_lock:
+            self._models[key] = model
+            while len(self._models) > self.max_cached_models:
+                self._models.popitem(last=False)
+        return model
 
     def set_model(self, model_name, system_instruction=None):
-        """切换模型和/或系统指令"""
+        """切换默认模型和/或系统指令（单次请求也可以直接指定，不必修改默认值）"""
         changed = False
         if self.model_name != model_name:
             self.model_name = model_name
@@ -59,67 +207,388 @@ class GeminiClient:
             changed = True
         if changed:
             self._init_model()
-            print(f"Model switched to: {self.model_name}, system_instruction updated.")
+            logger.info(f"默认模型切换为: {self.model_name}")
+            self.prewarm()
 
-    def generate_response(self, history=None, new_prompt="", temperature=0.7, top_p=0.9):
+    def warm_up(self, model_name=None):
+        """
+        为每个密钥的每个连接发送一次 count_tokens（不消耗生成配额），提前完成 DNS、TLS 和通道建立。
+        每个连接调用两次：第一次为冷启动耗时，第二次为连接已建立后的耗时。
+        返回 {"cold_ms", "warm_ms", "connections", "transport"}，失败时返回 None。
+        """
+        model_name = model_name or self.model_name
+        # 启动预热和保活可能同时触发，依次执行
+        with self._warm_lock:
+            return self._warm_up(model_name)
+
+    def _warm_up(self, model_name):
+        self._last_activity = time.monotonic()
+        cold, warm = [], []
+        for api_key in self.key_pool.keys():
+            for slot in range(self.pool_size):
+                try:
+                    model = self._get_model(model_name, None, api_key, slot)
+                    samples = []
+                    for _ in range(2):
+                        start = time.perf_counter()
+                        model.count_tokens("ping")
+                        samples.append((time.perf_counter() - start) * 1000)
+                except Exception as e:
+                    # 单个密钥 / 连接失败不影响其他连接的预热
+                    logger.warning(f"连接预热失败（{model_name}, 密钥 {key_label(api_key)}）: {e}")
+                    continue
+                cold.append(samples[0])
+                warm.append(samples[1])
+        self._last_activity = time.monotonic()
+        if not cold:
+            return None
+        result = {
+            "cold_ms": sum(cold) / len(cold),
+            "warm_ms": sum(warm) / len(warm),
+            "connections": len(cold),
+            "transport": self.transport or "grpc",
+        }
+        # 只保留每个模型第一次预热的结果，保活时的再次预热不覆盖冷启动耗时
+        self._warm_latency.setdefault(model_name, result)
+        logger.info(f"连接预热完成 - 模型: {model_name}, 连接数: {len(cold)}, "
+                    f"冷启动 {result['cold_ms']:.0f} ms, 预热后 {result['warm_ms']:.0f} ms")
+        return result
+
+    def prewarm(self, model_name=None):
+        """在后台线程中执行 warm_up，不阻塞调用方"""
+        threading.Thread(target=self.warm_up, args=(model_name,), daemon=True, name="gemini-prewarm").start()
+
+    def connection_latency(self, model_name=None):
+        """第一次预热测得的冷启动 / 预热后耗时，尚未预热时返回 None"""
+        return self._warm_latency.get(model_name or self.model_name)
+
+    def _keepalive_loop(self):
+        # 空闲连接会被服务端或中间网络关闭，长时间没有请求时重新预热默认模型
+        while not self._closed.wait(self.keepalive):
+            if time.monotonic() - self._last_activity >= self.keepalive:
+                self.warm_up()
+
+    def close(self):
+        """停止后台保活，通知多模型请求的线程池退出"""
+        self._closed.set()
+        if self._fan_out_executor is not None:
+            self._fan_out_executor.shutdown(wait=False)
+
+    def _resolve(self, model_name, system_instruction):
+        """单次请求的模型设置，未指定时使用默认值"""
+        if model_name is None:
+            model_name = self.model_name
+        if system_instruction is None:
+            system_instruction = self.system_instruction
+        return model_name, system_instruction
+
+    def _build_messages(self, history, new_prompt, model_name, system_instruction, request_info=None):
+        """
+        把对话历史（Message 列表，也接受 (sender, message) 元组）转换为 API 所需的消息列表。
+        超出模型上下文预算时丢弃最早的轮次；request_info 为 dict 时写入本次发送的 token 数。
+        Message 上缓存的 token 数和请求格式跨请求复用，每次请求只需处理新增的消息。
+        返回 (消息列表, 保留的历史 Message 列表, 因超出预算丢弃的条数)。
+        """
+        history = history or []
+        if history and not isinstance(history[-1], Message):
+            # (sender, message) 元组先转换；这种情况下缓存不能跨请求复用
+            history = [Message.coerce(m) for m in history]
+        fixed_tokens = self.token_counter.count(new_prompt)
+        if system_instruction:
+            fixed_tokens += self.token_counter.count(str(system_instruction))
+        budget = budget_for(model_name, self.context_budgets) - fixed_tokens
+        kept, history_tokens, dropped = trim_history(history, self.token_counter.count_fn, budget)
+        if dropped:
+            logger.info(f"上下文超出预算，丢弃最早的 {dropped} 条消息")
+        logger.info(f"本次请求约 {history_tokens + fixed_tokens} tokens")
+        if request_info is not None:
+            request_info["prompt_tokens"] = history_tokens + fixed_tokens
+            request_info["dropped_messages"] = dropped
+        messages = [m.payload() for m in kept]
+        # 添加新的用户消息
+        messages.append({"role": ROLE_USER, "parts": [new_prompt]})
+        return messages, kept, dropped
+
+    def _build_generation_config(self, temperature, top_p):
+        return load_sdk().GenerationConfig(
+            temperature=temperature,
+            top_p=top_p,
+            max_output_tokens=8192,
+        )
+
+    def _cache_key(self, model_name, system_instruction, messages, temperature, top_p):
+        """只有确定性生成才可缓存，否则返回 None"""
+        if not self.cache_enabled or float(temperature) != 0:
+            return None
+        return make_cache_key(model_name, system_instruction, messages, temperature, top_p)
+
+    def _send(self, model_name, system_instruction, messages, generation_config, stream=False, timings=None,
+              history=(), trimmed=False):
+        """
+        发送请求；有可用的上下文缓存时只发送未缓存部分，缓存出错则透明回退（配额用尽时直接抛出）。
+        history 为 messages 中历史部分对应的 Message 列表；trimmed 表示历史被预算裁剪过，这种请求不使用上下文缓存。
+        """
+        self._last_activity = time.monotonic()
+        cached = self.context_cache.prepare(model_name, system_instruction, history, messages[-1], trimmed=trimmed)
+        if cached is not None:
+            cached_model, tail = cached
+
+            def call_cached():
+                # 上下文缓存属于创建它的主密钥
+                with self.key_pool.lease(only=self.key_pool.primary):
+                    return cached_model.generate_content(
+                        tail,
+                        generation_config=generation_config,
+                        stream=stream
+                    )
+
+            try:
+                return self.scheduler.run(model_name, call_cached, timings)
+            except Exception as e:
+                if is_quota_error(e):
+                    # 配额用尽与缓存无关，回退发送完整请求只会再消耗一次配额；缓存保留，下次继续使用
+                    raise
+                logger.warning(f"使用上下文缓存的请求失败，回退到普通请求: {e}")
+                self.context_cache.invalidate(model_name, system_instruction)
+
+        def call():
+            # 每次尝试（包括重试）重新选择密钥，配额用尽的密钥会被跳过
+            with self.key_pool.lease() as api_key:
+                model = self._get_model(model_name, system_instruction, api_key)
+                return model.generate_content(
+                    messages,
+                    generation_config=generation_config,
+                    stream=stream
+                )
+
+        return self.scheduler.run(model_name, call, timings)
+
+    def _start_record(self, model_name, request_info):
+        """
+        开始一条请求指标记录。
+        request_info 中的 submitted_at（time.perf_counter()）是调用方提交请求的时间，用来计算排队耗时。
+        """
+        rec = RequestRecord(model_name)
+        start = time.perf_counter()
+        if request_info is not None and "submitted_at" in request_info:
+            rec.queue_ms = max(0.0, (start - request_info["submitted_at"]) * 1000)
+        return rec, start
+
+    @staticmethod
+    def _read_usage(rec, response):
+        """从 usage_metadata 读取服务端统计的 token 数（流式时最后一个片段为累计值）"""
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None:
+            return
+        prompt_tokens = getattr(usage, "prompt_token_count", 0)
+        output_tokens = getattr(usage, "candidates_token_count", 0)
+        if prompt_tokens:
+            rec.prompt_tokens = prompt_tokens
+        if output_tokens:
+            rec.output_tokens = output_tokens
+
+    def _finish_record(self, rec, start, timings, request_info):
+        rec.total_ms = (time.perf_counter() - start) * 1000
+        rec.queue_ms += timings.get("wait", 0.0) * 1000
+        self.telemetry.record(rec)
+        if request_info is not None:
+            request_info["ttft_ms"] = rec.ttft_ms
+            request_info["total_ms"] = rec.total_ms
+            request_info["output_tokens"] = rec.output_tokens
+
+    def generate_response(self, history=None, new_prompt="", temperature=0.7, top_p=0.9, request_info=None,
+                          model_name=None, system_instruction=None):
         """
         生成回复
+        model_name / system_instruction 只作用于本次请求，不修改客户端默认值。
         """
+        model_name, system_instruction = self._resolve(model_name, system_instruction)
+        rec, start = self._start_record(model_name, request_info)
+        timings = {}
         try:
-            logger.info(f"生成回复 - 模型: {self.model_name}, 温度: {temperature}, top_p: {top_p}")
+            logger.info(f"生成回复 - 模型: {model_name}, 温度: {temperature}, top_p: {top_p}")
             
             # 构建完整的对话历史
-            messages = []
-            if history:
-                for sender, message in history:
-                    role = "user" if sender == "You" else "model"
-                    messages.append({"role": role, "parts": [message]})
-            
-            # 添加新的用户消息
-            messages.append({"role": "user", "parts": [new_prompt]})
+            messages, kept, dropped = self._build_messages(history, new_prompt, model_name, system_instruction,
+                                                           request_info)
+            rec.convert_ms = (time.perf_counter() - start) * 1000
+            cache_key = self._cache_key(model_name, system_instruction, messages, temperature, top_p)
+            if cache_key is not None:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    logger.info("命中回复缓存")
+                    rec.cached = True
+                    return cached
             
             # 设置生成配置
-            generation_config = GenerationConfig(
-                temperature=temperature,
-                top_p=top_p,
-                max_output_tokens=8192,
-            )
+            generation_config = self._build_generation_config(temperature, top_p)
             
             # 生成回复
-            response = self.model.generate_content(
-                messages,
-                generation_config=generation_config
-            )
+            response = self._send(model_name, system_instruction, messages, generation_config, timings=timings,
+                                  history=kept, trimmed=bool(dropped))
+            # 非流式请求的首字时间就是完整回复到达的时间
+            rec.ttft_ms = (time.perf_counter() - start) * 1000
+            self._read_usage(rec, response)
             
             logger.info("回复生成成功")
+            if cache_key is not None:
+                self.response_cache.put(cache_key, response.text)
             return response.text
             
         except Exception as e:
+            rec.ok = False
             logger.error(f"生成回复失败: {e}")
             raise
+        finally:
+            self._finish_record(rec, start, timings, request_info)
+
+    def generate_response_stream(self, history=None, new_prompt="", temperature=0.7, top_p=0.9, request_info=None,
+                                 model_name=None, system_instruction=None):
+        """
+        流式生成回复，逐块 yield 文本片段。
+        """
+        model_name, system_instruction = self._resolve(model_name, system_instruction)
+        rec, start = self._start_record(model_name, request_info)
+        timings = {}
+        try:
+            logger.info(f"流式生成回复 - 模型: {model_name}, 温度: {temperature}, top_p: {top_p}")
+            messages, kept, dropped = self._build_messages(history, new_prompt, model_name, system_instruction,
+                                                           request_info)
+            rec.convert_ms = (time.perf_counter() - start) * 1000
+            cache_key = self._cache_key(model_name, system_instruction, messages, temperature, top_p)
+            if cache_key is not None:
+                cached = self.response_cache.get(cache_key)
+                if cached is not None:
+                    logger.info("命中回复缓存")
+                    rec.cached = True
+                    yield cached
+                    return
+            generation_config = self._build_generation_config(temperature, top_p)
+            # 流式请求在首个片段返回前发生的错误可以安全重试
+            response = self._send(model_name, system_instruction, messages, generation_config, stream=True,
+                                  timings=timings, history=kept, trimmed=bool(dropped))
+            chunks = []
+            for chunk in response:
+                self._read_usage(rec, chunk)
+                # 安全过滤等情况下 chunk 可能没有文本
+                try:
+                    text = chunk.text
+                except ValueError:
+                    continue
+                if text:
+                    if rec.ttft_ms is None:
+                        rec.ttft_ms = (time.perf_counter() - start) * 1000
+                    rec.chunks += 1
+                    chunks.append(text)
+                    yield text
+            logger.info("流式回复生成完成")
+            if cache_key is not None:
+                self.response_cache.put(cache_key, "".join(chunks))
+        except GeneratorExit:
+            # 调用方中途停止读取（用户取消），单独计为 cancelled，不算失败
+            rec.cancelled = True
+            raise
+        except Exception as e:
+            rec.ok = False
+            logger.error(f"流式生成回复失败: {e}")
+            raise
+        finally:
+            self._finish_record(rec, start, timings, request_info)
 
     @staticmethod
-    def get_available_models():
+    def _fan_out_result(model_name):
+        return {"model": model_name, "status": "cancelled", "text": "", "error": None,
+                "ttft_ms": None, "total_ms": None, "output_tokens": None, "winner": False}
+
+    def _fan_out_one(self, model_name, stop, on_chunk, submitted_at, kwargs):
+        """多模型请求中的单个模型：流式读取，stop 被设置后在下一个片段处停止"""
+        request_info = {"submitted_at": submitted_at}
+        result = self._fan_out_result(model_name)
+        if stop.is_set():
+            return result
+        parts = []
+        stream = self.generate_response_stream(model_name=model_name, request_info=request_info, **kwargs)
+        try:
+            for text in stream:
+                if stop.is_set():
+                    break
+                parts.append(text)
+                if on_chunk is not None:
+                    on_chunk(model_name, text)
+            else:
+                result["status"] = "ok"
+        except Exception as e:
+            result["status"] = "error"
+            result["error"] = str(e)
+        finally:
+            # 关闭生成器才会结束流式连接并写入耗时
+            stream.close()
+        result["text"] = "".join(parts)
+        result["ttft_ms"] = request_info.get("ttft_ms")
+        result["total_ms"] = request_info.get("total_ms")
+        result["output_tokens"] = request_info.get("output_tokens")
+        return result
+
+    def generate_fan_out(self, model_names, history=None, new_prompt="", temperature=0.7, top_p=0.9,
+                         system_instruction=None, race=False, cancel_event=None, on_chunk=None, on_result=None):
         """
-        获取所有支持 generateContent 的模型短名列表。
+        把同一个问题同时发给多个模型。
+        返回与 model_names 顺序一致的结果列表，每项为
+        {"model", "status": "ok" / "error" / "cancelled", "text", "error", "ttft_ms", "total_ms", "output_tokens", "winner"}。
+        race 为 True 时第一个完整回复（winner）到达后立即返回，其余请求在下一个片段处停止；
+        cancel_event 被设置时停止所有请求。on_chunk(model_name, text) 和 on_result(result) 在工作线程中回调。
         """
-        api_file = get_api_file_path()
-        with open(api_file, "r", encoding="utf-8") as f:
-            api_key = f.read().strip()
-        if not api_key:
-            print("❌ 错误: 在 api.txt 文件中未找到 API Key。")
-            return []
+        model_names = list(dict.fromkeys(model_names))
+        if not model_names:
+            raise ValueError("至少需要选择一个模型")
+        with self._models_lock:
+            if self._fan_out_executor is None:
+                self._fan_out_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="gemini-fan-out")
+        logger.info(f"多模型请求 - 模型: {', '.join(model_names)}, 抢答: {race}")
+        kwargs = {"history": history, "new_prompt": new_prompt, "temperature": temperature, "top_p": top_p,
+                  "system_instruction": system_instruction}
+        stop = threading.Event()
+        submitted_at = time.perf_counter()
+        futures = {
+            self._fan_out_executor.submit(self._fan_out_one, name, stop, on_chunk, submitted_at, kwargs): name
+            for name in model_names
+        }
+        results = {}
+        pending = set(futures)
+        while pending and not stop.is_set():
+            if cancel_event is not None and cancel_event.is_set():
+                logger.info("多模型请求已取消")
+                stop.set()
+                break
+            # 定时醒来检查 cancel_event
+            done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                if race and result["status"] == "ok" and not stop.is_set():
+                    result["winner"] = True
+                    stop.set()
+                    logger.info(f"抢答完成 - 最快的模型: {result['model']}")
+                results[result["model"]] = result
+                if on_result is not None:
+                    on_result(result)
+        # 尚未结束的请求在后台自行停止，这里直接记为已取消
+        for future in pending:
+            results[futures[future]] = self._fan_out_result(futures[future])
+        return [results[name] for name in model_names]
+
+    def get_remaining_quota(self, model_name=None):
+        """返回指定模型 (本分钟剩余, 今日剩余) 的本地估计值"""
+        return self.scheduler.remaining(model_name or self.model_name)
+
+    @staticmethod
+    def get_available_models(force_refresh=False):
+        """
+        获取所有支持 generateContent 的模型短名列表（经过 ModelRegistry 的磁盘缓存）。
+        """
+        from model_registry import ModelRegistry
         try:
-            # genai.configure(api_key=api_key)
-            configure(api_key=api_key)
-            models = []
-            for m in list_models():
-                if 'generateContent' in getattr(m, 'supported_generation_methods', []):
-                    name = m.name
-                    if name.startswith("models/"):
-                        name = name.split("/", 1)[1]
-                    models.append(name)
-            return models
+            registry = ModelRegistry()
+            return registry.chat_model_names(registry.get_models(force_refresh=force_refresh))
         except Exception as e:
             print(f"获取模型列表失败: {e}")
-            return []
\ No newline at end of file
+            return []
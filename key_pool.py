@@ -0,0 +1,152 @@
+# key_pool.py
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 表示配额用尽的状态码
+QUOTA_CODES = {429}
+# 密钥无效或没有权限
+PERMISSION_CODES = {401, 403}
+
+
+class NoAvailableKeyError(Exception):
+    """所有 API 密钥都处于冷却中"""
+
+
+def _error_code(error):
+    code = getattr(error, "code", None)
+    code = getattr(code, "value", code)
+    if isinstance(code, tuple):
+        code = code[0]
+    return code
+
+
+def classify_error(error):
+    """返回 "quota"、"permission" 或 None（与密钥无关的错误）"""
+    code = _error_code(error)
+    text = str(error)
+    if code in QUOTA_CODES or "429" in text or "ResourceExhausted" in type(error).__name__:
+        return "quota"
+    if code in PERMISSION_CODES or "API_KEY_INVALID" in text or "API key not valid" in text:
+        return "permission"
+    return None
+
+
+def key_label(key):
+    """日志和界面中只显示密钥末尾几位"""
+    return f"...{key[-4:]}" if len(key) > 4 else "..."
+
+
+class KeyState:
+    __slots__ = ("key", "label", "requests", "errors", "quota_errors", "consecutive_quota_errors",
+                 "disabled_until", "last_used")
+
+    def __init__(self, key):
+        self.key = key
+        self.label = key_label(key)
+        self.requests = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.consecutive_quota_errors = 0
+        self.disabled_until = 0.0
+        self.last_used = 0.0
+
+
+class KeyPool:
+    """
+    多个 API 密钥的负载均衡：每次请求选用可用密钥中请求数最少的一个。
+    返回配额错误的密钥暂停 quota_cooldown 秒（连续失败时翻倍），权限错误的密钥暂停 permission_cooldown 秒。
+    """
+
+    def __init__(self, keys, quota_cooldown=60.0, max_quota_cooldown=3600.0, permission_cooldown=3600.0):
+        keys = list(dict.fromkeys(k for k in keys if k))
+        if not keys:
+            raise ValueError("API Key not found. Please make sure api.txt exists and contains your API key.")
+        self._states = [KeyState(k) for k in keys]
+        self.quota_cooldown = quota_cooldown
+        self.max_quota_cooldown = max_quota_cooldown
+        self.permission_cooldown = permission_cooldown
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._states)
+
+    @property
+    def primary(self):
+        """第一个密钥：模型列表、上下文缓存等全局配置使用它"""
+        return self._states[0].key
+
+    def keys(self):
+        """所有密钥（包括冷却中的）"""
+        return [s.key for s in self._states]
+
+    def _acquire(self, only=None):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [s for s in self._states
+                          if s.disabled_until <= now and (only is None or s.key == only)]
+            if not candidates:
+                waits = [s.disabled_until - now for s in self._states if only is None or s.key == only]
+                raise NoAvailableKeyError(f"所有 API 密钥都在冷却中，约 {int(min(waits)) + 1} 秒后恢复")
+            state = min(candidates, key=lambda s: (s.requests, s.last_used))
+            state.requests += 1
+            state.last_used = now
+            return state
+
+    def _report_error(self, state, error):
+        kind = classify_error(error)
+        with self._lock:
+            state.errors += 1
+            if kind is not None and state.disabled_until > time.monotonic():
+                # 冷却开始前已发出的并发请求，不重复延长冷却
+                if kind == "quota":
+                    state.quota_errors += 1
+                return
+            if kind == "quota":
+                state.quota_errors += 1
+                cooldown = min(self.max_quota_cooldown,
+                               self.quota_cooldown * (2 ** state.consecutive_quota_errors))
+                state.consecutive_quota_errors += 1
+            elif kind == "permission":
+                cooldown = self.permission_cooldown
+            else:
+                return
+            state.disabled_until = time.monotonic() + cooldown
+        logger.warning(f"API 密钥 {state.label} 返回{'配额' if kind == 'quota' else '权限'}错误，暂停使用 {cooldown:.0f} 秒")
+
+    @contextmanager
+    def lease(self, only=None):
+        """
+        借用一个密钥执行一次调用：with pool.lease() as key: ...
+        调用抛出的配额 / 权限错误会让该密钥进入冷却；only 指定时只使用该密钥。
+        """
+        state = self._acquire(only)
+        try:
+            yield state.key
+        except Exception as e:
+            self._report_error(state, e)
+            raise
+        else:
+            with self._lock:
+                state.consecutive_quota_errors = 0
+
+    def available(self):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for s in self._states if s.disabled_until <= now)
+
+    def stats(self):
+        """每个密钥的请求数、错误数和剩余冷却秒数"""
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "key": s.label,
+                "requests": s.requests,
+                "errors": s.errors,
+                "quota_errors": s.quota_errors,
+                "cooldown": max(0.0, s.disabled_until - now),
+            } for s in self._states]
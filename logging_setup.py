@@ -0,0 +1,168 @@
+# logging_setup.py
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+from datetime import datetime
+
+# 日志文件超过这个大小时轮转
+DEFAULT_MAX_BYTES = 5 * 1024 * 1024
+# 单个日志文件最多写这么久（秒）就轮转，超过保留期的旧文件被删除
+DEFAULT_ROTATE_AGE = 24 * 3600
+DEFAULT_RETENTION = 48 * 3600
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志一行 JSON，便于导入指标管道"""
+
+    def format(self, record):
+        entry = {
+            "time": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class RotatingLogWriter(logging.Handler):
+    """
+    写日志文件的处理器，只在 QueueListener 的后台线程中使用。
+    当前文件超过 max_bytes 或写满 rotate_age 秒时改名归档（gemini_chat_时间戳.log），
+    并顺带删除修改时间超过 retention 秒的归档，整个过程都在写线程中完成，不放在启动路径上。
+    每次启动都续写同一个文件，文件的创建时间记录在旁边的 .created 文件中，文件年龄跨启动累计。
+    """
+
+    def __init__(self, log_dir="logs", prefix="gemini_chat", max_bytes=DEFAULT_MAX_BYTES,
+                 rotate_age=DEFAULT_ROTATE_AGE, retention=DEFAULT_RETENTION):
+        super().__init__()
+        self.log_dir = log_dir
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        self.rotate_age = rotate_age
+        self.retention = retention
+        self.path = os.path.join(log_dir, f"{prefix}.log")
+        self.created_path = self.path + ".created"
+        os.makedirs(log_dir, exist_ok=True)
+        self._stream = None
+        self._opened_at = 0.0
+        self._size = 0
+        self._purged = False
+        self._open()
+
+    def _open(self):
+        self._stream = open(self.path, "a", encoding="utf-8")
+        self._size = self._stream.tell()
+        if self._size:
+            try:
+                with open(self.created_path, "r", encoding="utf-8") as f:
+                    self._opened_at = float(f.read())
+                return
+            except (OSError, ValueError):
+                # 旧版本留下的文件没有记录，取文件各时间戳中最早的一个
+                st = os.fstat(self._stream.fileno())
+                self._opened_at = min(st.st_mtime, st.st_ctime, getattr(st, "st_birthtime", st.st_mtime))
+        else:
+            self._opened_at = time.time()
+        try:
+            with open(self.created_path, "w", encoding="utf-8") as f:
+                f.write(repr(self._opened_at))
+        except OSError:
+            pass
+
+    def _rotate(self):
+        self._stream.close()
+        archive = os.path.join(self.log_dir, f"{self.prefix}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log")
+        suffix = 1
+        while os.path.exists(archive):
+            archive = archive[:-4] + f"_{suffix}.log"
+            suffix += 1
+        try:
+            os.replace(self.path, archive)
+        except OSError:
+            pass
+        self._open()
+        self._purge()
+
+    def _purge(self):
+        """删除超过保留期的归档（包括旧版本每次启动生成的日志文件）"""
+        cutoff = time.time() - self.retention
+        try:
+            names = os.listdir(self.log_dir)
+        except OSError:
+            return
+        for name in names:
+            if not (name.startswith(self.prefix + "_") and name.endswith(".log")):
+                continue
+            path = os.path.join(self.log_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                continue
+
+    def emit(self, record):
+        try:
+            text = self.format(record) + "\n"
+            if not self._purged:
+                # 首条日志时清理过期归档，而不是在启动时
+                self._purged = True
+                self._purge()
+            size = len(text.encode("utf-8"))
+            if self._size and (self._size + size > self.max_bytes
+                               or time.time() - self._opened_at > self.rotate_age):
+                self._rotate()
+            self._stream.write(text)
+            self._size += size
+            # 写线程不在界面和请求路径上，逐条刷新，进程崩溃时不丢日志
+            self._stream.flush()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        try:
+            if self._stream is not None:
+                self._stream.close()
+                self._stream = None
+        finally:
+            super().close()
+
+
+def setup_logging(log_dir="logs", json_format=False, console=True, level=logging.INFO, **writer_options):
+    """
+    配置根日志记录器：调用方线程只把记录放进无界队列（不会阻塞），
+    文件和控制台输出都由一个后台线程完成。返回 QueueListener，进程退出时自动停止并写完剩余日志。
+    """
+    if json_format:
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+    handlers = [RotatingLogWriter(log_dir, **writer_options)]
+    if console:
+        handlers.append(logging.StreamHandler(sys.stdout))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(level)
+    listener.start()
+    atexit.register(_stop_listener, listener)
+    return listener
+
+
+def _stop_listener(listener):
+    # 调用方可能已经手动停止过
+    if listener._thread is not None:
+        listener.stop()
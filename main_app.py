@@ -1,6 +1,19 @@
 # main_app.py
+import time
+_START_TIME = time.perf_counter()  # 启动计时起点，放在其他导入之前
+
 import customtkinter as ctk
 from gemini_client import GeminiClient
+from startup_timing import StartupTimer
+from model_registry import ModelRegistry, DEFAULT_MODELS
+from request_engine import RequestEngine
+from chat_store import ChatStore
+from message import Message
+from chat_list_view import ChatListView
+from ui_pump import UIPump
+from telemetry import Telemetry
+from logging_setup import setup_logging
+from chat_archive import TitleIndex, safe_filename, import_into_store, export_archive
 import json
 import uuid
 import os
@@ -8,79 +21,71 @@ import tkinter as tk
 import tkinter.simpledialog
 import tkinter.filedialog
 from tkinter import messagebox, filedialog
-import re
-import threading
 import logging
+import multiprocessing
 import sys
-from datetime import datetime, timedelta
+from collections import OrderedDict
 
-# 配置日志
-def setup_logging():
-    # 创建logs目录
-    if not os.path.exists("logs"):
-        os.makedirs("logs")
-    
-    # 清理超过48小时的日志文件
-    cleanup_old_logs()
-    
-    # 生成日志文件名（包含时间戳）
-    log_filename = f"logs/gemini_chat_{datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
-    
-    # 配置日志格式
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_filename, encoding='utf-8'),
-            logging.StreamHandler(sys.stdout)  # 同时输出到控制台
-        ]
-    )
-    return logging.getLogger(__name__)
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+# 导入存档时的解析子进程（spawn）会以 __mp_main__ 的名字重新导入本模块，子进程不初始化日志
+if __name__ != "__mp_main__":
+    # 初始化日志：记录经队列交给后台线程写入，轮转和旧日志清理也在该线程中进行
+    # --json-logs：以 JSON 行格式写日志
+    setup_logging(json_format="--json-logs" in sys.argv)
+    logger.info("程序启动")
+startup = StartupTimer(_START_TIME)
+startup.mark("import")
 
-def cleanup_old_logs():
-    """清理超过48小时的日志文件"""
-    try:
-        logs_dir = "logs"
-        if not os.path.exists(logs_dir):
-            return
-        
-        current_time = datetime.now()
-        cutoff_time = current_time - timedelta(hours=48)
-        
-        deleted_count = 0
-        for filename in os.listdir(logs_dir):
-            if filename.startswith("gemini_chat_") and filename.endswith(".log"):
-                file_path = os.path.join(logs_dir, filename)
-                try:
-                    # 从文件名解析时间戳
-                    # 文件名格式: gemini_chat_YYYYMMDD_HHMMSS.log
-                    time_str = filename.replace("gemini_chat_", "").replace(".log", "")
-                    file_time = datetime.strptime(time_str, "%Y%m%d_%H%M%S")
-                    
-                    if file_time < cutoff_time:
-                        os.remove(file_path)
-                        deleted_count += 1
-                except (ValueError, OSError) as e:
-                    # 如果文件名格式不对或删除失败，跳过
-                    continue
-        
-        if deleted_count > 0:
-            print(f"已清理 {deleted_count} 个超过48小时的日志文件")
-    except Exception as e:
-        print(f"清理日志文件时出错: {e}")
 
-# 初始化日志
-logger = setup_logging()
-logger.info("程序启动")
+def argv_option(name, default=None):
+    """读取 "--name 值" 或 "--name=值" 形式的命令行参数"""
+    for i, arg in enumerate(sys.argv):
+        if arg == name and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+        if arg.startswith(name + "="):
+            return arg[len(name) + 1:]
+    return default
+
 
 class ChatApp(ctk.CTk):
-    HISTORY_FILE = "chat_history.json"
+    HISTORY_FILE = "chat_history.json"  # 旧版历史文件，启动时迁移到数据库
+    HISTORY_DB = "chat_history.db"
+    # 内存中最多保留的消息条数，超出后按最近最少使用卸载整个对话的消息
+    LOADED_MESSAGE_BUDGET = 20000
+    # 聊天区每次加载的消息条数，以及最多同时保留在文本框中的消息条数
+    RENDER_PAGE = 50
+    RENDER_CAP = 200
 
-    def __init__(self, gemini_client):
+    def __init__(self, gemini_client=None, client_factory=None, startup_timer=None, startup_check=False):
+        """
+        gemini_client 与 client_factory 二选一：传入工厂时，客户端（含 SDK 导入）在后台构建，
+        窗口先显示，首次发送前再等待构建完成。
+        startup_check 为 True 时，首帧绘制且客户端就绪后输出启动耗时并退出。
+        """
         super().__init__()
-        self.chats = {}
+        self.chats = {}  # chat_id -> 对话，未加载时 "messages" 为 None
+        self.title_index = TitleIndex()  # 已使用的对话标题，load_history 中重建
+        self._history_names = None  # history 目录中已有的文件名，首次保存时建立
+        self._loaded_chats = OrderedDict()  # 已加载消息的对话，按最近使用排序
         self.current_chat_id = None
-        self.gemini_client = gemini_client
+        self.startup_timer = startup_timer or StartupTimer()
+        self.startup_check = startup_check
+        self.startup_exit_code = None
+        # 对话持久化：每条消息单独追加，由后台线程写入
+        self.chat_store = ChatStore(self.HISTORY_DB)
+        # 所有模型请求由后台事件循环统一调度
+        self.request_engine = RequestEngine()
+        # 客户端就绪前为 None；工作线程通过 get_client() 等待
+        self.gemini_client = None
+        if gemini_client is not None:
+            self.client_future = self.request_engine.submit_call(lambda: gemini_client)
+        else:
+            self.client_future = self.request_engine.submit_call(self._build_client(client_factory))
+        self.stream_buffers = {}  # chat_id -> 正在流式生成的回复片段
+        # 工作线程的界面更新统一经过这个队列，由主线程按帧处理
+        self.ui_pump = UIPump(self, on_append=self.append_stream_chunk)
+        self.ui_pump.start()
 
         self.title("Gemini Chat App")
         self.geometry("900x600")
@@ -125,6 +130,11 @@ class ChatApp(ctk.CTk):
         # 聊天显示区（在大框内）
         self.chat_display = ctk.CTkTextbox(main_chat_frame, state="disabled", wrap="word", font=("Microsoft YaHei", 14), fg_color="#ffffff", border_width=2, border_color="#636e72", corner_radius=8)
         self.chat_display.grid(row=1, column=0, columnspan=3, sticky="nsew", padx=16, pady=(0, 8))
+        # 文本框只渲染消息区间 [display_start, display_end)，滚动到顶部 / 底部时再加载相邻的一页
+        self.display_start = 0
+        self.display_end = 0
+        self._page_job = None
+        self.chat_display._textbox.configure(yscrollcommand=self.on_display_scroll)
         main_chat_frame.grid_rowconfigure(1, weight=1)
 
         # 用户输入区（在大框内最下方）
@@ -146,13 +156,46 @@ class ChatApp(ctk.CTk):
         self.sidebar.grid(row=0, column=0, rowspan=3, sticky="nswe", padx=(10, 0), pady=15)
         self.sidebar.grid_propagate(False)
 
-        # 只开放三种模型
-        model_list = ["gemini-2.0-flash", "gemini-2.5-flash", "gemini-2.5-pro"]
-        default_model = model_list[0]
+        # 先用磁盘缓存中的模型列表（没有缓存时用默认的三种），启动后在后台刷新
+        self.model_registry = ModelRegistry()
+        cached_models, _ = self.model_registry.load_cached()
+        model_list = self.model_registry.chat_model_names(cached_models) or list(DEFAULT_MODELS)
+        default_model = DEFAULT_MODELS[0] if DEFAULT_MODELS[0] in model_list else model_list[0]
         ctk.CTkLabel(self.sidebar, text="选择模型", font=("Microsoft YaHei", 14, "bold")).pack(pady=(10, 2), padx=10, anchor="w")
         self.model_var = ctk.StringVar(value=default_model)
         self.model_option = ctk.CTkOptionMenu(self.sidebar, variable=self.model_var, values=model_list, font=("Microsoft YaHei", 12), fg_color="#3498db", text_color="#ffffff", command=self.on_model_change)
-        self.model_option.pack(pady=(0, 15), fill="x", padx=10)
+        self.model_option.pack(pady=(0, 2), fill="x", padx=10)
+
+        # 剩余配额（本地估计）
+        self.quota_label = ctk.CTkLabel(self.sidebar, text="", font=("Microsoft YaHei", 11), text_color="#666666")
+        self.quota_label.pack(pady=(0, 0), padx=10, anchor="w")
+        # 上一次请求发送的上下文 token 数
+        self.tokens_label = ctk.CTkLabel(self.sidebar, text="", font=("Microsoft YaHei", 11), text_color="#666666")
+        self.tokens_label.pack(pady=(0, 0), padx=10, anchor="w")
+        # 请求统计面板（默认折叠）
+        self.stats_var = ctk.BooleanVar(value=False)
+        self.stats_checkbox = ctk.CTkCheckBox(self.sidebar, text="显示请求统计", variable=self.stats_var, command=self.toggle_stats_panel, font=("Microsoft YaHei", 11))
+        self.stats_checkbox.pack(pady=(2, 10), padx=10, anchor="w")
+        self.stats_label = ctk.CTkLabel(self.sidebar, text="", font=("Microsoft YaHei", 11), text_color="#666666", justify="left")
+
+        # 多模型同时发送：并排对比各模型的回复；抢答模式只保留最快的完整回复，其余请求取消
+        fanout_row = ctk.CTkFrame(self.sidebar, fg_color="transparent")
+        fanout_row.pack(pady=(0, 2), fill="x", padx=10)
+        self.fanout_var = ctk.BooleanVar(value=False)
+        self.fanout_checkbox = ctk.CTkCheckBox(fanout_row, text="多模型同时发送", variable=self.fanout_var, font=("Microsoft YaHei", 11))
+        self.fanout_checkbox.pack(side="left")
+        self.fanout_models_btn = ctk.CTkButton(fanout_row, text="选择", width=44, command=self.choose_fanout_models, font=("Microsoft YaHei", 11), fg_color="#3498db", text_color="#ffffff")
+        self.fanout_models_btn.pack(side="right")
+        self.fanout_models = model_list[:2]
+        self.fanout_label = ctk.CTkLabel(self.sidebar, text="", font=("Microsoft YaHei", 11), text_color="#666666", justify="left", wraplength=190)
+        self.fanout_label.pack(pady=(0, 0), padx=10, anchor="w")
+        self.race_var = ctk.BooleanVar(value=False)
+        self.race_checkbox = ctk.CTkCheckBox(self.sidebar, text="抢答：只取最快的完整回复", variable=self.race_var, font=("Microsoft YaHei", 11))
+        self.race_checkbox.pack(pady=(2, 10), padx=10, anchor="w")
+        self.update_fanout_label()
+        # 多模型对比窗口：{模型名: (标题标签, 文本框)}
+        self.compare_window = None
+        self.compare_views = {}
 
         # temperature参数
         ctk.CTkLabel(self.sidebar, text="temperature", font=("Microsoft YaHei", 12)).pack(pady=(0, 2), padx=10, anchor="w")
@@ -176,6 +219,11 @@ class ChatApp(ctk.CTk):
         self.top_p_value_label.pack(side="right")
         self.top_p_var.trace_add("write", lambda *args: self.top_p_value_label.configure(text=f"{self.top_p_var.get():.2f}"))
 
+        # 回复缓存开关（仅 temperature 为 0 时生效）
+        self.cache_var = ctk.BooleanVar(value=True)
+        self.cache_checkbox = ctk.CTkCheckBox(self.sidebar, text="缓存确定性回复 (temperature=0)", variable=self.cache_var, command=self.on_cache_toggle, font=("Microsoft YaHei", 11))
+        self.cache_checkbox.pack(pady=(0, 15), padx=10, anchor="w")
+
         # 新建对话按钮
         self.new_chat_btn = ctk.CTkButton(self.sidebar, text="新建对话", command=self.new_chat, font=("Microsoft YaHei", 12), fg_color="#3498db", text_color="#ffffff")
         self.new_chat_btn.pack(pady=(0, 15), fill="x", padx=10)
@@ -186,33 +234,118 @@ class ChatApp(ctk.CTk):
 
         # 导入历史对话按钮
         self.import_chat_btn = ctk.CTkButton(self.sidebar, text="导入历史对话", command=self.import_chat_from_file, font=("Microsoft YaHei", 12), fg_color="#e67e22", text_color="#ffffff")
-        self.import_chat_btn.pack(pady=(0, 15), fill="x", padx=10)
+        self.import_chat_btn.pack(pady=(0, 8), fill="x", padx=10)
+
+        # 批量导入文件夹 / 导出全部对话
+        bulk_frame = ctk.CTkFrame(self.sidebar, fg_color="transparent")
+        bulk_frame.pack(pady=(0, 15), fill="x", padx=10)
+        self.import_folder_btn = ctk.CTkButton(bulk_frame, text="导入文件夹", width=95, command=self.import_chat_folder, font=("Microsoft YaHei", 12), fg_color="#e67e22", text_color="#ffffff")
+        self.import_folder_btn.pack(side="left", fill="x", expand=True, padx=(0, 4))
+        self.export_all_btn = ctk.CTkButton(bulk_frame, text="导出全部", width=95, command=self.export_all_chats, font=("Microsoft YaHei", 12), fg_color="#27ae60", text_color="#ffffff")
+        self.export_all_btn.pack(side="left", fill="x", expand=True)
+
+        # 全文检索
+        self.search_var = ctk.StringVar()
+        self.search_entry = ctk.CTkEntry(self.sidebar, textvariable=self.search_var, placeholder_text="搜索所有对话...", font=("Microsoft YaHei", 12))
+        self.search_entry.pack(pady=(0, 4), fill="x", padx=10)
+        self.search_entry.bind("<KeyRelease>", self.on_search_input)
+        self.search_results_frame = ctk.CTkScrollableFrame(self.sidebar, height=140, fg_color="#f7f9fa")
+        self._search_job = None
 
         # 对话历史列表
         ctk.CTkLabel(self.sidebar, text="对话历史", font=("Microsoft YaHei", 13, "bold")).pack(pady=(0, 2), padx=10, anchor="w")
-        self.chat_list_frame = ctk.CTkScrollableFrame(self.sidebar, label_text="", fg_color="#ffffff", scrollbar_button_color="#ffffff", scrollbar_button_hover_color="#aaaaaa")
-        self.chat_list_frame.pack(pady=(0, 10), fill="both", expand=True, padx=10)
-        self.chat_buttons = {}
-        self.rename_buttons = {}
+        self.chat_list = ChatListView(self.sidebar, on_select=self.switch_chat, on_rename=self.rename_chat, fg_color="#ffffff")
+        self.chat_list.pack(pady=(0, 10), fill="both", expand=True, padx=10)
 
         # --- 初始化 ---
-        self.load_history()
+        with self.startup_timer.measure("history_load"):
+            self.load_history()
         self.refresh_chat_list()
         if not self.chats:
             # 启动时自动新建一个"新聊天"对话，不弹窗
-            chat_id = str(uuid.uuid4())
-            self.chats[chat_id] = {"title": "新聊天", "messages": [], "prompt": ""}
+            chat_id = self.create_chat("新聊天")
             self.current_chat_id = chat_id
             self.switch_chat(chat_id)
             self.refresh_chat_list()
             self.add_message_to_display("System", "你好！我是Gemini，有什么可以帮你的吗？")
-            # 确保prompt被传递
-            model_name = self.model_var.get()
-            prompt = self.chats[chat_id].get("prompt", "")
-            self.gemini_client.set_model(model_name, system_instruction=prompt)
         else:
             last_chat_id = list(self.chats.keys())[-1]
             self.switch_chat(last_chat_id)
+        self.refresh_quota_label()
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.client_future.add_done_callback(lambda f: self.ui_pump.call(lambda: self.on_client_ready(f)))
+        self.after_idle(self.on_first_paint)
+
+    def _build_client(self, client_factory):
+        timer = self.startup_timer
+
+        def build():
+            with timer.measure("client_init"):
+                return client_factory()
+        return build
+
+    def get_client(self):
+        """在工作线程中调用：等待后台初始化完成并返回客户端"""
+        return self.client_future.result()
+
+    def on_client_ready(self, future):
+        if future.exception() is not None:
+            e = future.exception()
+            logger.error(f"初始化Gemini客户端失败: {e}")
+            if not self.startup_check:
+                messagebox.showerror("初始化失败", f"初始化Gemini客户端失败：{e}")
+        else:
+            self.gemini_client = future.result()
+            # 同步客户端初始化前界面上已做的设置
+            self.gemini_client.cache_enabled = self.cache_var.get()
+            self.refresh_quota_label(schedule=False)
+            if not self.startup_check and self.model_registry.is_stale():
+                # 与聊天请求使用同一个密钥和连接方式
+                client = self.gemini_client
+                refresh = self.request_engine.submit_call(
+                    lambda: self.model_registry.refresh(client.key_pool.primary, transport=client.transport)
+                )
+                refresh.add_done_callback(lambda f: self.ui_pump.call(lambda: self.on_models_refreshed(f)))
+        if self.startup_check and "first_paint" in self.startup_timer.phases:
+            self.finish_startup_check()
+
+    def on_models_refreshed(self, future):
+        if future.exception() is not None:
+            logger.warning(f"刷新模型列表失败，继续使用现有列表: {future.exception()}")
+            return
+        model_list = self.model_registry.chat_model_names(future.result())
+        if not model_list:
+            return
+        current = self.model_var.get()
+        if current not in model_list:
+            model_list.insert(0, current)
+        self.model_option.configure(values=model_list)
+
+    def on_first_paint(self):
+        self.update_idletasks()
+        self.startup_timer.mark("first_paint")
+        if self.startup_check and self.client_future.done():
+            self.finish_startup_check()
+
+    def finish_startup_check(self):
+        # 首帧和客户端就绪两条路径都可能触发，只执行一次
+        if self.startup_exit_code is not None:
+            return
+        print(self.startup_timer.report())
+        violations = self.startup_timer.check()
+        for phase, (elapsed, limit) in violations.items():
+            print(f"启动阶段 {phase} 耗时 {elapsed:.0f} ms，超过阈值 {limit} ms")
+        self.startup_exit_code = 1 if violations else 0
+        self.on_close()
+
+    def on_close(self):
+        # 退出前把尚未写入的消息落盘
+        self.ui_pump.stop()
+        if self.gemini_client is not None:
+            self.gemini_client.close()
+        self.request_engine.shutdown()
+        self.chat_store.close()
+        self.destroy()
 
     def show_title_dialog(self, title_hint="请输入对话名称：", default_value=""):
         dialog = tk.Toplevel(self)
@@ -244,22 +377,66 @@ class ChatApp(ctk.CTk):
         title = self.show_title_dialog("请输入对话名称：")
         if not title:
             return
-        chat_id = str(uuid.uuid4())
-        self.chats[chat_id] = {"title": title, "messages": [], "prompt": ""}
+        chat_id = self.create_chat(title)
         self.current_chat_id = chat_id
         self.switch_chat(chat_id)
         self.refresh_chat_list()
         self.add_message_to_display("System", "你好！我是Gemini，有什么可以帮你的吗？")
 
+    def create_chat(self, title, prompt=""):
+        chat_id = str(uuid.uuid4())
+        self.chats[chat_id] = {"title": title, "messages": [], "prompt": prompt, "message_count": 0}
+        self._loaded_chats[chat_id] = None
+        self.title_index.add(title)
+        self.chat_store.create_chat(chat_id, title, prompt)
+        return chat_id
+
+    def append_message(self, chat_id, sender, message):
+        """追加一条消息到内存和存储（存储为 O(1) 追加写）"""
+        chat = self.chats[chat_id]
+        if chat["messages"] is not None:
+            chat["messages"].append(Message.from_sender(sender, message))
+        chat["message_count"] = chat.get("message_count", 0) + 1
+        self.chat_store.append_message(chat_id, sender, message)
+
+    def ensure_messages(self, chat_id):
+        """按需从存储加载对话的消息列表"""
+        chat = self.chats[chat_id]
+        if chat["messages"] is None:
+            chat["messages"] = self.chat_store.load_messages(chat_id)
+            chat["message_count"] = len(chat["messages"])
+        self._loaded_chats[chat_id] = None
+        self._loaded_chats.move_to_end(chat_id)
+        self.evict_chats()
+        return chat["messages"]
+
+    def evict_chats(self):
+        """内存中的消息超过预算时，卸载最久未使用的对话（当前对话和生成中的对话除外）"""
+        total = sum(len(self.chats[cid]["messages"]) for cid in self._loaded_chats)
+        for cid in list(self._loaded_chats):
+            if total <= self.LOADED_MESSAGE_BUDGET:
+                break
+            if cid == self.current_chat_id or cid in self.stream_buffers:
+                continue
+            total -= len(self.chats[cid]["messages"])
+            self.chats[cid]["messages"] = None
+            del self._loaded_chats[cid]
+
     def rename_chat(self, chat_id):
         old_title = self.chats[chat_id]["title"]
         new_title = self.show_title_dialog("重命名对话：", old_title)
         if new_title and new_title != old_title:
             self.chats[chat_id]["title"] = new_title
+            self.title_index.add(new_title)
+            self.chat_store.update_chat(chat_id, title=new_title)
             self.refresh_chat_list()
-            self.save_history()
 
     def send_message(self):
+        # 当前对话正在生成时，按钮作为“停止”使用
+        if self.current_chat_id and self.request_engine.is_busy(self.current_chat_id):
+            self.request_engine.cancel(self.current_chat_id)
+            return
+
         user_text = self.user_input.get().strip()
         if not user_text:
             return
@@ -268,8 +445,7 @@ class ChatApp(ctk.CTk):
 
         # 如果当前没有对话，自动新建一个对话
         if not self.current_chat_id:
-            chat_id = str(uuid.uuid4())
-            self.chats[chat_id] = {"title": "新聊天", "messages": [], "prompt": ""}
+            chat_id = self.create_chat("新聊天")
             self.current_chat_id = chat_id
             self.switch_chat(chat_id)
             self.refresh_chat_list()
@@ -277,46 +453,259 @@ class ChatApp(ctk.CTk):
 
         self.add_message_to_display("You", user_text)
         self.user_input.delete(0, "end")
-        self.send_button.configure(state="disabled", text="...")
-        self.update_idletasks()
 
-        def get_response():
-            if self.current_chat_id is None or self.current_chat_id not in self.chats:
-                return
-            model_name = self.model_var.get()
-            temperature = self.temp_var.get()
-            top_p = self.top_p_var.get()
-            current_chat = self.chats[self.current_chat_id]
-            history_for_api = current_chat["messages"][:-1]
-            self.gemini_client.set_model(model_name, system_instruction=current_chat.get("prompt", ""))
-            try:
-                logger.info(f"请求模型回复 - 模型: {model_name}, 温度: {temperature}")
-                response_text = self.gemini_client.generate_response(
-                    history=history_for_api,
-                    new_prompt=user_text,
-                    temperature=temperature,
-                    top_p=top_p
-                )
-                logger.info("模型回复成功")
-            except Exception as e:
-                logger.error(f"模型回复失败: {e}")
-                response_text = f"【出错】{e}"
-            # 回到主线程更新界面
-            self.after(0, lambda: self.finish_response(response_text, user_text))
+        # 请求参数在发送时确定并绑定到发起请求的对话，切换对话不会影响回复去向
+        chat_id = self.current_chat_id
+        current_chat = self.chats[chat_id]
+        history_for_api = list(current_chat["messages"][:-1])
+        model_name = self.model_var.get()
+        temperature = self.temp_var.get()
+        top_p = self.top_p_var.get()
+        prompt = current_chat.get("prompt", "")
+        if self.fanout_var.get() and self.fanout_models:
+            self.send_fan_out(chat_id, history_for_api, user_text, temperature, top_p, prompt)
+            return
+        # 提交时间用于统计请求在引擎中的排队耗时
+        request_info = {"submitted_at": time.perf_counter()}
 
-        threading.Thread(target=get_response, daemon=True).start()
+        def make_stream():
+            logger.info(f"请求模型回复 - 模型: {model_name}, 温度: {temperature}")
+            # 模型和系统指令随请求传入，并发请求之间不共享可变的模型状态
+            return self.get_client().generate_response_stream(
+                history=history_for_api,
+                new_prompt=user_text,
+                temperature=temperature,
+                top_p=top_p,
+                request_info=request_info,
+                model_name=model_name,
+                system_instruction=prompt
+            )
+
+        def on_chunk(cid, chunk):
+            # 交给界面更新泵，同一帧内的片段会合并后一次性追加
+            self.ui_pump.append_text(cid, chunk)
+
+        self.stream_buffers[chat_id] = []
+        self.begin_stream_display(chat_id)
+        future = self.request_engine.submit_stream(chat_id, make_stream, on_chunk=on_chunk)
+        future.add_done_callback(
+            lambda f: self.ui_pump.call(lambda: self.finish_response(chat_id, f, user_text, request_info))
+        )
+        self.update_send_button()
+
+    def update_send_button(self):
+        """按钮状态只反映当前显示对话是否有请求在进行；每帧最多刷新一次"""
+        self.ui_pump.schedule_once("send_button", self._apply_send_button)
+
+    def _apply_send_button(self):
+        if self.current_chat_id and self.request_engine.is_busy(self.current_chat_id):
+            self.send_button.configure(state="normal", text="停止")
+        else:
+            self.send_button.configure(state="normal", text="发送")
+
+    def begin_stream_display(self, chat_id):
+        """在聊天区写入回复的抬头，后续片段追加在其后"""
+        if not self.tail_displayed(chat_id):
+            return
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("end", "Gemini:\n")
+        self.chat_display.configure(state="disabled")
+        self.chat_display.see("end")
 
-    def finish_response(self, response_text, user_text):
-        if self.current_chat_id is None or self.current_chat_id not in self.chats:
+    def append_stream_chunk(self, chat_id, chunk):
+        if chat_id not in self.stream_buffers:
             return
-        self.send_button.configure(state="normal", text="发送")
-        self.add_message_to_display("Gemini", response_text)
-        current_chat = self.chats[self.current_chat_id]
+        self.stream_buffers[chat_id].append(chunk)
+        if not self.tail_displayed(chat_id):
+            return
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("end", chunk)
+        self.chat_display.configure(state="disabled")
+        self.chat_display.see("end")
+
+    def finish_response(self, chat_id, future, user_text, request_info=None):
+        streamed = "".join(self.stream_buffers.pop(chat_id, []))
+        if chat_id not in self.chats:
+            self.update_send_button()
+            return
+        if future.cancelled():
+            logger.info("模型回复已取消")
+            tail = "【已停止】"
+        elif future.exception() is not None:
+            e = future.exception()
+            logger.error(f"模型回复失败: {e}")
+            tail = f"【出错】{e}"
+        else:
+            logger.info("模型回复成功")
+            tail = ""
+        response_text = streamed + tail
+        # 文本已经流式显示，只需写入对话记录并补上结尾
+        show = self.tail_displayed(chat_id)
+        self.append_message(chat_id, "Gemini", response_text)
+        if show:
+            self.chat_display.configure(state="normal")
+            self.chat_display.insert("end", f"{tail}\n\n")
+            self.display_end += 1
+            self.trim_display_top()
+            self.chat_display.configure(state="disabled")
+            self.chat_display.see("end")
+        self.update_send_button()
+        self.refresh_quota_label(schedule=False)
+        if request_info:
+            self.show_request_tokens(request_info)
+        self.refresh_stats_panel()
+        self.auto_title(chat_id, user_text)
+
+    def auto_title(self, chat_id, user_text):
+        current_chat = self.chats[chat_id]
         # 保留：如果用户未手动修改标题，发送第一条消息后自动用内容命名
-        if len(current_chat["messages"]) == 2 and current_chat["title"] == "新对话":
+        if current_chat["message_count"] == 2 and current_chat["title"] == "新对话":
             current_chat["title"] = user_text[:30]
+            self.title_index.add(current_chat["title"])
+            self.chat_store.update_chat(chat_id, title=current_chat["title"])
             self.refresh_chat_list()
-        self.save_history()
+
+    # ---------- 多模型同时发送 ----------
+
+    def update_fanout_label(self):
+        self.fanout_label.configure(text="对比模型：" + ("、".join(self.fanout_models) or "未选择"))
+
+    def choose_fanout_models(self):
+        dialog = tk.Toplevel(self)
+        dialog.title("选择同时发送的模型")
+        dialog.resizable(False, False)
+        dialog.grab_set()
+        tk.Label(dialog, text="同时发送到以下模型：", font=("Microsoft YaHei", 12)).pack(pady=(14, 6), padx=20, anchor="w")
+        choices = {}
+        for name in self.model_option.cget("values"):
+            var = tk.BooleanVar(value=name in self.fanout_models)
+            tk.Checkbutton(dialog, text=name, variable=var, font=("Microsoft YaHei", 11)).pack(padx=20, anchor="w")
+            choices[name] = var
+
+        def on_ok():
+            self.fanout_models = [name for name, var in choices.items() if var.get()]
+            self.update_fanout_label()
+            dialog.destroy()
+        tk.Button(dialog, text="确定", font=("Microsoft YaHei", 12), command=on_ok, width=8).pack(pady=10)
+        dialog.wait_window()
+
+    def open_compare_window(self, models, race):
+        """打开（或重建）多模型对比窗口，每个模型一列"""
+        if self.compare_window is None or not self.compare_window.winfo_exists():
+            self.compare_window = ctk.CTkToplevel(self)
+            self.compare_window.geometry(f"{min(1500, 420 * len(models))}x560")
+        else:
+            for child in self.compare_window.winfo_children():
+                child.destroy()
+        window = self.compare_window
+        window.title("抢答：最快的完整回复" if race else "多模型对比")
+        window.grid_rowconfigure(1, weight=1)
+        self.compare_views = {}
+        for column, name in enumerate(models):
+            window.grid_columnconfigure(column, weight=1, uniform="compare")
+            header = ctk.CTkLabel(window, text=f"{name}\n等待回复…", font=("Microsoft YaHei", 12, "bold"))
+            header.grid(row=0, column=column, padx=6, pady=(8, 4), sticky="w")
+            box = ctk.CTkTextbox(window, wrap="word", font=("Microsoft YaHei", 12))
+            box.grid(row=1, column=column, padx=6, pady=(0, 8), sticky="nsew")
+            box.configure(state="disabled")
+            self.compare_views[name] = (header, box)
+        window.lift()
+        return self.compare_views
+
+    def compare_append(self, views, model_name, text):
+        # 窗口已关闭或已被新的请求复用时忽略
+        if views is not self.compare_views or not self.compare_window.winfo_exists():
+            return
+        box = views[model_name][1]
+        box.configure(state="normal")
+        box.insert("end", text)
+        box.configure(state="disabled")
+        box.see("end")
+
+    def compare_result(self, views, result):
+        if views is not self.compare_views or not self.compare_window.winfo_exists():
+            return
+        header = views[result["model"]][0]
+        if result["status"] == "ok":
+            ttft = "--" if result["ttft_ms"] is None else f"{result['ttft_ms']:.0f}"
+            status = f"{'✓ 最快  ' if result['winner'] else ''}首字 {ttft} ms / 总耗时 {result['total_ms']:.0f} ms"
+        elif result["status"] == "error":
+            status = f"出错：{result['error']}"[:60]
+        else:
+            status = "已取消"
+        header.configure(text=f"{result['model']}\n{status}")
+
+    def send_fan_out(self, chat_id, history, user_text, temperature, top_p, prompt):
+        """把同一条消息同时发给多个模型，结果并排显示在对比窗口中"""
+        models = list(self.fanout_models)
+        race = self.race_var.get()
+        views = self.open_compare_window(models, race)
+
+        def task(cancel_event):
+            return self.get_client().generate_fan_out(
+                models,
+                history=history,
+                new_prompt=user_text,
+                temperature=temperature,
+                top_p=top_p,
+                system_instruction=prompt,
+                race=race,
+                cancel_event=cancel_event,
+                on_chunk=lambda name, text: self.ui_pump.call(lambda: self.compare_append(views, name, text)),
+                on_result=lambda result: self.ui_pump.call(lambda: self.compare_result(views, result))
+            )
+
+        future = self.request_engine.submit_task(chat_id, task)
+        future.add_done_callback(
+            lambda f: self.ui_pump.call(lambda: self.finish_fan_out(chat_id, f, user_text, views))
+        )
+        self.update_send_button()
+
+    @staticmethod
+    def format_fan_out(results):
+        """写入对话记录的文本：抢答模式只保留胜出的回复，对比模式每个模型一段"""
+        for result in results:
+            if result["winner"]:
+                return result["text"]
+        sections = []
+        for result in results:
+            if result["status"] == "ok":
+                sections.append(f"【{result['model']}，{result['total_ms']:.0f} ms】\n{result['text']}")
+            elif result["status"] == "error":
+                sections.append(f"【{result['model']}】【出错】{result['error']}")
+            else:
+                sections.append(f"【{result['model']}】{result['text']}【已停止】")
+        return "\n\n".join(sections)
+
+    def finish_fan_out(self, chat_id, future, user_text, views):
+        if chat_id not in self.chats:
+            self.update_send_button()
+            return
+        if future.cancelled():
+            logger.info("多模型请求已取消")
+            response_text = "【已停止】"
+        elif future.exception() is not None:
+            logger.error(f"多模型请求失败: {future.exception()}")
+            response_text = f"【出错】{future.exception()}"
+        else:
+            results = future.result()
+            # 抢答模式下被取消的模型不会回调 on_result，这里统一刷新对比窗口的状态
+            for result in results:
+                self.compare_result(views, result)
+            response_text = self.format_fan_out(results)
+        show = self.tail_displayed(chat_id)
+        self.append_message(chat_id, "Gemini", response_text)
+        if show:
+            self.chat_display.configure(state="normal")
+            self.chat_display.insert("end", self.format_message("Gemini", response_text))
+            self.display_end += 1
+            self.trim_display_top()
+            self.chat_display.configure(state="disabled")
+            self.chat_display.see("end")
+        self.update_send_button()
+        self.refresh_quota_label(schedule=False)
+        self.refresh_stats_panel()
+        self.auto_title(chat_id, user_text)
 
     def send_message_event(self, event):
         self.send_message()
@@ -324,54 +713,118 @@ class ChatApp(ctk.CTk):
     def add_message_to_display(self, sender, message):
         if not self.current_chat_id: return
         
-        self.chats[self.current_chat_id]["messages"].append((sender, message))
+        show = self.tail_displayed(self.current_chat_id)
+        self.append_message(self.current_chat_id, sender, message)
         
-        if self.current_chat_id == self.get_displayed_chat_id():
+        if show:
             self.chat_display.configure(state="normal")
-            self.chat_display.insert("end", f"{sender}:\n{message}\n\n")
+            self.chat_display.insert("end", self.format_message(sender, message))
+            self.display_end += 1
+            self.trim_display_top()
             self.chat_display.configure(state="disabled")
             self.chat_display.see("end")
+        elif self.current_chat_id == self.get_displayed_chat_id():
+            # 正在查看较早的消息，回到最新一页
+            self.render_range(self.current_chat_id)
+
+    @staticmethod
+    def format_message(sender, message):
+        return f"{sender}:\n{message}\n\n"
+
+    @staticmethod
+    def message_lines(message):
+        # format_message 产生的换行数
+        return message.count("\n") + 3
+
+    def tail_displayed(self, chat_id):
+        """该对话正在显示，且文本框中包含最新的消息"""
+        if chat_id != self.get_displayed_chat_id():
+            return False
+        messages = self.chats[chat_id]["messages"]
+        return messages is not None and self.display_end == len(messages)
+
+    def render_range(self, chat_id, start=None, end=None):
+        """一次性渲染消息区间 [start, end)，默认是最新的一页"""
+        messages = self.ensure_messages(chat_id)
+        end = len(messages) if end is None else min(end, len(messages))
+        start = max(0, end - self.RENDER_PAGE) if start is None else max(0, start)
+        text = "".join(self.format_message(sender, msg) for sender, msg in messages[start:end])
+        # 该对话仍在生成中时，补上已收到的部分回复
+        if end == len(messages) and chat_id in self.stream_buffers:
+            text += "Gemini:\n" + "".join(self.stream_buffers[chat_id])
+        self.display_start, self.display_end = start, end
+        self.chat_display.configure(state="normal")
+        self.chat_display.delete("1.0", "end")
+        self.chat_display.insert("end", text)
+        self.chat_display.configure(state="disabled")
+
+    def trim_display_top(self):
+        """文本框中的消息超过上限时，删除最上面的若干条"""
+        excess = self.display_end - self.display_start - self.RENDER_CAP
+        if excess <= 0:
+            return
+        messages = self.chats[self.current_chat_id]["messages"]
+        lines = sum(self.message_lines(m[1]) for m in messages[self.display_start:self.display_start + excess])
+        self.chat_display.delete("1.0", f"{lines + 1}.0")
+        self.display_start += excess
+
+    def trim_display_bottom(self):
+        excess = self.display_end - self.display_start - self.RENDER_CAP
+        if excess <= 0:
+            return
+        messages = self.chats[self.current_chat_id]["messages"]
+        new_end = self.display_end - excess
+        line = 1 + sum(self.message_lines(m[1]) for m in messages[self.display_start:new_end])
+        self.chat_display.delete(f"{line}.0", "end")
+        self.display_end = new_end
+
+    def on_display_scroll(self, first, last):
+        self.chat_display._y_scrollbar.set(first, last)
+        chat_id = self.get_displayed_chat_id()
+        if chat_id is None or chat_id not in self.chats or self.chats[chat_id]["messages"] is None:
+            return
+        if self._page_job is not None:
+            return
+        if float(first) <= 0.0 and self.display_start > 0:
+            self._page_job = self.after_idle(self.load_older_page)
+        elif float(last) >= 1.0 and self.display_end < len(self.chats[chat_id]["messages"]):
+            self._page_job = self.after_idle(self.load_newer_page)
+
+    def load_older_page(self):
+        """滚动到顶部时在文本框开头插入更早的一页消息，并保持当前阅读位置"""
+        self._page_job = None
+        if self.display_start <= 0:
+            return
+        messages = self.chats[self.current_chat_id]["messages"]
+        start = max(0, self.display_start - self.RENDER_PAGE)
+        text = "".join(self.format_message(sender, msg) for sender, msg in messages[start:self.display_start])
+        top_line = int(self.chat_display.index("@0,0").split(".")[0])
+        inserted_lines = text.count("\n")
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("1.0", text)
+        self.display_start = start
+        self.trim_display_bottom()
+        self.chat_display.configure(state="disabled")
+        self.chat_display.yview(f"{top_line + inserted_lines}.0")
+
+    def load_newer_page(self):
+        self._page_job = None
+        messages = self.chats[self.current_chat_id]["messages"]
+        if self.display_end >= len(messages):
+            return
+        end = min(len(messages), self.display_end + self.RENDER_PAGE)
+        text = "".join(self.format_message(sender, msg) for sender, msg in messages[self.display_end:end])
+        if end == len(messages) and self.current_chat_id in self.stream_buffers:
+            text += "Gemini:\n" + "".join(self.stream_buffers[self.current_chat_id])
+        self.chat_display.configure(state="normal")
+        self.chat_display.insert("end", text)
+        self.display_end = end
+        self.trim_display_top()
+        self.chat_display.configure(state="disabled")
 
     def refresh_chat_list(self):
-        for widget in self.chat_list_frame.winfo_children():
-            widget.destroy()
-        self.chat_buttons.clear()
-        self.rename_buttons.clear()
-        for cid in reversed(list(self.chats.keys())):
-            chat = self.chats[cid]
-            title = chat["title"]
-            frame = ctk.CTkFrame(self.chat_list_frame, fg_color="#ffffff")
-            frame.pack(fill="x", pady=2)
-            btn = ctk.CTkButton(
-                frame,
-                text=title,
-                fg_color="#ffffff",
-                text_color="#222222",
-                command=lambda c=cid: self.switch_chat(c),
-                font=("Microsoft YaHei", 12),
-                width=140,
-                anchor="w"
-            )
-            def on_enter(e, b=btn, c=cid):
-                b.configure(fg_color="#3498db", text_color="#ffffff")
-            def on_leave(e, b=btn, c=cid):
-                b.configure(fg_color="#ffffff", text_color="#222222")
-            btn.bind("<Enter>", on_enter)
-            btn.bind("<Leave>", on_leave)
-            btn.pack(side="left", fill="x", expand=True)
-            self.chat_buttons[cid] = btn
-            rename_btn = ctk.CTkButton(
-                frame,
-                text="🖉",  # 编辑图标
-                width=32,
-                fg_color="#ffffff",
-                text_color=("#666", "#aaa"),
-                hover_color=("#e0e0e0", "#444444"),
-                command=lambda c=cid: self.rename_chat(c),
-                font=("Microsoft YaHei", 13)
-            )
-            rename_btn.pack(side="right", padx=(2, 0))
-            self.rename_buttons[cid] = rename_btn
+        # 列表控件只更新发生变化的可见行
+        self.chat_list.set_items([(cid, self.chats[cid]["title"]) for cid in reversed(self.chats)])
 
     def switch_chat(self, chat_id):
         if chat_id not in self.chats:
@@ -379,142 +832,307 @@ class ChatApp(ctk.CTk):
         self.current_chat_id = chat_id
         # 切换时显示当前对话的prompt
         self.prompt_var.set(self.chats[chat_id].get("prompt", ""))
-        # 切换对话时也重建模型对象
-        model_name = self.model_var.get()
-        prompt = self.chats[chat_id].get("prompt", "")
-        self.gemini_client.set_model(model_name, system_instruction=prompt)
-        self.chat_display.configure(state="normal")
-        self.chat_display.delete("1.0", "end")
-        for sender, msg in self.chats[chat_id]["messages"]:
-            self.chat_display.insert("end", f"{sender}:\n{msg}\n\n")
-        self.chat_display.configure(state="disabled")
+        # 只渲染最新的一页，切换耗时与对话长度无关
+        self.render_range(chat_id)
         self.chat_display.see("end")
-        self.refresh_chat_list()
+        self.update_send_button()
     
+    def on_search_input(self, event=None):
+        # 输入停顿后再检索，避免每次按键都查询
+        if self._search_job is not None:
+            self.after_cancel(self._search_job)
+        self._search_job = self.after(250, self.run_search)
+
+    def run_search(self):
+        self._search_job = None
+        query = self.search_var.get().strip()
+        for widget in self.search_results_frame.winfo_children():
+            widget.destroy()
+        if not query:
+            self.search_results_frame.pack_forget()
+            return
+        hits = self.chat_store.search(query, limit=30)
+        if not self.search_results_frame.winfo_ismapped():
+            self.search_results_frame.pack(pady=(0, 8), fill="x", padx=10, after=self.search_entry)
+        if not hits:
+            ctk.CTkLabel(self.search_results_frame, text="没有找到匹配的消息", font=("Microsoft YaHei", 11), text_color="#888888").pack(anchor="w")
+            return
+        for chat_id, title, seq, sender, text in hits:
+            snippet = " ".join(text.split())[:24]
+            ctk.CTkButton(
+                self.search_results_frame,
+                text=f"{title}｜{snippet}",
+                fg_color="transparent",
+                text_color="#222222",
+                hover_color="#dfe6e9",
+                anchor="w",
+                font=("Microsoft YaHei", 11),
+                command=lambda c=chat_id, n=seq: self.open_search_hit(c, n)
+            ).pack(fill="x")
+
+    def open_search_hit(self, chat_id, seq):
+        """切换到命中的对话并定位、高亮对应消息"""
+        if chat_id not in self.chats:
+            return
+        self.switch_chat(chat_id)
+        messages = self.chats[chat_id]["messages"]
+        if seq >= len(messages):
+            return
+        if not self.display_start <= seq < self.display_end:
+            # 命中的消息不在当前渲染区间内，渲染以它为中心的一页
+            self.render_range(chat_id, seq - self.RENDER_PAGE // 2, seq + self.RENDER_PAGE // 2)
+        line = 1 + sum(self.message_lines(m[1]) for m in messages[self.display_start:seq])
+        end_line = line + messages[seq][1].count("\n") + 1
+        self.chat_display.tag_remove("search_hit", "1.0", "end")
+        self.chat_display.tag_add("search_hit", f"{line}.0", f"{end_line}.end")
+        self.chat_display.tag_config("search_hit", background="#fff3b0")
+        self.chat_display.see(f"{line}.0")
+
     def get_displayed_chat_id(self):
         return self.current_chat_id
 
     def get_safe_filename(self, title, ext=".json"):
-        # 允许中文，去除不合法字符，重名自动加后缀
-        safe_title = re.sub(r'[\\/:*?"<>|]', '_', title)
-        base = os.path.join("history", safe_title)
-        filename = base + ext
-        i = 1
-        while os.path.exists(filename):
-            filename = f"{base}_{i}{ext}"
-            i += 1
-        return filename
+        # 允许中文，去除不合法字符，重名自动加后缀；history 目录只扫描一次，之后在索引中查重
+        if self._history_names is None:
+            os.makedirs("history", exist_ok=True)
+            self._history_names = TitleIndex(
+                name[:-len(ext)] for name in os.listdir("history") if name.endswith(ext)
+            )
+        return os.path.join("history", self._history_names.unique(safe_filename(title)) + ext)
 
     def save_current_chat_to_file(self):
         if not self.current_chat_id:
             return
         chat = self.chats[self.current_chat_id]
         os.makedirs("history", exist_ok=True)
-        filename = self.get_safe_filename(chat["title"])
-        with open(filename, "w", encoding="utf-8") as f:
-            json.dump(chat, f, ensure_ascii=False, indent=2)
+        data = {
+            "title": chat["title"],
+            "messages": [list(m) for m in self.ensure_messages(self.current_chat_id)],
+            "prompt": chat.get("prompt", ""),
+        }
+        while True:
+            filename = self.get_safe_filename(chat["title"])
+            try:
+                # "x" 模式：文件在索引建立后被外部创建时不会被覆盖，换下一个名称
+                with open(filename, "x", encoding="utf-8") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+                break
+            except FileExistsError:
+                continue
         logger.info(f"保存对话到文件: {filename}")
         messagebox.showinfo("保存成功", f"对话已保存到：{filename}")
 
     def import_chat_from_file(self):
-        file_path = filedialog.askopenfilename(
+        paths = filedialog.askopenfilenames(
             title="导入历史对话",
-            filetypes=[("对话历史", "*.json")],
+            filetypes=[("对话历史或压缩包", "*.json *.zip"), ("对话历史", "*.json"), ("压缩包", "*.zip")],
             initialdir="history"
         )
-        if not file_path:
+        if not paths:
             return
-        try:
-            logger.info(f"导入对话文件: {file_path}")
-            with open(file_path, "r", encoding="utf-8") as f:
-                chat = json.load(f)
-            # 数据健壮性校验和修复
-            if "messages" not in chat or not isinstance(chat["messages"], list):
-                chat["messages"] = []
-            # 修正messages内部元素类型（如有元组转为列表）
-            chat["messages"] = [list(m) if isinstance(m, tuple) else m for m in chat["messages"]]
-            if "prompt" not in chat or not isinstance(chat["prompt"], str):
-                chat["prompt"] = ""
-            # 生成唯一ID，避免冲突
-            chat_id = str(uuid.uuid4())
-            # 如果title重名自动加后缀
-            title = chat.get("title", "导入对话")
-            exist_titles = {c["title"] for c in self.chats.values()}
-            orig_title = title
-            i = 1
-            while title in exist_titles:
-                title = f"{orig_title}_{i}"
-                i += 1
-            chat["title"] = title
-            # 弹窗询问导入方式
-            import tkinter.simpledialog
-            import tkinter.messagebox
-            result = tkinter.messagebox.askquestion(
+        replace = False
+        if len(paths) == 1 and paths[0].lower().endswith(".json"):
+            # 单个对话文件时保留原来的导入方式选择
+            result = messagebox.askquestion(
                 "导入方式选择",
                 "请选择导入方式：\n是 - 替换所有历史\n否 - 作为新对话导入",
                 icon='question'
             )
-            if result == 'yes':
-                # 替换所有历史
-                self.chats = {chat_id: chat}
-                self.current_chat_id = chat_id
-                self.switch_chat(chat_id)
-                self.refresh_chat_list()
-                messagebox.showinfo("导入成功", f"已替换所有历史，当前对话：{title}")
-            else:
-                # 作为新对话导入
-                self.chats[chat_id] = chat
-                self.current_chat_id = chat_id
-                self.switch_chat(chat_id)
-                self.refresh_chat_list()
-                messagebox.showinfo("导入成功", f"已导入对话：{title}")
-        except Exception as e:
-            messagebox.showerror("导入失败", f"导入失败：{e}")
+            replace = result == 'yes'
+        self.start_import(list(paths), replace)
+
+    def import_chat_folder(self):
+        folder = filedialog.askdirectory(title="导入文件夹中的所有对话", initialdir="history")
+        if folder:
+            self.start_import([folder])
 
-    def save_history(self):
-        # 不再自动保存，保留空实现以兼容原有调用
-        pass
+    def start_import(self, paths, replace=False):
+        """在后台解析并写入存储（多个文件时使用进程池），界面不阻塞；完成后一次性刷新列表"""
+        logger.info(f"导入对话: {paths}")
+        # 替换模式下标题只需与本次导入的对话去重
+        titles = TitleIndex() if replace else self.title_index
+        self.import_chat_btn.configure(state="disabled", text="导入中...")
+        self.import_folder_btn.configure(state="disabled")
+        future = self.request_engine.submit_call(
+            lambda: import_into_store(self.chat_store, paths, titles, replace=replace)
+        )
+        future.add_done_callback(lambda f: self.ui_pump.call(lambda: self.finish_import(f, replace, titles)))
+
+    def finish_import(self, future, replace, titles):
+        self.import_chat_btn.configure(state="normal", text="导入历史对话")
+        self.import_folder_btn.configure(state="normal")
+        if future.exception() is not None:
+            messagebox.showerror("导入失败", f"导入失败：{future.exception()}")
+            return
+        entries, failed = future.result()
+        if not entries:
+            detail = "\n".join(f"{desc}: {error}" for desc, error in failed[:5])
+            messagebox.showerror("导入失败", f"没有导入任何对话\n{detail}")
+            return
+        if replace:
+            self.chats = {}
+            self._loaded_chats = OrderedDict()
+            self.title_index = titles
+        self.chats.update(entries)
+        chat_id = list(entries)[-1]
+        self.current_chat_id = chat_id
+        self.switch_chat(chat_id)
+        self.refresh_chat_list()
+        if replace:
+            messagebox.showinfo("导入成功", f"已替换所有历史，当前对话：{entries[chat_id]['title']}")
+        elif len(entries) == 1 and not failed:
+            messagebox.showinfo("导入成功", f"已导入对话：{entries[chat_id]['title']}")
+        else:
+            text = f"已导入 {len(entries)} 个对话"
+            if failed:
+                text += f"，{len(failed)} 个文件解析失败（详见日志）"
+            messagebox.showinfo("导入完成", text)
+
+    def export_all_chats(self):
+        path = filedialog.asksaveasfilename(
+            title="导出全部对话",
+            defaultextension=".zip",
+            filetypes=[("压缩包", "*.zip")],
+            initialfile=f"gemini_chats_{time.strftime('%Y%m%d_%H%M%S')}.zip"
+        )
+        if not path:
+            return
+        # 已加载的对话直接使用内存中的消息，其余的在后台线程中从存储读取
+        chats = [
+            (chat_id, chat["title"], chat.get("prompt", ""),
+             list(chat["messages"]) if chat["messages"] is not None else None)
+            for chat_id, chat in self.chats.items()
+        ]
+        self.export_all_btn.configure(state="disabled", text="导出中...")
+        future = self.request_engine.submit_call(
+            lambda: export_archive(chats, self.chat_store.load_messages, path)
+        )
+        future.add_done_callback(lambda f: self.ui_pump.call(lambda: self.finish_export(f, path)))
+
+    def finish_export(self, future, path):
+        self.export_all_btn.configure(state="normal", text="导出全部")
+        if future.exception() is not None:
+            messagebox.showerror("导出失败", f"导出失败：{future.exception()}")
+        else:
+            messagebox.showinfo("导出成功", f"已导出 {future.result()} 个对话到：{path}")
 
     def load_history(self):
-        if os.path.exists(self.HISTORY_FILE):
-            try:
-                with open(self.HISTORY_FILE, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    if content:
-                        self.chats = json.load(f)
-                    else:
-                        self.chats = {}
-            except (json.JSONDecodeError, Exception) as e:
-                print(f"加载历史失败: {e}")
-                self.chats = {}
+        """启动时只加载对话索引，消息在切换到对话时再加载"""
+        try:
+            self.chat_store.migrate_json(self.HISTORY_FILE)
+            self.chats = self.chat_store.load_index()
+        except Exception as e:
+            logger.error(f"加载历史失败: {e}")
+            self.chats = {}
+        # 导入时标题去重用的索引，之后随新建 / 重命名维护
+        self.title_index = TitleIndex(chat["title"] for chat in self.chats.values())
 
     def apply_prompt(self):
         if not self.current_chat_id:
             return
         prompt = self.prompt_var.get()
         self.chats[self.current_chat_id]["prompt"] = prompt
-        model_name = self.model_var.get()
-        self.gemini_client.set_model(model_name, system_instruction=prompt)
+        # 模型和系统指令在每次请求时传给客户端，这里只需保存
+        self.chat_store.update_chat(self.current_chat_id, prompt=prompt)
         logger.info(f"应用系统提示词: {prompt[:50]}...")  # 记录提示词（前50字符）
         self.apply_prompt_btn.configure(text="√")
         self.after(1500, lambda: self.apply_prompt_btn.configure(text="应用"))
 
-    def on_model_change(self, *args):
-        if not self.current_chat_id:
+    def show_request_tokens(self, request_info):
+        text = f"上次请求：约 {request_info.get('prompt_tokens', 0)} tokens"
+        if request_info.get("dropped_messages"):
+            text += f"，丢弃 {request_info['dropped_messages']} 条旧消息"
+        self.tokens_label.configure(text=text)
+
+    def toggle_stats_panel(self):
+        if self.stats_var.get():
+            self.stats_label.pack(after=self.stats_checkbox, pady=(0, 10), padx=10, anchor="w")
+            self.refresh_stats_panel()
+        else:
+            self.stats_label.pack_forget()
+
+    def refresh_stats_panel(self):
+        """显示当前模型最近请求的首字 / 总耗时分位数和生成速度"""
+        if not self.stats_var.get() or self.gemini_client is None:
             return
-        prompt = self.chats[self.current_chat_id].get("prompt", "")
-        model_name = self.model_var.get()
-        self.gemini_client.set_model(model_name, system_instruction=prompt)
+
+        def fmt(value, unit="ms"):
+            return "--" if value is None else f"{value:.0f} {unit}"
+
+        stats = self.gemini_client.telemetry.summary(self.model_var.get())
+        frame = self.ui_pump.stats()
+        self.stats_label.configure(text=(
+            f"请求 {stats['requests']}（失败 {stats['errors']}，取消 {stats['cancelled']}，缓存 {stats['cached']}）\n"
+            f"首字 p50 {fmt(stats['ttft_p50_ms'])} / p95 {fmt(stats['ttft_p95_ms'])}\n"
+            f"总耗时 p50 {fmt(stats['latency_p50_ms'])} / p95 {fmt(stats['latency_p95_ms'])}\n"
+            f"排队 p50 {fmt(stats['queue_p50_ms'])}，速度 {fmt(stats['tokens_per_sec_avg'], 'tok/s')}\n"
+            f"{self.connection_latency_text()}\n"
+            f"界面帧耗时 平均 {frame['avg_frame_ms']:.1f} ms"
+        ))
+
+    def connection_latency_text(self):
+        """连接预热测得的冷启动 / 预热后耗时"""
+        latency = self.gemini_client.connection_latency(self.model_var.get())
+        if latency is None:
+            return "连接：尚未预热"
+        return (f"连接（{latency['transport']} × {latency['connections']}）："
+                f"冷 {latency['cold_ms']:.0f} ms / 热 {latency['warm_ms']:.0f} ms")
+
+    def on_cache_toggle(self):
+        # 客户端尚未就绪时，on_client_ready 会同步该设置
+        if self.gemini_client is not None:
+            self.gemini_client.cache_enabled = self.cache_var.get()
+        logger.info(f"回复缓存: {'开启' if self.cache_var.get() else '关闭'}")
+
+    def refresh_quota_label(self, schedule=True):
+        """显示当前模型的剩余配额，并定时刷新（令牌桶会随时间恢复）"""
+        if self.gemini_client is None:
+            self.quota_label.configure(text="剩余配额：--")
+        else:
+            per_minute, per_day = self.gemini_client.get_remaining_quota(self.model_var.get())
+            text = f"剩余配额：本分钟 {per_minute} / 今日 {per_day}"
+            key_pool = self.gemini_client.key_pool
+            if len(key_pool) > 1:
+                text += f"\n可用密钥：{key_pool.available()} / {len(key_pool)}"
+            self.quota_label.configure(text=text)
+        if schedule:
+            self.after(5000, self.refresh_quota_label)
+
+    def on_model_change(self, *args):
+        # 下一次请求会使用新选择的模型，提前在后台建立连接
+        if self.gemini_client is not None:
+            self.gemini_client.prewarm(self.model_var.get())
+        self.refresh_quota_label(schedule=False)
+        self.refresh_stats_panel()
 
 
 if __name__ == "__main__":
+    # 打包为可执行文件后，子进程需要由此进入进程池的工作循环
+    multiprocessing.freeze_support()
     ctk.set_appearance_mode("System")
     ctk.set_default_color_theme("blue")
 
     try:
-        client = GeminiClient(model_name="gemini-2.0-flash")
-        app = ChatApp(gemini_client=client)
+        # --startup-check：输出各启动阶段耗时，超过阈值时以非零状态退出
+        startup_check = "--startup-check" in sys.argv
+        # --transport grpc|rest：连接方式；--pool-size N：每个 API 密钥的连接数
+        transport = argv_option("--transport")
+        pool_size = int(argv_option("--pool-size", 1))
+        app = ChatApp(
+            client_factory=lambda: GeminiClient(
+                model_name="gemini-2.0-flash",
+                cache_dir="cache",
+                telemetry=Telemetry(jsonl_path="metrics/requests.jsonl", prometheus_path="metrics/gemini.prom"),
+                transport=transport,
+                pool_size=pool_size,
+                quota_state_path="quota_state.json"
+            ),
+            startup_timer=startup,
+            startup_check=startup_check
+        )
         app.mainloop()
+        if startup_check:
+            sys.exit(app.startup_exit_code or 0)
     except Exception as e:
         print(f"启动应用失败: {e}")
         import traceback
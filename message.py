@@ -0,0 +1,99 @@
+# message.py
+import hashlib
+import sys
+import time
+
+ROLE_USER = "user"
+ROLE_MODEL = "model"
+ROLE_SYSTEM = "system"
+
+# 界面上的发送者名称与 API 角色的对应关系
+_SENDER_TO_ROLE = {"You": ROLE_USER, "Gemini": ROLE_MODEL, "System": ROLE_SYSTEM}
+_ROLE_TO_SENDER = {role: sender for sender, role in _SENDER_TO_ROLE.items()}
+
+
+class Message:
+    """
+    一条对话消息。
+    使用 __slots__，角色字符串经过 intern，所有消息共用同一个对象；
+    token 数和 API 所需的 {"role", "parts"} 在第一次使用时计算并保存，之后的请求直接复用。
+    上下文缓存使用的前缀状态（从对话开头到本条消息的哈希和 token 数）同样保存在消息上，由前一条消息增量计算。
+    兼容旧的 (sender, text) 元组用法：可以解包、下标访问和 list(message)。
+    """
+
+    __slots__ = ("role", "text", "timestamp", "_tokens", "_payload", "_prefix")
+
+    def __init__(self, role, text, timestamp=None):
+        self.role = sys.intern(role)
+        self.text = text
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self._tokens = None
+        self._payload = None
+        self._prefix = None  # (前一条消息, 前缀哈希, 前缀 token 数)
+
+    @classmethod
+    def from_sender(cls, sender, text, timestamp=None):
+        """由界面上的发送者名称（You / Gemini / System）创建"""
+        return cls(_SENDER_TO_ROLE.get(sender, ROLE_MODEL), text, timestamp)
+
+    @classmethod
+    def coerce(cls, item):
+        """Message 原样返回，(sender, text) 元组转换为 Message"""
+        if isinstance(item, cls):
+            return item
+        sender, text = item
+        return cls.from_sender(sender, text)
+
+    @property
+    def sender(self):
+        return _ROLE_TO_SENDER.get(self.role, "Gemini")
+
+    def token_count(self, count_fn):
+        if self._tokens is None:
+            self._tokens = count_fn(self.text)
+        return self._tokens
+
+    def prefix_after(self, prev):
+        """前一条消息为 prev（第一条消息为 None）时已计算的 (前缀哈希, 前缀 token 数)，没有时返回 None"""
+        if self._prefix is None or self._prefix[0] is not prev:
+            return None
+        return self._prefix[1], self._prefix[2]
+
+    def extend_prefix(self, prev, count_fn):
+        """在 prev 的前缀状态上追加本条消息；prev 的前缀状态必须已经计算"""
+        prev_hash, prev_tokens = prev._prefix[1:] if prev is not None else (b"", 0)
+        digest = hashlib.sha256(prev_hash)
+        digest.update(self.role.encode("utf-8") + b"\0")
+        digest.update(self.text.encode("utf-8", "surrogatepass"))
+        self._prefix = (prev, digest.digest(), prev_tokens + self.token_count(count_fn))
+        return self._prefix[1:]
+
+    def payload(self):
+        """API 请求中的消息；调用方不能修改返回的字典"""
+        if self._payload is None:
+            self._payload = {"role": self.role, "parts": [self.text]}
+        return self._payload
+
+    # ---------- 与 (sender, text) 元组兼容 ----------
+
+    def __iter__(self):
+        yield self.sender
+        yield self.text
+
+    def __len__(self):
+        return 2
+
+    def __getitem__(self, index):
+        return (self.sender, self.text)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, Message):
+            return self.role == other.role and self.text == other.text
+        if isinstance(other, tuple):
+            return tuple(self) == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return f"Message({self.role!r}, {self.text[:30]!r})"
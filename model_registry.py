@@ -0,0 +1,83 @@
+# model_registry.py
+import json
+import os
+import threading
+import time
+import logging
+
+from gemini_client import load_sdk, read_api_key
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 拿不到真实列表（离线、首次启动尚未刷新）时使用的模型
+DEFAULT_MODELS = ["gemini-2.0-flash", "gemini-2.5-flash", "gemini-2.5-pro"]
+
+
+def _short_name(name):
+    return name.split("/", 1)[1] if name.startswith("models/") else name
+
+
+class ModelRegistry:
+    """
+    可用模型列表的磁盘缓存（TTL），界面和 check_models.py 共用。
+    每条记录包含模型名、显示名、支持的生成方法和输入 / 输出 token 上限。
+    """
+
+    def __init__(self, cache_path="models_cache.json", ttl=24 * 3600):
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def load_cached(self):
+        """读取磁盘缓存，返回 (模型列表, 获取时间)；没有缓存时返回 ([], 0)"""
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            return data["models"], data["fetched_at"]
+        except (OSError, ValueError, KeyError):
+            return [], 0
+
+    def is_stale(self):
+        models, fetched_at = self.load_cached()
+        return not models or time.time() - fetched_at > self.ttl
+
+    def refresh(self, api_key=None, transport=None):
+        """
+        从 API 拉取模型列表并写入缓存，返回模型列表。
+        使用独立的 ModelServiceClient，不修改全局 configure（界面中的请求可能正在使用其连接方式）。
+        """
+        api_key = api_key or read_api_key()
+        if not api_key:
+            raise ValueError("API Key not found. Please make sure api.txt exists and contains your API key.")
+        sdk = load_sdk()
+        models = []
+        for m in sdk.list_models(client=sdk.model_client(api_key, transport=transport)):
+            methods = list(getattr(m, "supported_generation_methods", []) or [])
+            models.append({
+                "name": _short_name(m.name),
+                "display_name": getattr(m, "display_name", "") or "",
+                "methods": methods,
+                "input_token_limit": getattr(m, "input_token_limit", None),
+                "output_token_limit": getattr(m, "output_token_limit", None),
+            })
+        with self._lock:
+            tmp_path = self.cache_path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": time.time(), "models": models}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.cache_path)
+        logger.info(f"已刷新模型列表，共 {len(models)} 个模型")
+        return models
+
+    def get_models(self, force_refresh=False):
+        """读穿缓存：缓存有效时直接返回，否则联网刷新"""
+        if not force_refresh:
+            models, fetched_at = self.load_cached()
+            if models and time.time() - fetched_at <= self.ttl:
+                return models
+        return self.refresh()
+
+    @staticmethod
+    def chat_model_names(models):
+        """支持 generateContent（可用于聊天）的模型短名"""
+        return [m["name"] for m in models if "generateContent" in m.get("methods", [])]
@@ -0,0 +1,244 @@
+# quota_scheduler.py
+import json
+import os
+import random
+import threading
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 免费层配额（每分钟请求数, 每天请求数），按模型名关键字匹配
+DEFAULT_LIMITS = {
+    "pro": (5, 50),
+    "flash": (15, 1500),
+}
+FALLBACK_LIMITS = (15, 1500)
+
+# 需要退避重试的 HTTP 状态码
+RETRYABLE_CODES = {429, 500, 502, 503, 504}
+
+# API 的每日配额在太平洋时间午夜重置
+try:
+    from zoneinfo import ZoneInfo
+    _QUOTA_TZ = ZoneInfo("America/Los_Angeles")
+except (ImportError, KeyError):
+    # 没有时区数据（部分 Windows 环境未安装 tzdata）时按太平洋标准时间计算，夏令时期间晚一小时清零，偏保守
+    _QUOTA_TZ = timezone(timedelta(hours=-8))
+
+
+class QuotaExceededError(Exception):
+    """本地配额已用尽，且等待时间超过允许范围"""
+
+
+class TokenBucket:
+    """经典令牌桶：容量 capacity，每 period 秒匀速补满"""
+
+    def __init__(self, capacity, period):
+        self.capacity = float(capacity)
+        self.rate = capacity / float(period)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """距离有一个可用令牌还需等待的秒数"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def remaining(self, now):
+        self._refill(now)
+        return int(self.tokens)
+
+
+def quota_day(now=None):
+    """返回 (当前配额日期, 距离下次每日配额重置的秒数)"""
+    now = time.time() if now is None else now
+    current = datetime.fromtimestamp(now, _QUOTA_TZ)
+    midnight = datetime.combine(current.date() + timedelta(days=1), datetime.min.time(), tzinfo=_QUOTA_TZ)
+    # 用时间戳相减，夏令时切换当天也准确
+    return current.date().isoformat(), midnight.timestamp() - now
+
+
+class DailyQuota:
+    """
+    每天请求数的固定窗口计数：与 API 一致，在太平洋时间午夜清零。
+    不能用令牌桶：令牌桶每次启动都是满的，并且随时间匀速恢复，重启几次就会远超实际配额。
+    state_path 不为空时计数保存到该 JSON 文件，重启后同一天内继续累计。
+    """
+
+    def __init__(self, state_path=None):
+        self.state_path = state_path
+        self.day, _ = quota_day()
+        self.counts = {}  # model_name -> 今天已发出的请求数
+        self._load()
+
+    def _load(self):
+        if not self.state_path:
+            return
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data["day"] == self.day:
+                self.counts = {str(model): int(count) for model, count in data["counts"].items()}
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logger.warning(f"读取每日配额计数失败，从零开始计数: {e}")
+
+    def _roll(self, now):
+        day, until_reset = quota_day(now)
+        if day != self.day:
+            self.day = day
+            self.counts = {}
+        return until_reset
+
+    def wait_time(self, model_name, limit, now):
+        """额度未用完时返回 0，否则返回距离重置的秒数"""
+        until_reset = self._roll(now)
+        return 0.0 if self.counts.get(model_name, 0) < limit else until_reset
+
+    def take(self, model_name):
+        self.counts[model_name] = self.counts.get(model_name, 0) + 1
+
+    def remaining(self, model_name, limit, now):
+        self._roll(now)
+        return max(0, limit - self.counts.get(model_name, 0))
+
+    def snapshot(self):
+        return {"day": self.day, "counts": dict(self.counts)}
+
+    def save(self, snapshot):
+        if not self.state_path:
+            return
+        tmp_path = self.state_path + ".tmp"
+        try:
+            if os.path.dirname(self.state_path):
+                os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_path)
+        except OSError as e:
+            logger.warning(f"保存每日配额计数失败: {e}")
+
+
+def _error_code(error):
+    code = getattr(error, "code", None)
+    # google.api_core 的异常 code 是 int，grpc 的可能是枚举
+    code = getattr(code, "value", code)
+    if isinstance(code, tuple):
+        code = code[0]
+    return code
+
+
+def _is_retryable(error):
+    return _error_code(error) in RETRYABLE_CODES or "429" in str(error)
+
+
+def is_quota_error(error):
+    """配额用尽：API 返回 429，或本地调度层判定额度不足"""
+    return isinstance(error, QuotaExceededError) or _error_code(error) == 429 or "429" in str(error)
+
+
+class QuotaScheduler:
+    """
+    位于 generate_content 前面的调度层：
+    - 每个模型的每分钟额度用令牌桶，每天额度用在太平洋时间午夜清零的计数，额度不足时排队等待；
+    - 429 / 5xx 错误按带抖动的指数退避重试。
+    keys 为 API 密钥数量，免费层配额按密钥计算，总额度随之成倍增加。
+    state_path 不为空时每日计数保存到该文件，重启程序不会重置今日额度。
+    """
+
+    def __init__(self, limits=None, max_retries=4, base_delay=1.0, max_delay=32.0, max_wait=90.0, keys=1,
+                 state_path=None):
+        self.limits = dict(DEFAULT_LIMITS if limits is None else limits)
+        self.keys = max(1, keys)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_wait = max_wait
+        self._buckets = {}  # model_name -> (分钟桶, 每日上限)
+        self._daily = DailyQuota(state_path)
+        self._cond = threading.Condition()
+        self._save_lock = threading.Lock()
+
+    def _limits_for(self, model_name):
+        for keyword, limits in self.limits.items():
+            if keyword in model_name:
+                return limits
+        return FALLBACK_LIMITS
+
+    def _get_buckets(self, model_name):
+        buckets = self._buckets.get(model_name)
+        if buckets is None:
+            rpm, rpd = self._limits_for(model_name)
+            rpm, rpd = rpm * self.keys, rpd * self.keys
+            buckets = (TokenBucket(rpm, 60), rpd)
+            self._buckets[model_name] = buckets
+        return buckets
+
+    def acquire(self, model_name):
+        """阻塞直到该模型有可用额度，然后消耗一个令牌；返回排队等待的秒数"""
+        start = time.monotonic()
+        deadline = start + self.max_wait
+        with self._cond:
+            minute, daily_limit = self._get_buckets(model_name)
+            while True:
+                now = time.monotonic()
+                wait = max(minute.wait_time(now), self._daily.wait_time(model_name, daily_limit, time.time()))
+                if wait <= 0:
+                    minute.take()
+                    self._daily.take(model_name)
+                    break
+                if now + wait > deadline:
+                    raise QuotaExceededError(f"模型 {model_name} 的配额已用尽，请约 {int(wait)} 秒后再试")
+                logger.info(f"模型 {model_name} 接近配额上限，排队等待 {wait:.1f} 秒")
+                self._cond.wait(wait)
+        self._save_daily()
+        return now - start
+
+    def _save_daily(self):
+        # 文件在调度锁外写入；快照在写入锁内获取，较早的快照不会覆盖较新的
+        with self._save_lock:
+            with self._cond:
+                snapshot = self._daily.snapshot()
+            self._daily.save(snapshot)
+
+    def run(self, model_name, call, timings=None):
+        """
+        在配额允许时执行 call()，对 429 / 5xx 错误退避重试。
+        timings 为 dict 时把排队和退避等待的总秒数累加到 timings["wait"]。
+        """
+        attempt = 0
+        while True:
+            waited = self.acquire(model_name)
+            if timings is not None:
+                timings["wait"] = timings.get("wait", 0.0) + waited
+            try:
+                return call()
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    raise
+                # full jitter：在 [0, min(上限, 基数 * 2^n)] 内随机等待
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+                attempt += 1
+                logger.warning(f"请求失败（{e}），{delay:.1f} 秒后第 {attempt} 次重试")
+                time.sleep(delay)
+                if timings is not None:
+                    timings["wait"] = timings.get("wait", 0.0) + delay
+
+    def remaining(self, model_name):
+        """返回 (本分钟剩余, 今日剩余)；今日剩余按本地计数，在太平洋时间午夜恢复"""
+        with self._cond:
+            minute, daily_limit = self._get_buckets(model_name)
+            return minute.remaining(time.monotonic()), self._daily.remaining(model_name, daily_limit, time.time())
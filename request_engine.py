@@ -0,0 +1,136 @@
+# request_engine.py
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+class RequestCancelled(Exception):
+    """请求在生成过程中被取消"""
+
+
+class RequestEngine:
+    """
+    后台请求引擎：一个常驻 asyncio 事件循环统一调度所有 GeminiClient 调用。
+    每个请求绑定发起它的对话 ID，并返回一个可等待 / 可取消的 Future。
+    """
+
+    def __init__(self, max_workers=8):
+        self.loop = asyncio.new_event_loop()
+        # SDK 调用是阻塞的，放到有上限的线程池中执行，避免每条消息新建线程
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gemini-request")
+        self._lock = threading.Lock()
+        self._requests = {}  # chat_id -> set(Future)
+        self._thread = threading.Thread(target=self._run_loop, name="gemini-engine", daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit_call(self, fn):
+        """在后台线程池中执行一次普通调用（如客户端初始化），返回 Future"""
+        return asyncio.run_coroutine_threadsafe(self._run_call(fn), self.loop)
+
+    async def _run_call(self, fn):
+        return await self.loop.run_in_executor(self._executor, fn)
+
+    def submit_stream(self, chat_id, make_stream, on_chunk=None):
+        """
+        提交一个流式请求。
+        make_stream: 无参可调用对象，返回逐块产出文本的迭代器（在工作线程中调用）。
+        on_chunk: 每个片段到达时在工作线程中回调 on_chunk(chat_id, text)。
+        返回 concurrent.futures.Future，结果为完整回复文本；调用 cancel() 可中止生成。
+        """
+        cancel_event = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(
+            self._run_stream(chat_id, make_stream, on_chunk, cancel_event), self.loop
+        )
+        future.cancel_event = cancel_event
+        future.chat_id = chat_id
+        with self._lock:
+            self._requests.setdefault(chat_id, set()).add(future)
+        future.add_done_callback(lambda f: self._forget(chat_id, f))
+        return future
+
+    async def _run_stream(self, chat_id, make_stream, on_chunk, cancel_event):
+        def consume():
+            chunks = []
+            stream = make_stream()
+            try:
+                for chunk in stream:
+                    chunks.append(chunk)
+                    # 迭代器可能阻塞很久，取消发生在阻塞期间时，紧接回调之前再检查一次，
+                    # 过期的片段不会交给界面（用户可能已经在同一对话上发起了新请求）
+                    if cancel_event.is_set():
+                        raise RequestCancelled()
+                    if on_chunk is not None:
+                        on_chunk(chat_id, chunk)
+            finally:
+                # 取消或出错时主动关闭生成器，底层 HTTP 流立即释放，不等垃圾回收
+                close = getattr(stream, "close", None)
+                if close is not None:
+                    close()
+            return "".join(chunks)
+
+        try:
+            return await self.loop.run_in_executor(self._executor, consume)
+        except asyncio.CancelledError:
+            # 阻塞中的 SDK 调用无法被打断，通知工作线程在下一个片段处退出
+            cancel_event.set()
+            raise
+
+    def submit_task(self, chat_id, fn):
+        """
+        提交一个绑定对话的普通任务：fn(cancel_event) 在工作线程中执行，应定期检查 cancel_event。
+        与流式请求一样计入 is_busy，并可以被 cancel 取消。
+        """
+        cancel_event = threading.Event()
+        future = asyncio.run_coroutine_threadsafe(self._run_task(fn, cancel_event), self.loop)
+        future.cancel_event = cancel_event
+        future.chat_id = chat_id
+        with self._lock:
+            self._requests.setdefault(chat_id, set()).add(future)
+        future.add_done_callback(lambda f: self._forget(chat_id, f))
+        return future
+
+    async def _run_task(self, fn, cancel_event):
+        try:
+            return await self.loop.run_in_executor(self._executor, fn, cancel_event)
+        except asyncio.CancelledError:
+            cancel_event.set()
+            raise
+
+    def _forget(self, chat_id, future):
+        with self._lock:
+            futures = self._requests.get(chat_id)
+            if futures is not None:
+                futures.discard(future)
+                if not futures:
+                    del self._requests[chat_id]
+
+    def is_busy(self, chat_id):
+        with self._lock:
+            return bool(self._requests.get(chat_id))
+
+    def cancel(self, chat_id):
+        """取消某个对话上所有进行中的请求"""
+        with self._lock:
+            futures = list(self._requests.get(chat_id, ()))
+        for future in futures:
+            future.cancel_event.set()
+            future.cancel()
+        if futures:
+            logger.info(f"已取消对话 {chat_id} 的 {len(futures)} 个请求")
+        return len(futures)
+
+    def shutdown(self):
+        with self._lock:
+            futures = [f for fs in self._requests.values() for f in fs]
+        for future in futures:
+            future.cancel()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,119 @@
+# response_cache.py
+import hashlib
+import json
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(model_name, system_instruction, messages, temperature, top_p):
+    """对完整请求内容做哈希，任何一项不同都会得到不同的键"""
+    payload = json.dumps(
+        {
+            "model": model_name,
+            "system_instruction": system_instruction or "",
+            "messages": messages,
+            "temperature": round(float(temperature), 6),
+            "top_p": round(float(top_p), 6),
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    确定性生成（temperature 为 0）的回复缓存。
+    内存中是 LRU；指定 cache_dir 时额外写入磁盘，总大小超过 max_disk_bytes 时按最久未用淘汰。
+    """
+
+    def __init__(self, max_entries=256, cache_dir=None, max_disk_bytes=50 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._disk_index = OrderedDict()  # key -> 文件大小，按最近使用排序
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        if cache_dir:
+            self._load_disk_index()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + ".json")
+
+    def _load_disk_index(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and entry.name.endswith(".json"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._disk_index[key] = size
+            self._disk_bytes += size
+
+    def get(self, key):
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            if not self.cache_dir or key not in self._disk_index:
+                return None
+            try:
+                with open(self._path(key), "r", encoding="utf-8") as f:
+                    text = json.load(f)["text"]
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"读取磁盘缓存失败: {e}")
+                self._drop_disk(key)
+                return None
+            self._disk_index.move_to_end(key)
+            os.utime(self._path(key))
+            self._remember(key, text)
+            return text
+
+    def put(self, key, text):
+        with self._lock:
+            self._remember(key, text)
+            if self.cache_dir:
+                self._write_disk(key, text)
+
+    def _remember(self, key, text):
+        self._memory[key] = text
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _write_disk(self, key, text):
+        path = self._path(key)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"text": text}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入磁盘缓存失败: {e}")
+            return
+        size = os.path.getsize(path)
+        self._disk_bytes += size - self._disk_index.pop(key, 0)
+        self._disk_index[key] = size
+        while self._disk_bytes > self.max_disk_bytes and len(self._disk_index) > 1:
+            oldest = next(iter(self._disk_index))
+            self._drop_disk(oldest)
+
+    def _drop_disk(self, key):
+        self._disk_bytes -= self._disk_index.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            for key in list(self._disk_index):
+                self._drop_disk(key)
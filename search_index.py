@@ -0,0 +1,46 @@
+# search_index.py
+import re
+
+# 中日韩文字没有空格分词，按相邻两字（bigram）切分；其余文本按单词切分
+_TOKEN_RE = re.compile(r"([\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]+)|([0-9a-z_]+)")
+
+
+def _bigrams(cjk):
+    return [cjk[i:i + 2] for i in range(len(cjk) - 1)]
+
+
+def tokenize(text):
+    """
+    把文本切分为写入索引的检索词列表。
+    每段中日韩文字除相邻两字外还写入末字：这样每个字都是某个检索词的开头，单字查询用前缀匹配就能命中任意位置。
+    """
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall((text or "").lower()):
+        if word:
+            tokens.append(word)
+        else:
+            tokens.extend(_bigrams(cjk))
+            tokens.append(cjk[-1])
+    return tokens
+
+
+def index_text(text):
+    """写入 FTS5 表的内容：空格分隔的检索词"""
+    return " ".join(tokenize(text))
+
+
+def build_match_query(query):
+    """把用户输入转换为 FTS5 MATCH 表达式（所有检索词都需出现），无有效检索词时返回 None"""
+    terms = []
+    for cjk, word in _TOKEN_RE.findall((query or "").lower()):
+        if word:
+            terms.append(f'"{word}"')
+        elif len(cjk) == 1:
+            # 单字只出现在检索词开头（"猫咪" 的 "猫咪"、"小猫" 的末字 "猫"），用前缀匹配
+            terms.append(f'"{cjk}"*')
+        else:
+            terms.extend(f'"{bigram}"' for bigram in _bigrams(cjk))
+    if not terms:
+        return None
+    # 去重并保持顺序；检索词只含文字、数字和下划线，加引号后不会被当作 FTS5 语法
+    return " ".join(dict.fromkeys(terms))
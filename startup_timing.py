@@ -0,0 +1,64 @@
+# startup_timing.py
+import json
+import threading
+import time
+import logging
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+# 各启动阶段的耗时上限（毫秒），超出视为性能回退。
+# import / first_paint 是距进程启动的时间（mark），history_load / client_init 是该阶段自身耗时（measure）
+DEFAULT_THRESHOLDS_MS = {
+    "import": 800,
+    "history_load": 300,
+    "first_paint": 1500,
+    "client_init": 3000,
+}
+
+
+class StartupTimer:
+    """记录启动各阶段距离起点的耗时，并与回退阈值比较"""
+
+    def __init__(self, t0=None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self.phases = {}  # 阶段名 -> 距起点的毫秒数
+        self._lock = threading.Lock()
+
+    def mark(self, phase):
+        elapsed = (time.perf_counter() - self.t0) * 1000
+        with self._lock:
+            self.phases[phase] = elapsed
+        logger.info(f"启动阶段 {phase}: {elapsed:.0f} ms")
+        return elapsed
+
+    def measure(self, phase):
+        """上下文管理器：记录某段代码自身的耗时（不是距起点的耗时）"""
+        timer = self
+
+        class _Measure:
+            def __enter__(self):
+                self.start = time.perf_counter()
+
+            def __exit__(self, *exc):
+                elapsed = (time.perf_counter() - self.start) * 1000
+                with timer._lock:
+                    timer.phases[phase] = elapsed
+                logger.info(f"启动阶段 {phase}: {elapsed:.0f} ms")
+                return False
+
+        return _Measure()
+
+    def check(self, thresholds=None):
+        """返回超出阈值的阶段 {阶段: (耗时, 阈值)}"""
+        thresholds = DEFAULT_THRESHOLDS_MS if thresholds is None else thresholds
+        with self._lock:
+            return {
+                phase: (self.phases[phase], limit)
+                for phase, limit in thresholds.items()
+                if phase in self.phases and self.phases[phase] > limit
+            }
+
+    def report(self):
+        with self._lock:
+            return json.dumps({k: round(v, 1) for k, v in self.phases.items()}, ensure_ascii=False)
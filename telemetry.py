@@ -0,0 +1,163 @@
+# telemetry.py
+import collections
+import json
+import os
+import threading
+import time
+import logging
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+class RequestRecord:
+    """
+    单次请求的耗时与 token 用量；cancelled 表示调用方中途停止读取（用户取消、多模型竞速落败）。
+    chunks 为流式请求收到的文本片段数，非流式请求为 0。
+    """
+
+    __slots__ = ("model", "timestamp", "queue_ms", "convert_ms", "ttft_ms", "total_ms",
+                 "prompt_tokens", "output_tokens", "tokens_per_sec", "ok", "cached", "cancelled", "chunks")
+
+    def __init__(self, model):
+        self.model = model
+        self.timestamp = time.time()
+        self.queue_ms = 0.0
+        self.convert_ms = 0.0
+        self.ttft_ms = None
+        self.total_ms = 0.0
+        self.prompt_tokens = None
+        self.output_tokens = None
+        self.tokens_per_sec = None
+        self.ok = True
+        self.cached = False
+        self.cancelled = False
+        self.chunks = 0
+
+    @property
+    def outcome(self):
+        if self.cached:
+            return "cached"
+        if self.cancelled:
+            return "cancelled"
+        return "ok" if self.ok else "error"
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def _percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q * (len(values) - 1)))))
+    return values[index]
+
+
+class Telemetry:
+    """
+    请求指标：每个模型保留最近 window 条记录用于统计分位数，
+    可选地追加写入 JSONL 文件，并定期输出 Prometheus 文本格式文件。
+    """
+
+    def __init__(self, window=500, jsonl_path=None, prometheus_path=None, prometheus_interval=5.0):
+        self.window = window
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.prometheus_interval = prometheus_interval
+        self._records = {}  # model -> deque[RequestRecord]
+        self._totals = collections.Counter()  # (model, 结果) -> 累计请求数
+        self._lock = threading.Lock()
+        self._next_prometheus = 0.0
+        for path in (jsonl_path, prometheus_path):
+            if path and os.path.dirname(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def record(self, rec):
+        if rec.output_tokens and rec.chunks > 1 and rec.ttft_ms is not None and rec.total_ms > rec.ttft_ms:
+            # 流式请求的生成速度只计首个片段之后的时间；
+            # 非流式或只有一个片段时首字之后几乎没有耗时，按总耗时计算，否则速度会被放大到几百万 tok/s
+            rec.tokens_per_sec = rec.output_tokens / ((rec.total_ms - rec.ttft_ms) / 1000)
+        elif rec.output_tokens and rec.total_ms > 0:
+            rec.tokens_per_sec = rec.output_tokens / (rec.total_ms / 1000)
+        with self._lock:
+            self._records.setdefault(rec.model, collections.deque(maxlen=self.window)).append(rec)
+            self._totals[(rec.model, rec.outcome)] += 1
+            if self.jsonl_path:
+                try:
+                    with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(rec.to_dict(), ensure_ascii=False) + "\n")
+                except OSError as e:
+                    logger.warning(f"写入指标文件失败: {e}")
+            write_prometheus = self.prometheus_path and time.monotonic() >= self._next_prometheus
+            if write_prometheus:
+                self._next_prometheus = time.monotonic() + self.prometheus_interval
+        if write_prometheus:
+            self.export_prometheus(self.prometheus_path)
+        logger.info(
+            f"请求指标 - 模型: {rec.model}, 结果: {rec.outcome}, 排队: {rec.queue_ms:.0f} ms, 转换: {rec.convert_ms:.1f} ms, "
+            f"首字: {rec.ttft_ms if rec.ttft_ms is None else round(rec.ttft_ms)} ms, 总耗时: {rec.total_ms:.0f} ms, "
+            f"tokens: {rec.prompt_tokens}/{rec.output_tokens}"
+        )
+
+    def summary(self, model=None):
+        """
+        汇总最近的记录，model 为 None 时汇总所有模型。
+        requests 不含缓存命中；被取消的请求单独计数，不算失败，也不计入耗时分位数（耗时取决于何时取消）。
+        """
+        with self._lock:
+            if model is None:
+                records = [r for rs in self._records.values() for r in rs]
+            else:
+                records = list(self._records.get(model, ()))
+        live = [r for r in records if not r.cached]
+        cancelled = sum(1 for r in live if r.cancelled)
+        ok = [r for r in live if r.ok and not r.cancelled]
+        ttft = [r.ttft_ms for r in ok if r.ttft_ms is not None]
+        total = [r.total_ms for r in ok]
+        speed = [r.tokens_per_sec for r in ok if r.tokens_per_sec]
+        return {
+            "requests": len(live),
+            "errors": len(live) - len(ok) - cancelled,
+            "cancelled": cancelled,
+            "cached": len(records) - len(live),
+            "ttft_p50_ms": _percentile(ttft, 0.5),
+            "ttft_p95_ms": _percentile(ttft, 0.95),
+            "latency_p50_ms": _percentile(total, 0.5),
+            "latency_p95_ms": _percentile(total, 0.95),
+            "queue_p50_ms": _percentile([r.queue_ms for r in ok], 0.5),
+            "convert_p50_ms": _percentile([r.convert_ms for r in ok], 0.5),
+            "tokens_per_sec_avg": sum(speed) / len(speed) if speed else None,
+        }
+
+    def export_prometheus(self, path):
+        """以 Prometheus 文本格式写出各模型的请求计数和分位数（原子替换文件）"""
+        lines = [
+            "# TYPE gemini_requests_total counter",
+        ]
+        with self._lock:
+            totals = dict(self._totals)
+            models = list(self._records)
+        for (model, outcome), count in sorted(totals.items()):
+            lines.append(f'gemini_requests_total{{model="{model}",outcome="{outcome}"}} {count}')
+        for metric, key in (("gemini_ttft_ms", "ttft"), ("gemini_latency_ms", "latency")):
+            lines.append(f"# TYPE {metric} summary")
+            for model in models:
+                stats = self.summary(model)
+                for q in ("p50", "p95"):
+                    value = stats[f"{key}_{q}_ms"]
+                    if value is not None:
+                        quantile = "0.5" if q == "p50" else "0.95"
+                        lines.append(f'{metric}{{model="{model}",quantile="{quantile}"}} {value:.1f}')
+        lines.append("# TYPE gemini_tokens_per_second gauge")
+        for model in models:
+            value = self.summary(model)["tokens_per_sec_avg"]
+            if value is not None:
+                lines.append(f'gemini_tokens_per_second{{model="{model}"}} {value:.2f}')
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"写入 Prometheus 指标失败: {e}")
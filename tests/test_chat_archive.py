@@ -0,0 +1,87 @@
+# tests/test_chat_archive.py
+"""chat_archive：增量解码与 json.loads 结果一致，导入按批写入存储，解析失败的文件不留下数据"""
+import io
+import json
+import random
+import zipfile
+
+import chat_archive
+from chat_archive import TitleIndex, import_into_store, iter_chat_events, parse_chat_stream
+from chat_store import ChatStore
+
+
+def _random_value(rng, depth=0):
+    kind = rng.randrange(7 if depth < 3 else 4)
+    if kind == 0:
+        return rng.choice([15000000000.0, 1.5e-07, -0.25, 1e300, 123456789.125])
+    if kind == 1:
+        return rng.randrange(-10 ** 12, 10 ** 12)
+    if kind == 2:
+        return rng.choice([True, False, None])
+    if kind == 3:
+        return "".join(rng.choice("ab中文\"\\\n 1.e") for _ in range(rng.randrange(6)))
+    if kind == 4:
+        return [_random_value(rng, depth + 1) for _ in range(rng.randrange(4))]
+    return {f"k{i}": _random_value(rng, depth + 1) for i in range(rng.randrange(4))}
+
+
+def test_stream_reader_matches_json_loads():
+    rng = random.Random(1)
+    for _ in range(200):
+        data = [_random_value(rng) for _ in range(rng.randrange(1, 6))]
+        text = json.dumps(data, ensure_ascii=False, indent=rng.choice([None, 1]))
+        for chunk_size in (1, 2, 3, 7):
+            reader = chat_archive._StreamReader(io.StringIO(text), chunk_size=chunk_size)
+            assert list(reader.array()) == json.loads(text)
+
+
+def test_number_split_at_buffer_boundary():
+    text = '{"title": "t", "messages": [["You", "a"]], "extra": [15000000000.0, 2]}'
+    cut = text.index("15000000000.") + len("15000000000.")
+    for chunk_size in range(1, cut + 1):
+        reader = chat_archive._StreamReader(io.StringIO(text), chunk_size=chunk_size)
+        reader.expect("{")
+        values = {}
+        while True:
+            key = reader.value()
+            reader.expect(":")
+            values[key] = reader.value()
+            if not reader.next_member():
+                break
+        assert values == json.loads(text)
+
+
+def test_events_are_batched():
+    chat = {"messages": [["You", str(i)] for i in range(5)], "prompt": "p", "title": "T"}
+    events = list(iter_chat_events(io.StringIO(json.dumps(chat)), batch_size=2))
+    assert [e for e, _ in events] == ["begin", "messages", "messages", "messages", "end"]
+    assert events[-1][1] == {"title": "T", "prompt": "p"}
+
+    legacy = {"a": {"title": "A", "messages": [["You", "hi"], ["Gemini", None]]}, "b": {}}
+    chats = parse_chat_stream(io.StringIO(json.dumps(legacy)), "默认")
+    assert chats == [{"messages": [("You", "hi")], "title": "A", "prompt": ""},
+                     {"messages": [], "title": "默认", "prompt": ""}]
+
+
+def test_import_into_store(tmp_path):
+    archive = tmp_path / "chats.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        for i in range(3):
+            chat = {"title": "同名", "messages": [["You", f"{i}-{j}"] for j in range(7)]}
+            zf.writestr(f"chat{i}.json", json.dumps(chat))
+        zf.writestr("broken.json", '{"title": "坏", "messages": [["You", "x"], ')
+    store = ChatStore(str(tmp_path / "chat_history.db"))
+    try:
+        store.create_chat("old", "旧对话")
+        titles = TitleIndex(["旧对话"])
+        entries, failed = import_into_store(store, [str(archive)], titles, workers=2, replace=True)
+        assert len(entries) == 3 and len(failed) == 1
+        assert sorted(e["title"] for e in entries.values()) == ["同名", "同名_1", "同名_2"]
+        index = store.load_index()
+        assert set(index) == set(entries)
+        for chat_id, entry in entries.items():
+            assert index[chat_id]["message_count"] == entry["message_count"] == 7
+            texts = [m.text for m in store.load_messages(chat_id)]
+            assert texts == [f"{texts[0][0]}-{j}" for j in range(7)]
+    finally:
+        store.close()
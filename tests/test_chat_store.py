@@ -0,0 +1,77 @@
+# tests/test_chat_store.py
+"""ChatStore：失败的操作整体回滚，旧版历史迁移失败时保留原文件"""
+import json
+import os
+import sqlite3
+
+import chat_store
+from chat_store import ChatStore
+
+
+def test_failed_op_is_rolled_back(tmp_path):
+    store = ChatStore(str(tmp_path / "chat_history.db"))
+    try:
+        store.create_chat("a", "A")
+
+        def half_done(conn):
+            conn.execute("INSERT INTO chats (id, title, prompt, created, updated, message_count) "
+                         "VALUES ('z', 'Z', '', 0, 0, 0)")
+            raise RuntimeError("boom")
+
+        future = store._submit_future(half_done)
+        store.append_message("a", "You", "同一批次的其他操作")
+        store.flush()
+        assert isinstance(future.exception(), RuntimeError)
+        assert list(store.load_index()) == ["a"]
+        assert [m.text for m in store.load_messages("a")] == ["同一批次的其他操作"]
+    finally:
+        store.close()
+
+
+def test_migrate_skips_null_texts(tmp_path):
+    json_path = tmp_path / "chat_history.json"
+    json_path.write_text(json.dumps({"a": {"title": "A", "messages": [["You", "hi"], ["Gemini", None], ["You", 5]]}}),
+                         encoding="utf-8")
+    store = ChatStore(str(tmp_path / "chat_history.db"))
+    try:
+        assert store.migrate_json(str(json_path)) == 1
+        assert store.load_index()["a"]["message_count"] == 2
+        assert [m.text for m in store.load_messages("a")] == ["hi", "5"]
+        store.append_message("a", "Gemini", "新消息")
+        assert store.search("新消息")[0][2] == 2
+        assert not json_path.exists()
+    finally:
+        store.close()
+
+
+def test_migrate_keeps_file_on_failure(tmp_path, monkeypatch):
+    json_path = tmp_path / "chat_history.json"
+    json_path.write_text(json.dumps({"a": {"title": "A", "messages": [["You", "hi"]]}}), encoding="utf-8")
+    original = chat_store._add_chat
+
+    def failing(conn, *args):
+        original(conn, *args)
+        raise sqlite3.IntegrityError("fake failure")
+
+    monkeypatch.setattr(chat_store, "_add_chat", failing)
+    store = ChatStore(str(tmp_path / "chat_history.db"))
+    try:
+        assert store.migrate_json(str(json_path)) == 0
+        assert os.path.exists(json_path)
+        assert store.is_empty()
+    finally:
+        store.close()
+
+
+def test_single_cjk_character_search(tmp_path):
+    store = ChatStore(str(tmp_path / "chat_history.db"))
+    try:
+        store.create_chat("a", "A")
+        store.append_message("a", "You", "我家的猫咪很可爱")
+        store.append_message("a", "Gemini", "小猫")
+        store.append_message("a", "You", "狗")
+        assert sorted(row[2] for row in store.search("猫")) == [0, 1]
+        assert [row[2] for row in store.search("猫咪")] == [0]
+        assert [row[2] for row in store.search("狗")] == [2]
+    finally:
+        store.close()
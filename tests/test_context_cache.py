@@ -0,0 +1,172 @@
+# tests/test_context_cache.py
+"""ContextCacheManager 与 FakeCacheBackend：命中、续期、失效、回退，以及多个对话共用提示词时不互相挤占"""
+import time
+
+import pytest
+
+from context_cache import ContextCacheManager
+from fake_gemini import FakeGemini, FakeCacheBackend
+from message import Message
+from token_budget import estimate_tokens
+
+NEW = {"role": "user", "parts": ["新的问题"]}
+
+
+def _history(tag, turns):
+    history = []
+    for i in range(turns):
+        role = "user" if i % 2 == 0 else "model"
+        history.append(Message(role, f"{tag} 第 {i} 条消息 " + "内容" * 50))
+    return history
+
+
+@pytest.fixture
+def backend():
+    return FakeCacheBackend(FakeGemini())
+
+
+@pytest.fixture
+def manager(backend):
+    return ContextCacheManager(estimate_tokens, backend=backend, min_tokens=500)
+
+
+def test_short_history_is_not_cached(manager, backend):
+    assert manager.prepare("gemini-2.0-flash", "", _history("a", 2), NEW) is None
+    assert backend.created == 0
+
+
+def test_hit_sends_only_tail(manager, backend):
+    history = _history("a", 10)
+    model, tail = manager.prepare("gemini-2.0-flash", "", history, NEW)
+    assert backend.created == 1
+    assert len(tail) == 1
+    history += [Message("user", "追问"), Message("model", "回答")]
+    model2, tail = manager.prepare("gemini-2.0-flash", "", history, NEW)
+    assert model2 is model
+    assert backend.created == 1
+    assert len(tail) == 3
+
+
+def test_chats_sharing_a_prompt_keep_their_own_caches(manager, backend):
+    a, b = _history("a", 10), _history("b", 10)
+    for turn in range(4):
+        for history in (a, b):
+            history += [Message("user", f"追问 {turn}"), Message("model", "回答")]
+            assert manager.prepare("gemini-2.0-flash", "", history, NEW) is not None
+    assert backend.created == 2
+    assert backend.deleted == 0
+
+
+def test_trimmed_history_is_not_cached(manager, backend):
+    for turn in range(5):
+        history = _history(f"第 {turn} 轮裁剪后", 10)
+        assert manager.prepare("gemini-2.0-flash", "", history, NEW, trimmed=True) is None
+    assert backend.created == 0
+
+
+def test_refresh_near_expiry(manager, backend):
+    history = _history("a", 10)
+    manager.prepare("gemini-2.0-flash", "", history, NEW)
+    entry = next(iter(manager._entries.values()))
+    entry.expire_time = time.time() + manager.refresh_margin - 1
+    assert manager.prepare("gemini-2.0-flash", "", history, NEW) is not None
+    assert backend.refreshed == 1
+    assert entry.expire_time > time.time() + manager.refresh_margin
+
+
+def test_refresh_failure_falls_back(manager, backend):
+    history = _history("a", 10)
+    manager.prepare("gemini-2.0-flash", "", history, NEW)
+    next(iter(manager._entries.values())).expire_time = time.time() + 1
+    backend.fail_refresh = True
+    assert manager.prepare("gemini-2.0-flash", "", history, NEW) is None
+    assert backend.deleted == 1
+    assert not manager._entries
+
+
+def test_invalidate_disables_group(manager, backend):
+    history = _history("a", 10)
+    manager.prepare("gemini-2.0-flash", "", history, NEW)
+    manager.invalidate("gemini-2.0-flash", "")
+    assert backend.deleted == 1
+    assert manager.prepare("gemini-2.0-flash", "", history, NEW) is None
+    # 其他模型不受影响
+    assert manager.prepare("gemini-2.5-pro", "", history, NEW) is not None
+
+
+def test_create_failure_falls_back(manager, backend):
+    backend.fail_create = True
+    assert manager.prepare("gemini-2.0-flash", "", _history("a", 10), NEW) is None
+    backend.fail_create = False
+    # retry_after 内不再尝试
+    assert manager.prepare("gemini-2.0-flash", "", _history("a", 10), NEW) is None
+    assert backend.created == 0
+
+
+def test_lru_bound(backend):
+    manager = ContextCacheManager(estimate_tokens, backend=backend, min_tokens=500, max_entries=3)
+    for i in range(5):
+        manager.prepare("gemini-2.0-flash", "", _history(f"对话 {i}", 10), NEW)
+    assert len(manager._entries) == 3
+    assert backend.deleted == 2
+
+
+def test_client_falls_back_when_cached_request_fails(backend):
+    fake = backend.fake
+    previous = fake.install()
+    try:
+        from gemini_client import GeminiClient
+        client = GeminiClient(api_key="fake-key", context_cache_backend=backend, prewarm=False, keepalive=None)
+        client.context_cache.min_tokens = 500
+        history = [("You" if i % 2 == 0 else "Gemini", f"第 {i} 条消息 " + "内容" * 50) for i in range(10)]
+        assert client.generate_response(history, "问题")
+        assert backend.created == 1
+
+        def broken(*args, **kwargs):
+            raise RuntimeError("cached model error")
+        next(iter(client.context_cache._entries.values())).model.generate_content = broken
+        # 缓存模型出错时透明回退到普通请求
+        assert client.generate_response(history, "再问一次")
+        assert not client.context_cache._entries
+    finally:
+        import gemini_client
+        gemini_client._sdk = previous
+
+
+def test_prefix_is_extended_incrementally(manager, backend, monkeypatch):
+    history = _history("a", 10)
+    manager.prepare("gemini-2.0-flash", "", history, NEW)
+    calls = []
+    original = Message.extend_prefix
+    monkeypatch.setattr(Message, "extend_prefix", lambda self, *args: calls.append(self) or original(self, *args))
+    history += [Message("user", "追问"), Message("model", "回答")]
+    model, tail = manager.prepare("gemini-2.0-flash", "", history, NEW)
+    assert calls == history[-2:]
+    assert len(tail) == 3 and backend.created == 1
+
+
+def test_client_does_not_fall_back_on_quota_error(backend):
+    from fake_gemini import FakeApiError
+    from quota_scheduler import QuotaScheduler
+    fake = backend.fake
+    previous = fake.install()
+    try:
+        from gemini_client import GeminiClient
+        client = GeminiClient(api_key="fake-key", context_cache_backend=backend, prewarm=False, keepalive=None)
+        client.scheduler = QuotaScheduler(limits={"": (10 ** 6, 10 ** 6)}, max_retries=0)
+        client.context_cache.min_tokens = 500
+        history = [Message("user" if i % 2 == 0 else "model", f"第 {i} 条消息 " + "内容" * 50) for i in range(10)]
+        assert client.generate_response(history, "问题")
+        calls = fake.calls
+
+        def exhausted(*args, **kwargs):
+            raise FakeApiError(429, "quota exhausted")
+        next(iter(client.context_cache._entries.values())).model.generate_content = exhausted
+        with pytest.raises(FakeApiError):
+            client.generate_response(history, "再问一次")
+        # 不发送完整请求，缓存保留
+        assert fake.calls == calls
+        assert client.context_cache._entries
+    finally:
+        import gemini_client
+        gemini_client._sdk = previous
@@ -0,0 +1,58 @@
+# tests/test_gateway_server.py
+"""网关：Content-Length 不合法时返回 400，已有对话的新系统提示词会被保存"""
+import asyncio
+import json
+
+import gemini_client
+from chat_store import ChatStore
+from fake_gemini import FakeGemini
+from gateway_server import GatewayServer
+from gemini_client import GeminiClient
+
+
+def _request(gateway, raw):
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        sent = bytearray()
+
+        class Writer:
+            def write(self, data):
+                sent.extend(data)
+
+            async def drain(self):
+                pass
+
+            def close(self):
+                pass
+
+        await gateway.handle(reader, Writer())
+        head, _, body = bytes(sent).partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(body)
+
+    return asyncio.run(run())
+
+
+def _post(gateway, payload):
+    body = json.dumps(payload).encode("utf-8")
+    return _request(gateway, b"POST /v1/chat HTTP/1.1\r\nContent-Length: %d\r\n\r\n" % len(body) + body)
+
+
+def test_bad_content_length_and_saved_prompt(tmp_path, monkeypatch):
+    monkeypatch.setattr(gemini_client, "_sdk", FakeGemini())
+    client = GeminiClient(api_key="fake-key", prewarm=False, keepalive=None)
+    gateway = GatewayServer(client, ChatStore(str(tmp_path / "chat_history.db")))
+    try:
+        for value in (b"abc", b"-5"):
+            status, _ = _request(gateway, b"POST /v1/chat HTTP/1.1\r\nContent-Length: " + value + b"\r\n\r\n")
+            assert status == 400
+
+        status, result = _post(gateway, {"message": "你好", "chat_id": "a", "system_instruction": "旧提示词"})
+        assert status == 200
+        _post(gateway, {"message": "再来", "chat_id": "a", "system_instruction": "新提示词"})
+        assert gateway.store.load_chat("a")["prompt"] == "新提示词"
+        status, _ = _post(gateway, {"message": "再来", "chat_id": "a", "system_instruction": 5})
+        assert status == 400
+    finally:
+        gateway.close()
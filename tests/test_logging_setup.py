@@ -0,0 +1,39 @@
+# tests/test_logging_setup.py
+"""日志轮转：文件年龄跨启动累计，大小按 UTF-8 字节计算"""
+import logging
+import os
+import time
+
+from logging_setup import RotatingLogWriter
+
+
+def _record(message):
+    return logging.LogRecord("test", logging.INFO, __file__, 0, message, None, None)
+
+
+def _archives(log_dir):
+    return [name for name in os.listdir(log_dir) if name.startswith("gemini_chat_")]
+
+
+def test_age_is_kept_across_restarts(tmp_path):
+    writer = RotatingLogWriter(str(tmp_path), rotate_age=3600)
+    writer.emit(_record("第一次启动"))
+    writer.close()
+    # 模拟文件两小时前创建
+    with open(writer.created_path, "w", encoding="utf-8") as f:
+        f.write(repr(time.time() - 7200))
+
+    writer = RotatingLogWriter(str(tmp_path), rotate_age=3600)
+    writer.emit(_record("第二次启动"))
+    writer.close()
+    assert len(_archives(tmp_path)) == 1
+    with open(writer.path, encoding="utf-8") as f:
+        assert f.read() == "第二次启动\n"
+
+
+def test_size_is_counted_in_bytes(tmp_path):
+    writer = RotatingLogWriter(str(tmp_path), max_bytes=50)
+    writer.emit(_record("中文" * 5))  # 31 字节
+    writer.emit(_record("中文" * 5))
+    writer.close()
+    assert len(_archives(tmp_path)) == 1
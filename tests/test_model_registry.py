@@ -0,0 +1,28 @@
+# tests/test_model_registry.py
+"""ModelRegistry.refresh 使用独立的客户端，不改动全局 configure"""
+import gemini_client
+from fake_gemini import FakeGemini
+from model_registry import ModelRegistry
+
+
+def test_refresh_does_not_touch_global_configure(tmp_path, monkeypatch):
+    fake = FakeGemini(models=["gemini-2.0-flash"])
+    clients = []
+    original = fake.model_client
+
+    def configure(**kwargs):
+        raise AssertionError(f"全局 configure 被调用: {kwargs}")
+
+    def model_client(api_key, transport=None):
+        clients.append(original(api_key, transport))
+        return clients[-1]
+
+    monkeypatch.setattr(fake, "configure", configure)
+    monkeypatch.setattr(fake, "model_client", model_client)
+    monkeypatch.setattr(gemini_client, "_sdk", fake)
+
+    registry = ModelRegistry(cache_path=str(tmp_path / "models_cache.json"))
+    models = registry.refresh("fake-key", transport="rest")
+    assert ModelRegistry.chat_model_names(models) == ["gemini-2.0-flash"]
+    assert [(c.api_key, c.transport) for c in clients] == [("fake-key", "rest")]
+    assert registry.load_cached()[0] == models
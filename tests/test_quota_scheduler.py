@@ -0,0 +1,35 @@
+# tests/test_quota_scheduler.py
+"""每日额度：固定窗口计数，重启后保留，太平洋时间午夜清零"""
+import pytest
+
+import quota_scheduler
+from quota_scheduler import QuotaExceededError, QuotaScheduler, quota_day
+
+
+def test_daily_count_survives_restart(tmp_path):
+    path = str(tmp_path / "quota_state.json")
+    scheduler = QuotaScheduler(limits={"": (100, 3)}, max_wait=0.1, state_path=path)
+    scheduler.acquire("m")
+    scheduler.acquire("m")
+    assert scheduler.remaining("m") == (98, 1)
+
+    restarted = QuotaScheduler(limits={"": (100, 3)}, max_wait=0.1, state_path=path)
+    assert restarted.remaining("m")[1] == 1
+    restarted.acquire("m")
+    with pytest.raises(QuotaExceededError):
+        restarted.acquire("m")
+
+
+def test_daily_count_resets_at_pacific_midnight(tmp_path, monkeypatch):
+    # 2026-03-15 07:00 UTC = 太平洋夏令时 00:00
+    midnight = 1773558000
+    assert quota_day(midnight - 1) == ("2026-03-14", 1.0)
+    assert quota_day(midnight)[0] == "2026-03-15"
+
+    clock = [midnight - 10]
+    monkeypatch.setattr(quota_scheduler.time, "time", lambda: clock[0])
+    scheduler = QuotaScheduler(limits={"": (100, 1)}, max_wait=0.1, state_path=str(tmp_path / "q.json"))
+    scheduler.acquire("m")
+    assert scheduler.remaining("m")[1] == 0
+    clock[0] = midnight + 1
+    assert scheduler.remaining("m")[1] == 1
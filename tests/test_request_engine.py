@@ -0,0 +1,32 @@
+# tests/test_request_engine.py
+"""取消流式请求：取消后到达的片段不再回调，生成器被关闭"""
+import threading
+
+import pytest
+
+from request_engine import RequestCancelled, RequestEngine
+
+
+def test_cancel_while_blocked_drops_chunk_and_closes_stream():
+    release = threading.Event()
+    started = threading.Event()
+    closed = threading.Event()
+    received = []
+
+    def make_stream():
+        try:
+            started.set()
+            release.wait(5)
+            yield "过期的片段"
+        finally:
+            closed.set()
+
+    engine = RequestEngine(max_workers=2)
+    future = engine.submit_stream("a", make_stream, on_chunk=lambda cid, chunk: received.append(chunk))
+    started.wait(5)
+    future.cancel_event.set()
+    release.set()
+    assert closed.wait(5)
+    assert received == []
+    with pytest.raises(RequestCancelled):
+        future.result(5)
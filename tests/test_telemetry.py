@@ -0,0 +1,58 @@
+# tests/test_telemetry.py
+"""中途停止读取的流式请求计为 cancelled，不算失败，也不计入耗时分位数"""
+import gemini_client
+from fake_gemini import FakeGemini
+from gemini_client import GeminiClient
+from telemetry import RequestRecord, Telemetry
+
+
+def test_cancelled_stream_is_not_an_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(gemini_client, "_sdk", FakeGemini(chunks=5))
+    client = GeminiClient(api_key="fake-key", prewarm=False, keepalive=None, cache_dir=str(tmp_path))
+    try:
+        client.cache_enabled = False
+        stream = client.generate_response_stream([], "你好")
+        next(stream)
+        stream.close()
+        "".join(client.generate_response_stream([], "你好"))
+        stats = client.telemetry.summary()
+        assert (stats["requests"], stats["errors"], stats["cancelled"]) == (2, 0, 1)
+    finally:
+        client.close()
+
+
+def test_prometheus_outcomes(tmp_path):
+    telemetry = Telemetry()
+    for outcome in ("ok", "error", "cancelled"):
+        rec = RequestRecord("m")
+        rec.total_ms = 1000.0 if outcome == "cancelled" else 10.0
+        rec.ok = outcome != "error"
+        rec.cancelled = outcome == "cancelled"
+        telemetry.record(rec)
+    assert telemetry.summary()["latency_p95_ms"] == 10.0
+    path = tmp_path / "gemini.prom"
+    telemetry.export_prometheus(str(path))
+    text = path.read_text(encoding="utf-8")
+    for outcome in ("ok", "error", "cancelled"):
+        assert f'gemini_requests_total{{model="m",outcome="{outcome}"}} 1' in text
+
+
+def test_tokens_per_sec(tmp_path, monkeypatch):
+    monkeypatch.setattr(gemini_client, "_sdk", FakeGemini(chunks=1, latency=0.05))
+    client = GeminiClient(api_key="fake-key", prewarm=False, keepalive=None, cache_dir=str(tmp_path))
+    try:
+        client.cache_enabled = False
+        info = {}
+        client.generate_response([], "你好", request_info=info)
+        "".join(client.generate_response_stream([], "你好"))
+        expected = info["output_tokens"] / (info["total_ms"] / 1000)
+        rates = [r.tokens_per_sec for r in client.telemetry._records["gemini-2.0-flash"]]
+        assert rates[0] == expected
+        assert all(rate < 1000 for rate in rates)
+    finally:
+        client.close()
+
+    rec = RequestRecord("m")
+    rec.ttft_ms, rec.total_ms, rec.output_tokens, rec.chunks = 100.0, 1100.0, 50, 5
+    Telemetry().record(rec)
+    assert rec.tokens_per_sec == 50.0
@@ -0,0 +1,32 @@
+# tests/test_token_budget.py
+"""token 计数：历史消息的 token 数缓存在 Message 上，按文本的缓存只保留少量最近的输入"""
+from gemini_client import GeminiClient
+from message import Message
+from token_budget import TokenCounter, estimate_tokens, trim_history
+
+
+def test_counter_is_bounded_lru():
+    counter = TokenCounter(max_entries=2)
+    counter.count("a")
+    counter.count("b")
+    counter.count("a")
+    counter.count("c")
+    assert list(counter._cache) == ["a", "c"]
+
+
+def test_history_texts_are_not_cached_by_text():
+    client = GeminiClient(api_key="fake-key", prewarm=False, keepalive=None)
+    try:
+        history = [Message("user" if i % 2 == 0 else "model", f"消息 {i}") for i in range(50)]
+        client._build_messages(history, "新的问题", "gemini-2.0-flash", "系统指令")
+        assert set(client.token_counter._cache) == {"新的问题", "系统指令"}
+        assert all(m._tokens == estimate_tokens(m.text) for m in history)
+    finally:
+        client.close()
+
+
+def test_trim_keeps_latest_and_starts_with_user():
+    history = [Message("system", "欢迎")] + [Message("user" if i % 2 == 0 else "model", "字" * 10) for i in range(6)]
+    kept, used, dropped = trim_history(history, estimate_tokens, 29)
+    assert [m.role for m in kept] == ["user", "model"]
+    assert used == 28 and dropped == 4
@@ -0,0 +1,94 @@
+# token_budget.py
+import re
+import threading
+from collections import OrderedDict
+
+# 每条消息在请求中的固定开销（role 等结构字段）
+MESSAGE_OVERHEAD = 4
+
+# 每个模型每次请求允许发送的上下文 token 数，按模型名关键字匹配
+DEFAULT_CONTEXT_BUDGETS = {
+    "pro": 32000,
+    "flash": 32000,
+}
+FALLBACK_CONTEXT_BUDGET = 32000
+
+# 中日韩字符大约一个字一个 token，其余文本大约 4 个字符一个 token
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text):
+    """本地估算 token 数，不发起网络请求"""
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    other = len(text) - cjk
+    return cjk + (other + 3) // 4
+
+
+class TokenCounter:
+    """
+    带缓存的 token 计数器，只用于新输入和系统指令：重复发送的系统指令只计算一次。
+    历史消息的 token 数缓存在 Message 上，随消息一起释放，不经过这里（直接使用 count_fn），
+    否则按文本缓存会让已删除对话的文本一直留在内存中。
+    缓存按最近使用淘汰，最多 max_entries 条。
+    count_fn 可替换为调用 count_tokens 的函数以获得精确值。
+    """
+
+    def __init__(self, count_fn=estimate_tokens, max_entries=256):
+        self.count_fn = count_fn
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text):
+        with self._lock:
+            tokens = self._cache.get(text)
+            if tokens is not None:
+                self._cache.move_to_end(text)
+                return tokens
+        tokens = self.count_fn(text)
+        with self._lock:
+            self._cache[text] = tokens
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+        return tokens
+
+
+def budget_for(model_name, budgets=None):
+    budgets = DEFAULT_CONTEXT_BUDGETS if budgets is None else budgets
+    for keyword, budget in budgets.items():
+        if keyword in model_name:
+            return budget
+    return FALLBACK_CONTEXT_BUDGET
+
+
+def trim_history(history, count_fn, budget):
+    """
+    从最新的消息往前保留，直到超出 budget；未超出预算时不会访问更早的消息。
+    history 为 Message 序列（role 为 "system" 的欢迎语跳过），token 数缓存在消息上。
+    返回 (保留的 Message 列表, 保留部分的 token 数, 丢弃条数)。
+    """
+    kept = []
+    used = 0
+    start = len(history)
+    while start > 0:
+        message = history[start - 1]
+        if message.role != "system":
+            cost = message.token_count(count_fn) + MESSAGE_OVERHEAD
+            if used + cost > budget:
+                break
+            used += cost
+            kept.append(message)
+        start -= 1
+    # 欢迎语只出现在对话开头，不计入丢弃条数
+    head = 0
+    while head < start and history[head].role == "system":
+        head += 1
+    dropped = start - head
+    # 对话历史需要从用户消息开始
+    while kept and kept[-1].role != "user":
+        used -= kept.pop().token_count(count_fn) + MESSAGE_OVERHEAD
+        dropped += 1
+    kept.reverse()
+    return kept, used, dropped
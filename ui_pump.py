@@ -0,0 +1,124 @@
+# ui_pump.py
+import collections
+import threading
+import time
+import logging
+
+# 获取日志记录器
+logger = logging.getLogger(__name__)
+
+
+class UIPump:
+    """
+    工作线程到 Tk 主线程的统一通道。
+    工作线程只往线程安全的队列里放事件；主线程上一个周期性的 after 循环每帧取空队列：
+    - 同一对话的连续文本追加合并成一次回调；
+    - 通过 schedule_once 登记的界面刷新（如按钮状态）每帧最多执行一次；
+    - 记录队列深度和每帧耗时。
+    """
+
+    def __init__(self, widget, on_append, interval_ms=16, report_interval=60.0):
+        self.widget = widget
+        self.on_append = on_append  # on_append(chat_id, text)，在主线程调用
+        self.interval_ms = interval_ms
+        self.report_interval = report_interval
+        self._events = collections.deque()
+        self._once = {}
+        self._lock = threading.Lock()
+        self._running = False
+        self._reset_stats()
+
+    def _reset_stats(self):
+        self._frames = 0
+        self._events_done = 0
+        self._depth_total = 0
+        self._max_depth = 0
+        self._frame_total = 0.0
+        self._max_frame = 0.0
+        self._report_at = time.monotonic() + self.report_interval
+
+    # ---------- 任意线程调用 ----------
+
+    def append_text(self, chat_id, text):
+        self._events.append(("append", chat_id, text))
+
+    def call(self, fn):
+        """在主线程的下一帧执行 fn()"""
+        self._events.append(("call", None, fn))
+
+    def schedule_once(self, key, fn):
+        """本帧结束时执行 fn()，同一 key 在一帧内重复登记只执行最后一次"""
+        with self._lock:
+            self._once[key] = fn
+
+    # ---------- 主线程 ----------
+
+    def start(self):
+        if not self._running:
+            self._running = True
+            self.widget.after(self.interval_ms, self._tick)
+
+    def stop(self):
+        self._running = False
+
+    def _tick(self):
+        if not self._running:
+            return
+        started = time.perf_counter()
+        depth = len(self._events)
+        try:
+            self._drain()
+        except Exception as e:
+            logger.error(f"界面更新失败: {e}")
+        elapsed = time.perf_counter() - started
+        self._record(depth, elapsed)
+        self.widget.after(self.interval_ms, self._tick)
+
+    def _drain(self):
+        pending = {}  # chat_id -> [text]，保持首次出现的顺序
+        # 只处理本帧开始时已在队列中的事件，避免高频事件让一帧永远结束不了
+        for _ in range(len(self._events)):
+            kind, chat_id, payload = self._events.popleft()
+            if kind == "append":
+                pending.setdefault(chat_id, []).append(payload)
+            else:
+                # 回调可能依赖之前的文本，先把积压的追加写出去
+                self._flush(pending)
+                payload()
+            self._events_done += 1
+        self._flush(pending)
+        with self._lock:
+            once, self._once = self._once, {}
+        for fn in once.values():
+            fn()
+
+    def _flush(self, pending):
+        for chat_id, texts in pending.items():
+            self.on_append(chat_id, "".join(texts))
+        pending.clear()
+
+    def _record(self, depth, elapsed):
+        self._frames += 1
+        self._depth_total += depth
+        self._max_depth = max(self._max_depth, depth)
+        self._frame_total += elapsed
+        self._max_frame = max(self._max_frame, elapsed)
+        if time.monotonic() >= self._report_at:
+            if self._events_done:
+                logger.info(
+                    f"界面更新统计 - 事件: {self._events_done}, 平均队列深度: {self._depth_total / self._frames:.1f}, "
+                    f"最大队列深度: {self._max_depth}, 平均帧耗时: {self._frame_total / self._frames * 1000:.2f} ms, "
+                    f"最大帧耗时: {self._max_frame * 1000:.2f} ms"
+                )
+            self._reset_stats()
+
+    def stats(self):
+        """当前统计周期内的队列深度与帧耗时"""
+        frames = max(1, self._frames)
+        return {
+            "queue_depth": len(self._events),
+            "avg_queue_depth": self._depth_total / frames,
+            "max_queue_depth": self._max_depth,
+            "avg_frame_ms": self._frame_total / frames * 1000,
+            "max_frame_ms": self._max_frame * 1000,
+        }